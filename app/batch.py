@@ -0,0 +1,361 @@
+"""Validation and round-trip checks of many PBCore documents in one request.
+
+Documents come from uploaded XML files or from zip and tar (optionally gzip,
+bzip2 or xz compressed) archives. Archive members are read one at a time
+straight from the upload; nothing is extracted to disk, and a member larger
+than PBCORE_MAX_UPLOAD_SIZE is reported as an error without being read into
+memory, however well it compresses. Documents are
+validated in parallel in the work pool with `core.validation_error`, the same
+check the single-document endpoint makes, and share its result cache. Their
+records can be added to the record index as they are validated (see
+`app.index`).
+
+Round-trip checks go a record at a time instead, so the records of a
+pbcoreCollection are checked in parallel too, in chunks of
+`ROUNDTRIP_CHUNK_SIZE` records per job.
+"""
+
+import asyncio
+import contextvars
+import io
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from lxml import etree
+
+from app import collection, core
+from app.cache import MISS, content_digest, result_cache, result_key
+from app.config import MAX_UPLOAD_SIZE
+from app.core import Engine
+from app.executor import Overloaded, work_pool
+from app.index import BATCH_SIZE, record_index, validation_entries
+
+COMPRESSION_MAGIC = (b"\x1f\x8b", b"BZh", b"\xfd7zXZ")
+# Records sent to a worker at a time by `roundtrip_documents`.
+ROUNDTRIP_CHUNK_SIZE = 50
+
+
+class Document(NamedTuple):
+    name: str
+    archive: str | None
+    content: bytes | None
+    error: str | None = None
+
+
+class Record(NamedTuple):
+    name: str
+    archive: str | None
+    identifier: str | None
+    content: bytes | None
+    error: str | None = None
+
+
+def iter_documents(uploads, max_size=None):
+    """Yield a `Document` for each XML file in a list of `(filename, file)`
+    uploads, looking inside archives. Archive members larger than `max_size`
+    (by default PBCORE_MAX_UPLOAD_SIZE) are yielded with an error instead of
+    their content."""
+    max_size = max_size or MAX_UPLOAD_SIZE
+    for filename, fileobj in uploads:
+        kind = archive_kind(fileobj)
+        if kind is None:
+            yield Document(filename, None, fileobj.read())
+            continue
+        try:
+            if kind == "zip":
+                yield from _zip_members(filename, fileobj, max_size)
+            else:
+                yield from _tar_members(filename, fileobj, max_size)
+        except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+            yield Document(filename, None, None, f"Archive Error: {e}")
+
+
+def archive_kind(fileobj):
+    head = fileobj.read(512)
+    fileobj.seek(0)
+    if head.startswith(b"PK\x03\x04"):
+        return "zip"
+    if head.startswith(COMPRESSION_MAGIC) or head[257:262] == b"ustar":
+        return "tar"
+    return None
+
+
+def _zip_members(filename, fileobj, max_size):
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if not info.is_dir() and _is_xml(info.filename):
+                if info.file_size > max_size:
+                    yield _too_large(info.filename, filename, max_size)
+                    continue
+                # Read no more than the maximum, whatever the archive says.
+                with archive.open(info) as member:
+                    yield _read_member(member, info.filename, filename, max_size)
+
+
+def _tar_members(filename, fileobj, max_size):
+    # Stream mode reads members in order, without seeking back, skipping
+    # whatever of a member isn't read.
+    with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+        for member in archive:
+            if member.isfile() and _is_xml(member.name):
+                if member.size > max_size:
+                    yield _too_large(member.name, filename, max_size)
+                    continue
+                yield _read_member(
+                    archive.extractfile(member), member.name, filename, max_size
+                )
+
+
+def _read_member(member, name, archive, max_size):
+    content = member.read(max_size + 1)
+    if len(content) > max_size:
+        return _too_large(name, archive, max_size)
+    return Document(name, archive, content)
+
+
+def _too_large(name, archive, max_size):
+    return Document(
+        name,
+        archive,
+        None,
+        f"Document Too Large: larger than the maximum of {max_size} bytes",
+    )
+
+
+def _is_xml(name):
+    basename = name.rpartition("/")[2]
+    return basename.lower().endswith(".xml") and not basename.startswith(".")
+
+
+async def validate_documents(documents, window=None, harvest=None):
+    """Validate documents in parallel, yielding a result dict for each one in
+    the order they finish.
+
+    At most `window` documents are validated (and held in memory) at once. If
+    the work pool is full before anything has started this raises
+    `Overloaded`; after that, the batch waits for room instead.
+
+    With `harvest`, the records of every document are also added to the
+    record index under that name (see `app.index`). Their entries come from
+    the same parse that validates them, so the result cache is not used.
+    """
+    jobs = _validation_jobs(documents, harvest)
+    entries = []
+    async for (index, document, key), result in fan_out(jobs, window):
+        error = result
+        if harvest and document.error is None:
+            error, found = result
+            entries += [
+                entry._replace(file=document.name, archive=document.archive)
+                for entry in found
+            ]
+            if len(entries) >= BATCH_SIZE:
+                await asyncio.to_thread(record_index.add, harvest, entries)
+                entries = []
+        if key is not None:
+            await asyncio.to_thread(result_cache.put, key, error)
+        yield _result(index, document, error)
+    if entries:
+        await asyncio.to_thread(record_index.add, harvest, entries)
+
+
+def _validation_jobs(documents, harvest=None):
+    for index, document in enumerate(documents):
+        if document.error is not None:
+            yield (index, document, None), None, document.error
+            continue
+        if harvest:
+            yield (index, document, None), validation_entries, (document.content,)
+            continue
+        key = None
+        if result_cache.enabled:
+            key, cached = _lookup(document.content)
+            if cached is not MISS:
+                yield (index, document, None), None, cached
+                continue
+        yield (index, document, key), core.validation_error, (document.content,)
+
+
+def _lookup(content):
+    key = result_key("validate", content_digest(content))
+    return key, result_cache.lookup(key)
+
+
+async def roundtrip_documents(
+    uploads, engine=Engine.xslt, window=None, chunk_size=ROUNDTRIP_CHUNK_SIZE
+):
+    """Round-trip check every record in a list of `(filename, file)` uploads
+    in parallel, yielding a result dict for each record in the order they
+    finish.
+
+    Records are sent to the work pool `chunk_size` at a time; otherwise this
+    works like `validate_documents`.
+    """
+    jobs = _roundtrip_jobs(iter_records(uploads), engine, chunk_size)
+    async for chunk, results in fan_out(jobs, window):
+        for (index, record), result in zip(chunk, results):
+            yield _roundtrip_result(index, record, result)
+
+
+def _roundtrip_jobs(records, engine, chunk_size):
+    chunk = []
+    for index, record in enumerate(records):
+        if record.error is not None:
+            yield [(index, record)], None, [{"error": record.error}]
+            continue
+        chunk.append((index, record))
+        if len(chunk) >= chunk_size:
+            yield _roundtrip_job(chunk, engine)
+            chunk = []
+    if chunk:
+        yield _roundtrip_job(chunk, engine)
+
+
+def _roundtrip_job(chunk, engine):
+    contents = [record.content for _, record in chunk]
+    # Only the results need the records' names, not their content.
+    chunk = [(index, record._replace(content=None)) for index, record in chunk]
+    return chunk, core.roundtrip_records, (contents, engine)
+
+
+async def fan_out(jobs, window=None):
+    """Run jobs in the work pool in parallel, yielding `(tag, result)` for each
+    one in the order they finish.
+
+    `jobs` is a blocking iterator of `(tag, fn, args)`, read in a thread of its
+    own: always the same one, as an lxml `iterparse` behind it must not move
+    between threads (its tree would mix up their string dictionaries). A job
+    whose `fn` is None needs no running, and its `args` is its result. At most
+    `window` jobs run (and are held in memory) at once. If the work pool is
+    full before anything has started this raises `Overloaded`; after that, it
+    waits for room instead.
+    """
+    window = window or work_pool.max_workers
+    jobs = iter(jobs)
+    loop = asyncio.get_running_loop()
+    reader = ThreadPoolExecutor(1, thread_name_prefix="fan-out")
+    context = contextvars.copy_context()
+    try:
+        in_flight = {}
+        started = False
+        exhausted = False
+        job = None
+        while True:
+            while not exhausted and len(in_flight) < window:
+                if job is None:
+                    job = await loop.run_in_executor(
+                        reader, context.run, next, jobs, None
+                    )
+                    if job is None:
+                        exhausted = True
+                        break
+                tag, fn, args = job
+                if fn is None:
+                    yield tag, args
+                    job, started = None, True
+                    continue
+                try:
+                    future = work_pool.submit(fn, *args)
+                except Overloaded:
+                    if not started:
+                        raise
+                    if in_flight:
+                        break
+                    await asyncio.sleep(work_pool.retry_after)
+                    continue
+                in_flight[future] = tag
+                job, started = None, True
+
+            if not in_flight:
+                if exhausted:
+                    return
+                continue
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                yield in_flight.pop(future), future.result()
+    finally:
+        reader.shutdown(wait=False)
+
+
+def iter_records(uploads):
+    """Yield a `Record` for each pbcoreDescriptionDocument in a list of
+    `(filename, file)` uploads, whether on its own or in a pbcoreCollection,
+    looking inside archives."""
+    for filename, fileobj in uploads:
+        if archive_kind(fileobj) is None:
+            # Read collections straight from the upload, a record at a time.
+            yield from _records(filename, None, fileobj)
+            continue
+        for document in iter_documents([(filename, fileobj)]):
+            if document.error is not None:
+                yield Record(
+                    document.name, document.archive, None, None, document.error
+                )
+            else:
+                yield from _records(
+                    document.name, document.archive, io.BytesIO(document.content)
+                )
+
+
+def _records(name, archive, source):
+    found = False
+    try:
+        for record in collection.iter_records(source):
+            found = True
+            yield Record(
+                name,
+                archive,
+                collection.record_identifier(record),
+                etree.tostring(record),
+            )
+    except etree.XMLSyntaxError as e:
+        yield Record(name, archive, None, None, f"XML Parsing Error: {e}")
+        return
+    if not found:
+        yield Record(name, archive, None, None, "No pbcoreDescriptionDocument found")
+
+
+def summarize(results, summary=None):
+    """Count valid and invalid results, adding to `summary` if given."""
+    summary = summary or {"files": 0, "valid": 0, "invalid": 0}
+    for result in results:
+        summary["files"] += 1
+        summary["valid" if result["valid"] else "invalid"] += 1
+    return summary
+
+
+def summarize_roundtrips(results, summary=None):
+    """Count lossless, lossy and unchecked records, adding to `summary` if
+    given."""
+    summary = summary or {"records": 0, "lossless": 0, "lossy": 0, "errors": 0}
+    for result in results:
+        summary["records"] += 1
+        if "error" in result:
+            summary["errors"] += 1
+        else:
+            summary["lossless" if result["lossless"] else "lossy"] += 1
+    return summary
+
+
+def _result(index, document, error):
+    result = {
+        "index": index,
+        "file": document.name,
+        "archive": document.archive,
+        "valid": error is None,
+    }
+    if error is not None:
+        result["error"] = error
+    return result
+
+
+def _roundtrip_result(index, record, result):
+    return {
+        "index": index,
+        "file": record.name,
+        "archive": record.archive,
+        "identifier": record.identifier,
+        **result,
+    }
@@ -0,0 +1,168 @@
+"""Cache of validation and conversion results, keyed by document content.
+
+Keys are a SHA-256 over the operation, the digests of the schema and stylesheet
+files it depends on, and the document bytes, so a result is never served for
+a different document, and editing the XSD or XSL invalidates everything derived
+from it without any explicit purge.
+
+Each worker keeps a bounded in-memory LRU. Optionally, results are also kept in
+a SQLite database that all workers on a host share; it is checked on a memory
+miss and trimmed to its own size, least recently used first.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from app.config import (
+    CACHE_DISK_SIZE,
+    CACHE_MAX_ITEM_SIZE,
+    CACHE_PATH,
+    CACHE_SIZE,
+    DERIVED_ELEMENT_TABLES,
+)
+from app.database import SharedDatabase
+from app.registry import schema_registry, stylesheet_registry
+
+MISS = object()
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS results"
+    " (key TEXT PRIMARY KEY, value TEXT, used REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS results_used ON results (used)",
+)
+
+
+def content_digest(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def result_key(operation, document_digest, version=None):
+    """Cache key for running `operation` on a document, which depends on the
+    PBCore schema, the xml-to-json stylesheet and the element tables it's
+    given."""
+    parts = [
+        operation,
+        schema_registry.digest(version),
+        stylesheet_registry.digest(),
+        "derived" if DERIVED_ELEMENT_TABLES else "legacy",
+        document_digest,
+    ]
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+class ResultCache:
+    """Two-tier LRU cache of results, keyed by `result_key`.
+
+    Results are strings, None, or anything else JSON can hold, which is stored
+    on disk as JSON in a BLOB so that it can be told apart from a string.
+    """
+
+    def __init__(self, size, path=None, disk_size=0, max_item_size=2**20):
+        self.size = size
+        self.path = path
+        self.disk_size = disk_size
+        self.max_item_size = max_item_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.db = SharedDatabase(path, SCHEMA) if path is not None else None
+        self._writes = 0
+
+    @property
+    def enabled(self):
+        return self.size > 0 or self.path is not None
+
+    def get(self, key):
+        """The cached result, or MISS. Only looks in memory."""
+        with self._lock:
+            value = self._memory.get(key, MISS)
+            if value is not MISS:
+                self._memory.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        stored = _encode(value)
+        if stored is not None and len(stored) > self.max_item_size:
+            return
+        self._remember(key, value)
+        self.put_disk(key, value)
+
+    def lookup(self, key):
+        """The cached result from memory or disk, or MISS. Blocking."""
+        value = self.get(key)
+        if value is MISS:
+            value = self.get_disk(key)
+            if value is not MISS:
+                self._remember(key, value)
+        return value
+
+    def get_disk(self, key):
+        if self.path is None:
+            return MISS
+        with self.db.connection() as db:
+            row = db.execute(
+                "SELECT value FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return MISS
+            db.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+            return _decode(row[0])
+
+    def put_disk(self, key, value):
+        if self.path is None:
+            return
+        with self.db.connection() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO results (key, value, used) VALUES (?, ?, ?)",
+                (key, _encode(value), time.time()),
+            )
+            self._writes += 1
+            # Trimming needs a count, so only do it now and then.
+            if self._writes % 100 == 0:
+                self._trim_disk(db)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self.path is not None:
+            with self.db.connection() as db:
+                db.execute("DELETE FROM results")
+
+    def _remember(self, key, value):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.size:
+                self._memory.popitem(last=False)
+
+    def _trim_disk(self, db):
+        (count,) = db.execute("SELECT count(*) FROM results").fetchone()
+        if count > self.disk_size:
+            db.execute(
+                "DELETE FROM results WHERE key IN"
+                " (SELECT key FROM results ORDER BY used LIMIT ?)",
+                (count - self.disk_size,),
+            )
+
+
+def _encode(value):
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value).encode()
+
+
+def _decode(stored):
+    if isinstance(stored, bytes):
+        return json.loads(stored)
+    return stored
+
+
+result_cache = ResultCache(
+    CACHE_SIZE,
+    path=CACHE_PATH,
+    disk_size=CACHE_DISK_SIZE,
+    max_item_size=CACHE_MAX_ITEM_SIZE,
+)
@@ -0,0 +1,427 @@
+"""Validate or convert PBCore documents on disk, without going through the API.
+
+    pbcore-util validate records/ more/*.xml batch.zip --report report.csv
+    pbcore-util convert records/ --out converted/
+
+Paths can be files, directories (searched recursively for .xml files, and
+.json files too when converting), glob patterns, or zip and tar archives
+(optionally gzip, bzip2 or xz compressed). Documents go through the same
+`app.core` functions as the API, in a pool of worker processes, `--chunk-size`
+documents per job. Workers read plain files themselves; archive members are
+read here and sent to them. At most two jobs per worker are in flight at once,
+so memory stays flat however many files there are.
+
+The report has a line for every document, in the order they finish, as JSON
+or CSV. Progress goes to stderr. The exit status is 1 if any document was
+invalid or couldn't be converted.
+
+Nothing here imports FastAPI or uvicorn, so the command starts quickly.
+"""
+
+import argparse
+import csv
+import fnmatch
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import nullcontext
+from typing import NamedTuple
+
+from app import batch, core
+from app.config import DEFAULT_PBCORE_VERSION, MAX_VALIDATION_ERRORS, XSD_PATHS
+from app.core import Engine
+from app.registry import schema_registry, stylesheet_registry
+
+ARCHIVE_PATTERNS = ("*.zip", "*.tar", "*.tar.gz", "*.tgz", "*.tar.bz2", "*.tar.xz")
+CHUNK_SIZE = 16
+# Seconds between progress lines when stderr isn't a terminal.
+PROGRESS_INTERVAL = 10
+
+
+class Item(NamedTuple):
+    """A document to handle: a file for the worker to read (`path`), or an
+    archive member already read (`content`)."""
+
+    name: str
+    archive: str | None
+    path: str | None
+    content: bytes | None
+    # Where its output goes, relative to --out.
+    relative: str
+    error: str | None = None
+
+
+def iter_items(paths, suffixes):
+    """Yield an `Item` for each document in `paths`, looking in directories
+    for files ending in one of `suffixes`, and inside archives."""
+    for path in paths:
+        if any(char in path for char in "*?["):
+            matches = sorted(glob.iglob(path, recursive=True))
+            if not matches:
+                yield Item(path, None, None, None, path, "No files match")
+            for match in matches:
+                yield from _path_items(match, os.path.basename(match), suffixes)
+        elif os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+                for name in sorted(files):
+                    if name.startswith(".") or not (
+                        name.lower().endswith(suffixes) or _is_archive(name)
+                    ):
+                        continue
+                    file_path = os.path.join(root, name)
+                    yield from _path_items(
+                        file_path, os.path.relpath(file_path, path), suffixes
+                    )
+        else:
+            yield from _path_items(path, os.path.basename(path), suffixes)
+
+
+def _path_items(path, relative, suffixes):
+    if os.path.isdir(path):
+        yield from iter_items([path], suffixes)
+    elif not _is_archive(path):
+        yield Item(path, None, path, None, relative)
+    else:
+        # Archive members go in a directory named after the archive.
+        prefix = relative.rpartition(".")[0].removesuffix(".tar")
+        try:
+            with open(path, "rb") as f:
+                for document in batch.iter_documents([(path, f)]):
+                    yield Item(
+                        document.name,
+                        document.archive,
+                        None,
+                        document.content,
+                        os.path.join(prefix, _safe_relative(document.name)),
+                        document.error,
+                    )
+        except OSError as e:
+            yield Item(path, None, None, None, relative, f"File Error: {e.strerror}")
+
+
+def _is_archive(name):
+    name = name.lower()
+    return any(fnmatch.fnmatch(name, pattern) for pattern in ARCHIVE_PATTERNS)
+
+
+def _safe_relative(name):
+    # Archive member names mustn't write outside --out.
+    parts = [part for part in name.split("/") if part not in ("", ".", "..")]
+    return os.path.join(*parts) if parts else "_"
+
+
+def _read(item):
+    if item.content is not None:
+        return item.content
+    with open(item.path, "rb") as f:
+        return f.read()
+
+
+def _init_worker():
+    # Compile the XSD and XSLT once per worker process rather than once per job.
+    schema_registry.load()
+    stylesheet_registry.load()
+
+
+def validate_chunk(chunk, version=None, all_errors=False, max_errors=None):
+    """Validate a list of `(index, Item)`, returning a result dict for each."""
+    return [
+        _validation_result(index, item, version, all_errors, max_errors)
+        for index, item in chunk
+    ]
+
+
+def _validation_result(index, item, version, all_errors, max_errors):
+    result = {"index": index, "file": item.name, "archive": item.archive}
+    error = item.error
+    if error is None:
+        try:
+            content = _read(item)
+        except OSError as e:
+            error = f"File Error: {e.strerror}"
+    if error is not None:
+        return {**result, "valid": False, "error": error}
+    if not all_errors:
+        error = core.validation_error(content, version)
+        if error is None:
+            return {**result, "valid": True}
+        return {**result, "valid": False, "error": error}
+    report = core.validation_report(
+        content, version, max_errors or MAX_VALIDATION_ERRORS
+    )
+    if report is None:
+        return {**result, "valid": True}
+    return {
+        **result,
+        "valid": False,
+        "error": report["message"],
+        "error_count": report["error_count"],
+        "errors": report["errors"],
+    }
+
+
+def convert_chunk(chunk, out, engine=Engine.xslt, validate=False):
+    """Convert a list of `(index, Item)` of XML documents to JSON and JSON
+    documents to XML, writing each under `out` and returning a result dict for
+    each."""
+    return [
+        _conversion_result(index, item, out, engine, validate) for index, item in chunk
+    ]
+
+
+def _conversion_result(index, item, out, engine, validate):
+    result = {"index": index, "file": item.name, "archive": item.archive}
+    if item.error is not None:
+        return {**result, "converted": False, "error": item.error}
+    to_xml = item.relative.lower().endswith(".json")
+    output = os.path.join(
+        out, os.path.splitext(item.relative)[0] + (".xml" if to_xml else ".json")
+    )
+    try:
+        content = _read(item)
+        # --validate checks the XML side: what was read, or what was written.
+        if to_xml:
+            converted = core.json_to_xml(content)
+            error = core.validation_error(converted) if validate else None
+        else:
+            pbcore_xml = core.parse_xml(content)
+            error = core.validation_error(pbcore_xml) if validate else None
+            if error is None:
+                converted = core.convert(pbcore_xml, engine).encode()
+        if error is not None:
+            return {**result, "converted": False, "error": error}
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        with open(output, "wb") as f:
+            f.write(converted)
+    except OSError as e:
+        return {**result, "converted": False, "error": f"File Error: {e.strerror}"}
+    except core.XMLParseError as e:
+        return {**result, "converted": False, "error": f"XML Parsing Error: {e}"}
+    except core.PBCoreError as e:
+        return {**result, "converted": False, "error": f"Conversion Error: {e}"}
+    return {**result, "converted": True, "output": output}
+
+
+def run(items, fn, args=(), workers=None, chunk_size=CHUNK_SIZE):
+    """Run `fn(chunk, *args)` over `items` in chunks of `chunk_size`, in a pool
+    of `workers` processes (or in this one if `workers` is 0), yielding each
+    result in the order the chunks finish."""
+    chunks = _chunks(enumerate(items), chunk_size)
+    if workers == 0:
+        for chunk in chunks:
+            yield from fn(chunk, *args)
+        return
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(workers, initializer=_init_worker)
+    try:
+        in_flight = set()
+        for chunk in chunks:
+            if len(in_flight) >= 2 * workers:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+            in_flight.add(executor.submit(fn, chunk, *args))
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class JSONReport:
+    """Writes `{"results": [...], "summary": {...}}` a result at a time."""
+
+    def __init__(self, f):
+        self.f = f
+        self.first = True
+        f.write('{"results": [')
+
+    def write(self, result):
+        self.f.write(("\n" if self.first else ",\n") + json.dumps(result))
+        self.first = False
+
+    def close(self, summary):
+        self.f.write(f'\n], "summary": {json.dumps(summary)}}}\n')
+
+
+class CSVReport:
+    """Writes a row per result; the summary only goes to stderr."""
+
+    def __init__(self, f, fields):
+        self.writer = csv.DictWriter(f, fields, extrasaction="ignore")
+        self.writer.writeheader()
+
+    def write(self, result):
+        if "errors" in result:
+            result = {
+                **result,
+                "error": "\n".join(_error_line(e) for e in result["errors"]),
+            }
+        self.writer.writerow(result)
+
+    def close(self, summary):
+        pass
+
+
+def _error_line(error):
+    where = f"line {error['line']}" if error["line"] else error["path"]
+    return f"{where}: {error['message']}" if where else error["message"]
+
+
+class Progress:
+    """Reports how many documents are done on stderr, rewriting one line on a
+    terminal or every `PROGRESS_INTERVAL` seconds otherwise."""
+
+    def __init__(self, verb, quiet=False):
+        self.verb = verb
+        self.quiet = quiet
+        self.tty = sys.stderr.isatty()
+        self.start = self.last = time.monotonic()
+
+    def update(self, summary):
+        now = time.monotonic()
+        if self.quiet or now - self.last < (0.2 if self.tty else PROGRESS_INTERVAL):
+            return
+        self.last = now
+        self._print(summary, "\r" if self.tty else "\n")
+
+    def finish(self, summary):
+        if not self.quiet:
+            self._print(summary, "\n")
+
+    def _print(self, summary, end):
+        counts = ", ".join(f"{value} {key}" for key, value in summary.items())
+        rate = next(iter(summary.values())) / max(time.monotonic() - self.start, 1e-9)
+        if end == "\r":
+            sys.stderr.write("\r\033[K")
+        sys.stderr.write(f"{self.verb} {counts} ({rate:.0f}/s)")
+        sys.stderr.write("" if end == "\r" else "\n")
+        sys.stderr.flush()
+
+
+def summarize_conversions(results, summary=None):
+    """Count converted and failed results, adding to `summary` if given."""
+    summary = summary or {"files": 0, "converted": 0, "failed": 0}
+    for result in results:
+        summary["files"] += 1
+        summary["converted" if result["converted"] else "failed"] += 1
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="pbcore-util", description=__doc__.splitlines()[0]
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    validate_parser = subparsers.add_parser(
+        "validate", help="Validate PBCore XML documents"
+    )
+    validate_parser.add_argument(
+        "--all-errors",
+        action="store_true",
+        help="Report every XSD error of a document, not just the first",
+    )
+    validate_parser.add_argument(
+        "--max-errors", type=int, default=MAX_VALIDATION_ERRORS
+    )
+    validate_parser.add_argument(
+        "--pbcore-version", choices=XSD_PATHS, default=DEFAULT_PBCORE_VERSION
+    )
+
+    convert_parser = subparsers.add_parser(
+        "convert", help="Convert PBCore XML to JSON, and JSON to XML"
+    )
+    convert_parser.add_argument("--out", required=True, help="Directory to write to")
+    convert_parser.add_argument(
+        "--engine", choices=[engine.value for engine in Engine], default="xslt"
+    )
+    convert_parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="Don't write documents whose XML doesn't validate",
+    )
+
+    for subparser in (validate_parser, convert_parser):
+        subparser.add_argument(
+            "paths", nargs="+", help="Files, directories, globs or archives"
+        )
+        subparser.add_argument(
+            "--workers",
+            type=int,
+            help="Worker processes (default: CPU count; 0 runs in this process)",
+        )
+        subparser.add_argument(
+            "--chunk-size", type=int, default=CHUNK_SIZE, help="Documents per job"
+        )
+        subparser.add_argument(
+            "--report", default="-", help="Write the report here, not to stdout"
+        )
+        subparser.add_argument(
+            "--format",
+            choices=["json", "csv"],
+            help="Report format (default: from --report's extension, else json)",
+        )
+        subparser.add_argument(
+            "--quiet", action="store_true", help="Don't show progress"
+        )
+
+    args = parser.parse_args(argv)
+    if args.command == "validate":
+        items = iter_items(args.paths, (".xml",))
+        fn, fn_args = validate_chunk, (
+            args.pbcore_version,
+            args.all_errors,
+            args.max_errors,
+        )
+        summarize, verb = batch.summarize, "Validated"
+        fields = ["index", "file", "archive", "valid", "error_count", "error"]
+        succeeded = "valid"
+    else:
+        items = iter_items(args.paths, (".xml", ".json"))
+        fn, fn_args = convert_chunk, (args.out, Engine(args.engine), args.validate)
+        summarize, verb = summarize_conversions, "Converted"
+        fields = ["index", "file", "archive", "converted", "output", "error"]
+        succeeded = "converted"
+
+    report_format = args.format or (
+        "csv" if args.report.lower().endswith(".csv") else "json"
+    )
+    output = (
+        nullcontext(sys.stdout)
+        if args.report == "-"
+        else open(args.report, "w", newline="")
+    )
+    with output as f:
+        report = JSONReport(f) if report_format == "json" else CSVReport(f, fields)
+        progress = Progress(verb, args.quiet)
+        summary = summarize([])
+        failed = False
+        for result in run(items, fn, fn_args, args.workers, args.chunk_size):
+            report.write(result)
+            summarize([result], summary)
+            failed = failed or not result[succeeded]
+            progress.update(summary)
+        report.close(summary)
+        progress.finish(summary)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""Streaming validation and conversion of pbcoreCollection documents.
+
+A collection is read with `etree.iterparse` one pbcoreDescriptionDocument at a
+time. Each record is validated or converted on its own and then freed, so
+memory use doesn't grow with the size of the collection. Results come out as
+NDJSON, one line per record, in chunks of `BATCH_SIZE` lines.
+
+Validated records can be added to the record index as they go (see
+`app.index`).
+
+Fields are extracted from each record the same way (see `app.projection`),
+dropping the parts of records that aren't wanted as they are read.
+
+Going the other way, NDJSON with one PBCore JSON document per line is turned
+into a pbcoreCollection a record at a time, in chunks of `BATCH_SIZE` records.
+"""
+
+import json
+from contextlib import nullcontext
+
+from lxml import etree
+
+from app import core
+from app import json_to_xml as json_xml
+from app.core import Engine
+from app.elements import element_tables
+from app.index import IndexBuffer, record_entry, record_index
+from app.metrics import stage
+from app.projection import compile_projection
+from app.registry import schema_registry
+
+PBCORE_NS = "http://www.pbcore.org/PBCore/PBCoreNamespace.html"
+RECORD_TAG = f"{{{PBCORE_NS}}}pbcoreDescriptionDocument"
+BATCH_SIZE = 100
+
+
+def iter_records(source, keep=None):
+    """Yield each pbcoreDescriptionDocument in a collection, freeing each one
+    (and anything before it) once the caller is done with it.
+
+    With `keep`, a set of element names, the record's other children are left
+    out of it, each freed as soon as it has been parsed.
+    """
+    tags = [RECORD_TAG]
+    if keep is not None:
+        top_level = element_tables().child_order["pbcoreDescriptionDocument"]
+        tags += [f"{{{PBCORE_NS}}}{name}" for name in top_level if name not in keep]
+    for _, record in etree.iterparse(source, events=("end",), tag=tags):
+        if record.tag != RECORD_TAG:
+            # The same names can appear further down, e.g. in a pbcorePart.
+            parent = record.getparent()
+            if parent is not None and parent.tag == RECORD_TAG:
+                parent.remove(record)
+            continue
+        yield record
+        record.clear(keep_tail=True)
+        parent = record.getparent()
+        while record.getprevious() is not None:
+            del parent[0]
+
+
+def record_identifier(record):
+    return record.findtext(f"{{{PBCORE_NS}}}pbcoreIdentifier")
+
+
+def validate_collection(source, harvest=None, version=None, batch_size=BATCH_SIZE):
+    """Validate each record of a collection.
+
+    Yields one line per record, then a summary line. With `harvest`, the
+    records are also added to the record index under that name (see
+    `app.index`).
+    """
+    return _ndjson(_validation_lines(source, version, harvest), batch_size)
+
+
+def convert_collection(
+    source, engine=Engine.xslt, validate=False, version=None, batch_size=BATCH_SIZE
+):
+    """Convert each record of a collection to PBCore JSON.
+
+    Yields one JSON document per record. With `validate`, records that don't
+    validate are reported instead of converted.
+    """
+    return _ndjson(_conversion_lines(source, engine, validate, version), batch_size)
+
+
+def project_collection(source, paths, version=None, batch_size=BATCH_SIZE):
+    """Extract the fields at `paths` from each record of a collection.
+
+    Yields one JSON object per record, with a list of what was found at each
+    path.
+    """
+    return _ndjson(_projection_lines(source, paths, version), batch_size)
+
+
+def json_to_xml_collection(source, batch_size=BATCH_SIZE):
+    """Convert NDJSON, one PBCore JSON document per line, to a pbcoreCollection.
+
+    Yields the XML in chunks. A line that isn't a PBCore JSON document is left
+    out of the collection, with an XML comment in its place saying why.
+    """
+    tables = element_tables()
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<pbcoreCollection xmlns="{PBCORE_NS}">'
+    ).encode()
+    chunks = []
+    records = (line for line in source if line.strip())
+    for index, line in enumerate(records):
+        # Each record is written on its own, so that a bad one leaves no trace.
+        out = json_xml.OutputBuffer()
+        try:
+            with etree.xmlfile(out, encoding="UTF-8") as xf:
+                json_xml.write_record(
+                    xf, json_xml.record(json.loads(line)), tables, json_xml.NSMAP
+                )
+            chunks.append(out.drain())
+        except RecursionError:
+            chunks.append(
+                f"<!-- Record {index} not converted: nested too deeply -->".encode()
+            )
+        except ValueError as e:
+            message = str(e).replace("--", "- -").rstrip("-")
+            chunks.append(f"<!-- Record {index} not converted: {message} -->".encode())
+        if len(chunks) >= batch_size:
+            yield b"".join(chunks)
+            chunks = []
+    chunks.append(b"</pbcoreCollection>\n")
+    yield b"".join(chunks)
+
+
+def _validation_lines(source, version, harvest=None):
+    summary = {"records": 0, "valid": 0, "invalid": 0}
+    buffer = IndexBuffer(record_index, harvest) if harvest else nullcontext()
+    with schema_registry.validator(version) as pbcore_schema, buffer:
+        try:
+            for index, record in enumerate(iter_records(source)):
+                result = _validate_record(pbcore_schema, index, record)
+                if harvest:
+                    buffer.add([record_entry(record, index, result["valid"])])
+                summary["records"] += 1
+                summary["valid" if result["valid"] else "invalid"] += 1
+                yield json.dumps(result)
+        except etree.XMLSyntaxError as e:
+            yield json.dumps({"error": f"XML Parsing Error: {e}"})
+    yield json.dumps({"summary": summary})
+
+
+def _conversion_lines(source, engine, validate, version):
+    validator = schema_registry.validator(version) if validate else nullcontext()
+    with validator as pbcore_schema:
+        try:
+            for index, record in enumerate(iter_records(source)):
+                if validate:
+                    result = _validate_record(pbcore_schema, index, record)
+                    if not result["valid"]:
+                        yield json.dumps(result)
+                        continue
+                yield core.convert(record, engine)
+        except etree.XMLSyntaxError as e:
+            yield json.dumps({"error": f"XML Parsing Error: {e}"})
+
+
+def _projection_lines(source, paths, version):
+    projection = compile_projection(paths, version)
+    try:
+        for record in iter_records(source, keep=projection.top_level):
+            yield projection.extract(record)
+    except etree.XMLSyntaxError as e:
+        yield json.dumps({"error": f"XML Parsing Error: {e}"})
+
+
+def _validate_record(pbcore_schema, index, record):
+    result = {"index": index, "identifier": record_identifier(record)}
+    try:
+        with stage("validate"):
+            pbcore_schema.assertValid(record)
+        result["valid"] = True
+    except etree.DocumentInvalid as e:
+        result["valid"] = False
+        result["error"] = f"PBCore XML Validation Error: {e}"
+    return result
+
+
+def _ndjson(lines, batch_size):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= batch_size:
+            yield ("\n".join(batch) + "\n").encode()
+            batch = []
+    if batch:
+        yield ("\n".join(batch) + "\n").encode()
@@ -0,0 +1,125 @@
+import os
+import tempfile
+from pathlib import Path
+
+# The schemas and stylesheets are beside the package in a checkout, and inside
+# it once installed.
+PACKAGE_DIR = Path(__file__).resolve().parent
+BASE_DIR = PACKAGE_DIR if (PACKAGE_DIR / "schemas").is_dir() else PACKAGE_DIR.parent
+
+# PBCore XSD files, keyed by PBCore version.
+XSD_PATHS = {
+    "2.1": str(BASE_DIR / "schemas/pbcore-2.1.xsd"),
+}
+DEFAULT_PBCORE_VERSION = "2.1"
+XSD_PATH = XSD_PATHS[DEFAULT_PBCORE_VERSION]
+XSL_PATH = str(BASE_DIR / "stylesheets/pbcore-xml-to-json.xsl")
+# PBCore JSON Schemas, generated from the XSDs by app/json_schema.py.
+JSON_SCHEMA_PATHS = {
+    "2.1": str(BASE_DIR / "schemas/pbcore-schema.json"),
+}
+JSON_SCHEMA_PATH = JSON_SCHEMA_PATHS[DEFAULT_PBCORE_VERSION]
+
+# Blocking XML work runs in a bounded pool off the event loop: "thread" or
+# "process" mode, how many jobs run at once, how many more may wait, and the
+# Retry-After (seconds) sent with a 503 when the queue is full. A few more
+# threads than cores keeps small documents from queueing behind large ones.
+WORK_POOL_MODE = os.environ.get("PBCORE_WORK_POOL_MODE", "thread")
+WORK_POOL_SIZE = int(
+    os.environ.get("PBCORE_WORK_POOL_SIZE", str(min(32, (os.cpu_count() or 1) + 4)))
+)
+WORK_QUEUE_SIZE = int(os.environ.get("PBCORE_WORK_QUEUE_SIZE", str(4 * WORK_POOL_SIZE)))
+RETRY_AFTER = int(os.environ.get("PBCORE_RETRY_AFTER", "1"))
+# Uploads and fetches are parsed as they arrive, each in a thread of its own
+# outside the pool, since they mostly wait on the network. This many at once,
+# beyond which requests are rejected with a 503 too.
+FEED_POOL_SIZE = int(
+    os.environ.get("PBCORE_FEED_POOL_SIZE", str(WORK_POOL_SIZE + WORK_QUEUE_SIZE))
+)
+
+# Maximum number of compiled validators kept per schema (XSD and JSON Schema),
+# and of compiled transforms kept per stylesheet. Each one is only used by a
+# single job at a time, so there is no point in having more than there are
+# work pool threads.
+SCHEMA_POOL_SIZE = int(os.environ.get("PBCORE_SCHEMA_POOL_SIZE", str(WORK_POOL_SIZE)))
+JSON_SCHEMA_POOL_SIZE = int(
+    os.environ.get("PBCORE_JSON_SCHEMA_POOL_SIZE", str(WORK_POOL_SIZE))
+)
+XSLT_POOL_SIZE = int(os.environ.get("PBCORE_XSLT_POOL_SIZE", str(WORK_POOL_SIZE)))
+
+# Most XSD errors reported for one document by the all_errors validation mode.
+MAX_VALIDATION_ERRORS = int(os.environ.get("PBCORE_MAX_VALIDATION_ERRORS", "100"))
+
+# Fetching documents from URLs: request timeout (seconds), connection pool
+# limits, whether to use HTTP/2 (needs the h2 package), the largest document,
+# in bytes, that will be downloaded, and how many URLs' ETag/Last-Modified to
+# remember for conditional requests.
+HTTP_TIMEOUT = float(os.environ.get("PBCORE_HTTP_TIMEOUT", "10"))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("PBCORE_HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.environ.get("PBCORE_HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")
+)
+HTTP2 = os.environ.get("PBCORE_HTTP2", "false").lower() in ("1", "true", "yes")
+MAX_DOCUMENT_SIZE = int(os.environ.get("PBCORE_MAX_DOCUMENT_SIZE", str(100 * 2**20)))
+HTTP_VALIDATORS_SIZE = int(os.environ.get("PBCORE_HTTP_VALIDATORS_SIZE", "10000"))
+
+# Largest XML document accepted as an upload by the single-document endpoints,
+# once decompressed if it was gzipped. Larger ones get a 413.
+MAX_UPLOAD_SIZE = int(os.environ.get("PBCORE_MAX_UPLOAD_SIZE", str(MAX_DOCUMENT_SIZE)))
+
+# Validation and conversion results cached by document content: entries kept
+# in memory per worker (0 turns the memory tier off), the largest result (in
+# bytes) worth caching, and an optional SQLite file shared by all workers with
+# the number of entries it keeps.
+CACHE_SIZE = int(os.environ.get("PBCORE_CACHE_SIZE", "1024"))
+CACHE_MAX_ITEM_SIZE = int(os.environ.get("PBCORE_CACHE_MAX_ITEM_SIZE", str(2**20)))
+CACHE_PATH = os.environ.get("PBCORE_CACHE_PATH") or None
+CACHE_DISK_SIZE = int(os.environ.get("PBCORE_CACHE_DISK_SIZE", "100000"))
+
+# Validation sessions (see app/sessions.py): sessions kept in memory per worker,
+# seconds a session may sit unused before it expires, and an optional SQLite
+# file shared by all workers, which lets any worker carry on with any session.
+SESSION_SIZE = int(os.environ.get("PBCORE_SESSION_SIZE", "100"))
+SESSION_TTL = float(os.environ.get("PBCORE_SESSION_TTL", "3600"))
+SESSION_PATH = os.environ.get("PBCORE_SESSION_PATH") or None
+
+# Background jobs (see app/jobs.py): the directory holding their uploads,
+# results and state, shared by all workers on the host; jobs run at once and
+# queued per worker; and seconds a finished job's result is kept.
+JOB_DIR = os.environ.get("PBCORE_JOB_DIR") or os.path.join(
+    tempfile.gettempdir(), "pbcore-jobs"
+)
+JOB_WORKERS = int(os.environ.get("PBCORE_JOB_WORKERS", "1"))
+JOB_QUEUE_SIZE = int(os.environ.get("PBCORE_JOB_QUEUE_SIZE", "100"))
+JOB_TTL = float(os.environ.get("PBCORE_JOB_TTL", "86400"))
+
+# The record index (see app/index.py): a SQLite file of the identifiers, titles
+# and content hashes of the records validated into it, shared by all workers.
+INDEX_PATH = os.environ.get("PBCORE_INDEX_PATH") or os.path.join(
+    tempfile.gettempdir(), "pbcore-index.sqlite3"
+)
+
+# Send each request's stage timings (parse, validate, transform, ...) in a
+# Server-Timing header.
+SERVER_TIMING = os.environ.get("PBCORE_SERVER_TIMING", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+# Convert XML to JSON with the element tables derived from the XSD rather than
+# the stylesheet's original lists (see app/elements.py), so that every element
+# the XSD lets repeat becomes an array. This changes the JSON of some documents;
+# regenerate the JSON Schema with it set (`python -m app.json_schema`).
+DERIVED_ELEMENT_TABLES = os.environ.get(
+    "PBCORE_DERIVED_ELEMENT_TABLES", "false"
+).lower() in ("1", "true", "yes")
+
+# Conversion responses are sent as the converter wrote them, without parsing
+# them first. Set this to parse each one before sending it anyway, as a check
+# (with orjson if it's installed).
+VERIFY_JSON = os.environ.get("PBCORE_VERIFY_JSON", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
@@ -0,0 +1,306 @@
+"""Blocking PBCore operations shared by the API endpoints.
+
+Everything here is synchronous and CPU-bound, and is meant to be run in the
+work pool (see `app.executor`). Errors are raised as plain exceptions carrying
+a message, so they survive being sent back from a worker process.
+"""
+
+import copy
+import hashlib
+import json
+from enum import Enum
+
+from lxml import etree
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from app import json_to_xml as json_xml
+from app import native
+from app import roundtrip as roundtrip_check
+from app.config import MAX_VALIDATION_ERRORS
+from app.elements import element_tables
+from app.metrics import stage
+from app.registry import json_schema_registry, schema_registry, stylesheet_registry
+
+
+class Engine(str, Enum):
+    """How to convert PBCore XML to JSON."""
+
+    xslt = "xslt"
+    native = "native"
+
+
+class PBCoreError(Exception):
+    pass
+
+
+class XMLParseError(PBCoreError):
+    """The document is not well-formed XML."""
+
+
+class DocumentInvalid(PBCoreError):
+    """The document does not conform to the PBCore XSD."""
+
+
+class JSONParseError(PBCoreError):
+    """The document is not valid JSON."""
+
+
+class JSONConversionError(PBCoreError):
+    """The JSON is not shaped like PBCore JSON, so can't be converted to XML."""
+
+
+def parse_xml(source, parser=None):
+    """Parse XML from bytes or a file-like object. Already parsed documents are
+    returned as they are."""
+    if isinstance(source, (etree._Element, etree._ElementTree)):
+        return source
+    try:
+        with stage("parse"):
+            if isinstance(source, bytes):
+                return etree.fromstring(source, parser)
+            return etree.parse(source, parser)
+    except etree.XMLSyntaxError as e:
+        raise XMLParseError(str(e)) from e
+
+
+def validate_xml(source, version=None):
+    pbcore_xml = parse_xml(source)
+    with schema_registry.validator(version) as pbcore_schema, stage("validate"):
+        try:
+            pbcore_schema.assertValid(pbcore_xml)
+        except etree.DocumentInvalid as e:
+            raise DocumentInvalid(str(e)) from e
+
+
+def validation_error(source, version=None):
+    """Validate a document, returning why it is invalid, or None if it's valid."""
+    try:
+        validate_xml(source, version)
+    except DocumentInvalid as e:
+        return f"PBCore XML Validation Error: {e}"
+    except XMLParseError as e:
+        return f"XML Parsing Error: {e}"
+    return None
+
+
+def is_valid(source, version=None):
+    """Whether a document is well-formed and valid, and nothing more: no error
+    messages are formatted."""
+    try:
+        pbcore_xml = parse_xml(source)
+    except XMLParseError:
+        return False
+    with schema_registry.validator(version) as pbcore_schema, stage("validate"):
+        return pbcore_schema.validate(pbcore_xml)
+
+
+def validation_report(source, version=None, limit=MAX_VALIDATION_ERRORS):
+    """Validate a document, returning None if it's valid, or else every error
+    found by a single pass of the XSD (at most `limit` of them) as a dict
+    saying where it is and what it is."""
+    # The parser's own log, unlike the exception's, holds only its errors.
+    parser = etree.XMLParser()
+    try:
+        pbcore_xml = parse_xml(source, parser)
+    except XMLParseError:
+        return _report("XML Parsing Error", parser.error_log, None, limit)
+    with schema_registry.validator(version) as pbcore_schema, stage("validate"):
+        if pbcore_schema.validate(pbcore_xml):
+            return None
+        return _report(
+            "PBCore XML Validation Error", pbcore_schema.error_log, pbcore_xml, limit
+        )
+
+
+def parse_error_report(error):
+    """A `validation_report` for an `XMLParseError` raised by parsing elsewhere,
+    e.g. while downloading."""
+    cause = error.__cause__
+    error_log = getattr(cause, "error_log", None)
+    entry = error_log.last_error if error_log is not None else None
+    # An error lxml raises without logging it, e.g. for an empty document,
+    # comes with whatever the thread's log last held, so check it's the same.
+    if (
+        entry is not None
+        and entry.line == cause.lineno
+        and cause.msg.startswith(entry.message)
+    ):
+        details = _log_entry(entry, None)
+    else:
+        details = {
+            "line": None,
+            "column": None,
+            "path": None,
+            "domain": None,
+            "type": None,
+            "message": str(error),
+        }
+    return {"message": "XML Parsing Error", "error_count": 1, "errors": [details]}
+
+
+def _report(message, error_log, pbcore_xml, limit):
+    entries = error_log.filter_from_errors()
+    return {
+        "message": message,
+        "error_count": len(entries),
+        "errors": [_log_entry(entry, pbcore_xml) for entry in entries[:limit]],
+    }
+
+
+def _log_entry(entry, pbcore_xml):
+    path = entry.path
+    if path and pbcore_xml is not None:
+        # libxml2 gives paths like /*/*[8]/*[2]; name the elements instead.
+        nodes = pbcore_xml.xpath(path)
+        if nodes and isinstance(nodes[0], etree._Element):
+            path = element_path(nodes[0])
+    return {
+        "line": entry.line or None,
+        "column": entry.column or None,
+        "path": path,
+        "domain": entry.domain_name,
+        "type": entry.type_name,
+        "message": entry.message,
+    }
+
+
+def element_path(element):
+    """An element's path by name, with its position among siblings of the same
+    name, e.g. /pbcoreDescriptionDocument/pbcoreTitle[2]."""
+    steps = []
+    parent = element.getparent()
+    while parent is not None:
+        position = sum(1 for _ in element.itersiblings(element.tag, preceding=True))
+        steps.append(f"{etree.QName(element).localname}[{position + 1}]")
+        element, parent = parent, parent.getparent()
+    steps.append(etree.QName(element).localname)
+    return "/" + "/".join(reversed(steps))
+
+
+def canonical_digest(pbcore_xml):
+    """The SHA-256 of a parsed document's root element (or any element) as
+    canonical XML (exclusive C14N), the same whatever the document's
+    formatting of it, or what document it is in."""
+    if isinstance(pbcore_xml, etree._ElementTree):
+        pbcore_xml = pbcore_xml.getroot()
+    return hashlib.sha256(
+        etree.tostring(pbcore_xml, method="c14n", exclusive=True)
+    ).hexdigest()
+
+
+def parse_json(source):
+    """Parse JSON from bytes, a string or a binary file-like object."""
+    try:
+        if not isinstance(source, (bytes, str)):
+            source = source.read()
+        with stage("parse"):
+            return json.loads(source)
+    except ValueError as e:
+        raise JSONParseError(str(e)) from e
+    except RecursionError as e:
+        raise JSONParseError("JSON is nested too deeply") from e
+
+
+def json_validation_errors(source, version=None):
+    """Validate a PBCore JSON document against the JSON Schema, returning every
+    error found as a dict with the JSON pointer to where it is, or an empty list
+    if the document is valid."""
+    document = parse_json(source)
+    with json_schema_registry.validator(version) as validator, stage("validate"):
+        errors = sorted(validator.iter_errors(document), key=lambda e: list(e.path))
+        return [
+            {
+                "pointer": json_pointer(error.absolute_path),
+                "message": error.message,
+                "keyword": error.validator,
+            }
+            for error in errors
+        ]
+
+
+def json_pointer(path):
+    """RFC 6901 JSON pointer for a sequence of keys and indexes."""
+    return "".join(
+        "/" + str(part).replace("~", "~0").replace("/", "~1") for part in path
+    )
+
+
+def xml_to_json(source, engine=Engine.xslt):
+    """Convert a PBCore XML document to a PBCore JSON string."""
+    return convert(parse_xml(source), engine)
+
+
+def convert(pbcore_xml, engine=Engine.xslt):
+    """Convert a parsed PBCore document, or a single record element, to a PBCore
+    JSON string.
+
+    Both engines produce identical output from the same element tables.
+    """
+    tables = element_tables()
+    if engine == Engine.native:
+        with stage("transform"):
+            return escape_controls(native.xml_to_json(pbcore_xml, tables))
+    if isinstance(pbcore_xml, etree._Element) and pbcore_xml.getparent() is not None:
+        # lxml's XSLT can crash on an element that isn't the root of its
+        # document, e.g. a record in a collection, so transform a copy.
+        pbcore_xml = copy.deepcopy(pbcore_xml)
+    with stylesheet_registry.transform() as transform, stage("transform"):
+        return escape_controls(str(transform(pbcore_xml, **tables.xslt_params)))
+
+
+# Tabs, newlines and carriage returns can reach attribute values as character
+# references, and neither engine escapes them. They are the only control
+# characters XML allows, and the engines write no whitespace between tokens,
+# so any of them are inside strings.
+CONTROL_ESCAPES = {ord("\t"): "\\t", ord("\n"): "\\n", ord("\r"): "\\r"}
+
+
+def escape_controls(json_str):
+    if "\n" in json_str or "\t" in json_str or "\r" in json_str:
+        return json_str.translate(CONTROL_ESCAPES)
+    return json_str
+
+
+def check_json(content):
+    """Raise `ValueError` unless `content` is well-formed JSON. Uses orjson if
+    it's installed, which is several times faster than the json module."""
+    if orjson is not None:
+        orjson.loads(content)
+    else:
+        json.loads(content)
+
+
+def json_to_xml(source):
+    """Convert a PBCore JSON document to PBCore XML bytes."""
+    document = parse_json(source)
+    try:
+        with stage("transform"):
+            return json_xml.json_to_xml(document, element_tables())
+    except json_xml.ConversionError as e:
+        raise JSONConversionError(str(e)) from e
+
+
+def roundtrip(source, engine=Engine.xslt):
+    """Convert a PBCore XML document to JSON and back to XML, and compare the
+    result with the original (see `app.roundtrip`)."""
+    pbcore_xml = parse_xml(source, etree.XMLParser(remove_blank_text=True))
+    roundtripped = etree.fromstring(json_to_xml(convert(pbcore_xml, engine)))
+    return roundtrip_check.compare(pbcore_xml, roundtripped)
+
+
+def roundtrip_records(records, engine=Engine.xslt):
+    """`roundtrip` each of a list of documents, so that a batch of records can
+    be checked in one job. A record that can't be checked gets an "error"."""
+    results = []
+    for record in records:
+        try:
+            results.append(roundtrip(record, engine))
+        except XMLParseError as e:
+            results.append({"error": f"XML Parsing Error: {e}"})
+        except PBCoreError as e:
+            results.append({"error": f"Round-trip Error: {e}"})
+    return results
@@ -0,0 +1,66 @@
+"""SQLite databases shared by every worker on a host.
+
+The result cache, validation sessions, background jobs and the record index
+each keep their state in a SQLite file that every worker process opens. They
+all open it the same way, with `SharedDatabase`: a connection per process, in
+WAL mode so that readers don't wait for a writer, and `BEGIN IMMEDIATE` write
+transactions, which take the write lock up front rather than failing halfway
+when another process holds it.
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class SharedDatabase:
+    """A SQLite database at `path`, with the tables and indexes the `schema`
+    statements create if they don't exist yet.
+
+    A process has one connection, which its threads take turns with. All
+    methods block.
+    """
+
+    def __init__(self, path, schema=()):
+        self.path = path
+        self.schema = tuple(schema)
+        self._db = None
+        self._db_pid = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        """The connection, for this thread alone until the block ends. Each
+        statement commits by itself."""
+        with self._lock:
+            yield self._connect()
+
+    @contextmanager
+    def transaction(self):
+        """The connection in a write transaction, committed when the block
+        ends or rolled back if it raises."""
+        with self._lock:
+            db = self._connect()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    def _connect(self):
+        # Connections must not be shared with a forked child, e.g. a gunicorn
+        # worker forked from a master that preloaded the app.
+        if self._db is None or self._db_pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(
+                self.path, timeout=10, isolation_level=None, check_same_thread=False
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            for statement in self.schema:
+                db.execute(statement)
+            self._db, self._db_pid = db, os.getpid()
+        return self._db
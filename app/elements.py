@@ -0,0 +1,200 @@
+"""PBCore element tables derived from the XSD.
+
+The XML-to-JSON conversion needs to know which elements are repeatable (and so
+become JSON arrays) and which have sub-elements (and so get no "text" key).
+Converting back to XML also needs the order the XSD puts each element's
+children in. All of it is read off the schema, so it can't drift from it.
+
+Except, by default, which elements are repeatable or have sub-elements: the
+conversion uses the lists the stylesheet has always had, read from the defaults
+of its parameters, so that its JSON stays the same. They miss elements the XSD lets repeat, e.g. instantiationLanguage,
+instantiationRights and pbcoreRightsSummary, of which only the first is
+converted. PBCORE_DERIVED_ELEMENT_TABLES switches to the XSD's, making those
+arrays.
+"""
+
+from dataclasses import dataclass, field
+from functools import cached_property, lru_cache
+
+from lxml import etree
+
+from app.config import DERIVED_ELEMENT_TABLES, XSL_PATH
+from app.registry import schema_registry
+
+XSD = "{http://www.w3.org/2001/XMLSchema}"
+XSLT_NS = {"xsl": "http://www.w3.org/1999/XSL/Transform"}
+PARTICLES = {XSD + "sequence", XSD + "choice", XSD + "all", XSD + "group"}
+
+
+@dataclass(frozen=True)
+class ElementTables:
+    repeatable: frozenset
+    with_sub_elements: frozenset
+    # Element name -> its child element names, in XSD sequence order.
+    child_order: dict = field(default_factory=dict, compare=False)
+    # Element name -> the names of the attributes it may have, in XSD order.
+    attributes: dict = field(default_factory=dict, compare=False)
+
+    @cached_property
+    def xslt_params(self):
+        """The tables as parameters for the xml-to-json stylesheet."""
+        return {
+            "repeatable": _strparam(self.repeatable),
+            "with-sub-elements": _strparam(self.with_sub_elements),
+        }
+
+
+def element_tables(version=None, derived=None):
+    """Element tables for a PBCore version, recomputed if its XSD changes.
+
+    With `derived` (by default, DERIVED_ELEMENT_TABLES), which elements are
+    repeatable or have sub-elements comes from the XSD too.
+    """
+    version = version or schema_registry.default
+    if derived is None:
+        derived = DERIVED_ELEMENT_TABLES
+    return _element_tables(
+        schema_registry.paths[version], schema_registry.digest(version), derived
+    )
+
+
+@lru_cache(maxsize=8)
+def _element_tables(path, digest, derived):
+    return derive_element_tables(etree.parse(path).getroot(), derived)
+
+
+def derive_element_tables(xsd, derived=None):
+    complex_types = {
+        complex_type.get("name"): complex_type
+        for complex_type in xsd.iterfind(XSD + "complexType")
+    }
+    global_elements = {
+        element.get("name"): element for element in xsd.iterfind(XSD + "element")
+    }
+    attribute_groups = {
+        group.get("name"): group for group in xsd.iterfind(XSD + "attributeGroup")
+    }
+
+    repeatable = set()
+    with_sub_elements = set()
+    child_order = {}
+    attributes = {}
+    for element in xsd.iter(XSD + "element"):
+        name = element.get("name") or local_name(element.get("ref"))
+        max_occurs = element.get("maxOccurs", "1")
+        if max_occurs == "unbounded" or int(max_occurs) > 1:
+            repeatable.add(name)
+        declaration = global_elements.get(name) if element.get("ref") else element
+        if declaration is None:
+            continue
+        complex_type = _type_of(declaration, complex_types)
+        if complex_type is not None:
+            names = attributes.setdefault(name, [])
+            for attribute in _attribute_names(
+                complex_type, complex_types, attribute_groups
+            ):
+                if attribute not in names:
+                    names.append(attribute)
+        if has_element_content(complex_type, complex_types):
+            with_sub_elements.add(name)
+            order = child_order.setdefault(name, [])
+            for child in _child_names(complex_type, complex_types):
+                if child not in order:
+                    order.append(child)
+    if derived is None:
+        derived = DERIVED_ELEMENT_TABLES
+    if not derived:
+        repeatable, with_sub_elements = legacy_lists()
+    return ElementTables(
+        frozenset(repeatable),
+        frozenset(with_sub_elements),
+        {name: tuple(order) for name, order in child_order.items()},
+        {name: tuple(names) for name, names in attributes.items() if names},
+    )
+
+
+@lru_cache(maxsize=1)
+def legacy_lists(path=XSL_PATH):
+    """The stylesheet's own lists of repeatable elements and of elements with
+    sub-elements: the defaults of its parameters, used unless
+    DERIVED_ELEMENT_TABLES is set."""
+    xsl = etree.parse(path)
+    return tuple(
+        frozenset(
+            xsl.xpath(
+                f"string(//xsl:param[@name='{name}']/@select)", namespaces=XSLT_NS
+            )
+            .strip("'")
+            .split()
+        )
+        for name in ("repeatable", "with-sub-elements")
+    )
+
+
+def _child_names(complex_type, complex_types):
+    """Names of the child elements a complex type allows, in order, starting
+    with those of the type it extends."""
+    for content in complex_type.iterfind(XSD + "complexContent"):
+        for derivation in content:
+            base = complex_types.get(local_name(derivation.get("base") or ""))
+            if base is not None:
+                yield from _child_names(base, complex_types)
+            yield from _particle_names(derivation)
+    yield from _particle_names(complex_type)
+
+
+def _particle_names(node):
+    for child in node:
+        if child.tag == XSD + "element":
+            yield child.get("name") or local_name(child.get("ref"))
+        elif child.tag in PARTICLES:
+            yield from _particle_names(child)
+
+
+def _attribute_names(node, complex_types, attribute_groups):
+    """Names of the attributes a complex type (or part of one) allows,
+    including those of the types it extends and the groups it refers to."""
+    for child in node:
+        if child.tag == XSD + "attribute":
+            yield child.get("name") or local_name(child.get("ref"))
+        elif child.tag == XSD + "attributeGroup":
+            group = attribute_groups.get(local_name(child.get("ref") or ""))
+            if group is not None:
+                yield from _attribute_names(group, complex_types, attribute_groups)
+        elif child.tag in (XSD + "simpleContent", XSD + "complexContent"):
+            for derivation in child:
+                base = complex_types.get(local_name(derivation.get("base") or ""))
+                if base is not None:
+                    yield from _attribute_names(base, complex_types, attribute_groups)
+                yield from _attribute_names(derivation, complex_types, attribute_groups)
+
+
+def _type_of(declaration, complex_types):
+    inline = declaration.find(XSD + "complexType")
+    if inline is not None:
+        return inline
+    type_name = declaration.get("type")
+    return complex_types.get(local_name(type_name)) if type_name else None
+
+
+def has_element_content(complex_type, complex_types):
+    if complex_type is None:
+        return False
+    for content in complex_type.iterfind(XSD + "complexContent"):
+        for derivation in content:
+            if any(child.tag in PARTICLES for child in derivation):
+                return True
+            if derivation.tag == XSD + "extension" and has_element_content(
+                complex_types.get(local_name(derivation.get("base"))), complex_types
+            ):
+                return True
+    return any(child.tag in PARTICLES for child in complex_type)
+
+
+def local_name(qname):
+    return qname.rpartition(":")[2]
+
+
+def _strparam(names):
+    # The stylesheet matches names with contains($list, concat(' ', $name, ' ')).
+    return etree.XSLT.strparam(f" {' '.join(sorted(names))} ")
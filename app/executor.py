@@ -0,0 +1,336 @@
+import asyncio
+import contextvars
+import queue
+import threading
+import weakref
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from app import metrics
+from app.config import (
+    FEED_POOL_SIZE,
+    RETRY_AFTER,
+    WORK_POOL_MODE,
+    WORK_POOL_SIZE,
+    WORK_QUEUE_SIZE,
+)
+
+
+class Overloaded(Exception):
+    """Raised instead of queueing work when the work pool (or its feed threads)
+    are full."""
+
+    def __init__(self, retry_after):
+        super().__init__("Server is busy, try again later")
+        self.retry_after = retry_after
+
+
+class Feed:
+    """Data sent from the event loop to a job in the work pool, which reads it
+    as an iterator (see `WorkPool.feed`). Use as a context manager, to stop the
+    job if the data isn't all sent."""
+
+    _END = object()
+
+    def __init__(self, buffer):
+        self._loop = asyncio.get_running_loop()
+        self._items = queue.SimpleQueue()
+        self._slots = asyncio.Semaphore(max(1, buffer))
+        self.job = None
+
+    def __iter__(self):
+        # Runs in the pool thread.
+        while True:
+            item = self._items.get()
+            self._loop.call_soon_threadsafe(self._slots.release)
+            if item is self._END:
+                return
+            yield item
+
+    async def send(self, data):
+        """Pass `data` to the job, waiting while it has `buffer` items still to
+        read. Raises the job's error if it has failed."""
+        await self._slots.acquire()
+        if self.job.done():
+            # It has stopped reading, so the data isn't wanted.
+            self.job.result()
+            return
+        self._items.put(data)
+
+    async def close(self):
+        """End the data, and return what the job made of it."""
+        self._items.put(self._END)
+        return await self.job
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self.job.done():
+            self._items.put(self._END)
+            self.job.cancel()
+        elif not self.job.cancelled():
+            # Mark its error as seen: the caller is raising one of its own.
+            self.job.exception()
+
+
+def _init_process():
+    # Compile everything once per worker process rather than once per job.
+    from app.registry import json_schema_registry, schema_registry, stylesheet_registry
+
+    schema_registry.load()
+    stylesheet_registry.load()
+    json_schema_registry.load()
+
+
+class WorkPool:
+    """Runs blocking XML work off the asyncio event loop.
+
+    At most `max_workers` jobs run at once and at most `max_queue` more wait for
+    a worker. Beyond that, `run` fails fast with `Overloaded` rather than
+    letting latency grow without bound.
+
+    Threads are the default, since lxml releases the GIL while it parses,
+    validates and transforms. With `processes=True`, jobs and their arguments
+    and results must be picklable, so callers pass bytes rather than files.
+    Streaming jobs (see `iterate`) always run in threads.
+
+    Jobs fed from the network (see `feed`) run in threads of their own, at most
+    `max_feeds` at once, and don't count against the pool: they spend most of
+    their time waiting for data, and a slow sender mustn't keep other requests
+    out of the pool.
+    """
+
+    def __init__(
+        self, max_workers, max_queue, processes=False, retry_after=1, max_feeds=None
+    ):
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self.processes = processes
+        self.retry_after = retry_after
+        if max_feeds is None:
+            max_feeds = self.max_workers + self.max_queue
+        self.max_feeds = max(1, max_feeds)
+        self._pending = 0
+        self._feeding = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._thread_executor = None
+        self._feed_executor = None
+
+    @property
+    def pending(self):
+        return self._pending
+
+    @property
+    def feeding(self):
+        return self._feeding
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.processes:
+                        self._executor = ProcessPoolExecutor(
+                            self.max_workers, initializer=_init_process
+                        )
+                    else:
+                        self._executor = ThreadPoolExecutor(
+                            self.max_workers, thread_name_prefix="pbcore-work"
+                        )
+        return self._executor
+
+    @property
+    def thread_executor(self):
+        if not self.processes:
+            return self.executor
+        if self._thread_executor is None:
+            with self._lock:
+                if self._thread_executor is None:
+                    self._thread_executor = ThreadPoolExecutor(
+                        self.max_workers, thread_name_prefix="pbcore-stream"
+                    )
+        return self._thread_executor
+
+    @property
+    def feed_executor(self):
+        if self._feed_executor is None:
+            with self._lock:
+                if self._feed_executor is None:
+                    self._feed_executor = ThreadPoolExecutor(
+                        self.max_feeds, thread_name_prefix="pbcore-feed"
+                    )
+        return self._feed_executor
+
+    async def run(self, fn, *args, threads=False):
+        return await self.submit(fn, *args, threads=threads)
+
+    def submit(self, fn, *args, threads=False):
+        """Start `fn(*args)` in the pool and return an asyncio future for its
+        result. Raises `Overloaded` right away if the pool is full.
+
+        Stages the job times are added to the timings of the request that
+        submitted it. With `threads`, the job runs in a thread even in a
+        process pool, for jobs that work on objects living in this process.
+        """
+        executor = self.thread_executor if threads else self.executor
+        job = self._submit(executor, metrics.timed, fn, *args)
+        return self._result(job, metrics.current_timings())
+
+    def _result(self, job, timings):
+        # An asyncio future for the result of `job`, a `metrics.timed` call.
+        result = Future()
+
+        def done(job):
+            if job.cancelled():
+                result.cancel()
+                return
+            if not result.set_running_or_notify_cancel():
+                return
+            try:
+                value, stages = job.result()
+            except BaseException as e:
+                result.set_exception(e)
+                return
+            if timings is not None:
+                timings.merge(stages)
+            result.set_result(value)
+
+        def cancelled(result):
+            # Don't leave an abandoned job waiting in the queue.
+            if result.cancelled():
+                job.cancel()
+
+        job.add_done_callback(done)
+        result.add_done_callback(cancelled)
+        return asyncio.wrap_future(result)
+
+    def iterate(self, fn, *args, buffer=4):
+        """Run the generator function `fn` in a pool thread and return an async
+        iterator over what it yields.
+
+        The generator runs ahead of the consumer by at most `buffer` items, so
+        a slow client slows the work down rather than letting output pile up.
+        Raises `Overloaded` right away, before anything has been yielded, if
+        the pool is full.
+        """
+        loop = asyncio.get_running_loop()
+        items = asyncio.Queue(buffer)
+        stop = threading.Event()
+
+        def put(item):
+            # Wait for room, but give up once the consumer has gone, or never
+            # came, rather than holding the thread forever.
+            waiting = asyncio.run_coroutine_threadsafe(items.put(item), loop)
+            while not stop.is_set():
+                try:
+                    waiting.result(timeout=0.1)
+                    return True
+                except FutureTimeout:
+                    pass
+            waiting.cancel()
+            return False
+
+        def produce():
+            try:
+                for item in fn(*args):
+                    if stop.is_set() or not put((item, None)):
+                        return
+            except BaseException as e:
+                if not stop.is_set():
+                    put((None, e))
+                return
+            if not stop.is_set():
+                put((None, None))
+
+        # Run with the caller's context, so that stages are timed for its
+        # request.
+        context = contextvars.copy_context()
+        self._submit(self.thread_executor, context.run, produce)
+        consumer = self._consume(items, stop)
+        # An iterator dropped before it was started never runs its `finally`.
+        weakref.finalize(consumer, stop.set)
+        return consumer
+
+    async def _consume(self, items, stop):
+        try:
+            while True:
+                item, error = await items.get()
+                if error is not None:
+                    raise error
+                if item is None:
+                    return
+                yield item
+        finally:
+            # Unblock the producer if the consumer went away early.
+            stop.set()
+            while not items.empty():
+                items.get_nowait()
+
+    def feed(self, fn, *args, buffer=4):
+        """Run `fn(chunks, *args)` in a feed thread, where `chunks` iterates
+        over the data passed to the returned `Feed`'s `send`, and `close`
+        returns what `fn` returned.
+
+        The inverse of `iterate`: the event loop only receives the data, and
+        the work of decoding it is done in another thread. At most `buffer`
+        items wait for `fn`, so a slow job slows the sender down rather than
+        letting input pile up. Raises `Overloaded` right away if all
+        `max_feeds` feed threads are busy.
+        """
+        feed = Feed(buffer)
+        with self._lock:
+            if self._feeding >= self.max_feeds:
+                raise Overloaded(self.retry_after)
+            self._feeding += 1
+        try:
+            job = self.feed_executor.submit(metrics.timed, fn, feed, *args)
+        except BaseException:
+            self._release_feed()
+            raise
+        job.add_done_callback(self._release_feed)
+        feed.job = self._result(job, metrics.current_timings())
+        # Wake a sender waiting for room if the job stops reading.
+        feed.job.add_done_callback(lambda job: feed._slots.release())
+        return feed
+
+    def shutdown(self):
+        with self._lock:
+            executors = [self._executor, self._thread_executor, self._feed_executor]
+            self._executor = self._thread_executor = self._feed_executor = None
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def _submit(self, executor, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                raise Overloaded(self.retry_after)
+            self._pending += 1
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        # Release the slot when the job really finishes, not when the request
+        # awaiting it is cancelled, so abandoned jobs still count as load.
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future=None):
+        with self._lock:
+            self._pending -= 1
+
+    def _release_feed(self, future=None):
+        with self._lock:
+            self._feeding -= 1
+
+
+work_pool = WorkPool(
+    WORK_POOL_SIZE,
+    WORK_QUEUE_SIZE,
+    processes=WORK_POOL_MODE == "process",
+    retry_after=RETRY_AFTER,
+    max_feeds=FEED_POOL_SIZE,
+)
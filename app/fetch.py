@@ -0,0 +1,196 @@
+"""Fetching PBCore documents from URLs.
+
+All requests go through one application-scoped `httpx.AsyncClient`, so
+connections (and TLS sessions) to a repository host are kept alive and reused
+across requests. Bodies are streamed, with a cap on their size, to a job in a
+feed thread (see `WorkPool.feed`) that hashes them and feeds XML to lxml's
+incremental parser as it arrives, so parsing overlaps the download and stays
+off the event loop, and a slow download doesn't take up the work pool.
+
+The fetcher remembers the `ETag` and `Last-Modified` of recently fetched URLs,
+with the SHA-256 of the body they came with, so that a caller holding a result
+for that body can fetch conditionally and skip the download on a 304.
+"""
+
+import hashlib
+from collections import OrderedDict
+from typing import NamedTuple
+
+import httpx
+from lxml import etree
+
+from app.config import (
+    HTTP2,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_TIMEOUT,
+    HTTP_VALIDATORS_SIZE,
+    MAX_DOCUMENT_SIZE,
+)
+from app.core import XMLParseError
+from app.executor import work_pool
+from app.metrics import document_size, stage
+
+
+class FetchError(Exception):
+    """The document could not be fetched."""
+
+
+class DocumentTooLarge(Exception):
+    """The document is larger than the configured maximum."""
+
+    def __init__(self, max_size):
+        super().__init__(f"Document is larger than the maximum of {max_size} bytes")
+        self.max_size = max_size
+
+
+class NotModified(Exception):
+    """The URL still has the body it had when last fetched."""
+
+    def __init__(self, digest):
+        super().__init__("Not modified")
+        self.digest = digest
+
+
+class Fetched(NamedTuple):
+    document: object
+    digest: str
+
+
+class Validators(NamedTuple):
+    etag: str | None
+    last_modified: str | None
+    digest: str
+
+
+class Fetcher:
+    def __init__(
+        self,
+        timeout=HTTP_TIMEOUT,
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        http2=HTTP2,
+        max_size=MAX_DOCUMENT_SIZE,
+        validators_size=HTTP_VALIDATORS_SIZE,
+        transport=None,
+        pool=work_pool,
+    ):
+        self.timeout = timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        )
+        self.http2 = http2
+        self.max_size = max_size
+        self.validators_size = validators_size
+        self.transport = transport
+        self.pool = pool
+        self._client = None
+        # Only used from the event loop, so needs no lock.
+        self._validators = OrderedDict()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=self.http2,
+                transport=self.transport,
+                follow_redirects=True,
+            )
+        return self._client
+
+    async def aclose(self):
+        client, self._client = self._client, None
+        if client is not None:
+            await client.aclose()
+
+    def last_digest(self, url):
+        """SHA-256 of the body last fetched from `url`, if it can be fetched
+        conditionally."""
+        validators = self._validators.get(url)
+        return validators and validators.digest
+
+    async def fetch_bytes(self, url, conditional=False):
+        """Fetch a document as bytes.
+
+        With `conditional`, ask the server to only send it if it has changed
+        since it was last fetched, and raise `NotModified` if it hasn't.
+        """
+        return await self._download(url, _read_bytes, conditional)
+
+    async def fetch_xml(self, url, conditional=False):
+        """Fetch and parse an XML document, like `fetch_bytes`."""
+        return await self._download(url, _parse_xml, conditional)
+
+    async def _download(self, url, read, conditional):
+        validators = self._validators.get(url) if conditional else None
+        headers = {}
+        if validators is not None:
+            if validators.etag:
+                headers["If-None-Match"] = validators.etag
+            if validators.last_modified:
+                headers["If-Modified-Since"] = validators.last_modified
+        received = 0
+        with stage("fetch"):
+            try:
+                if httpx.URL(url).scheme not in ("http", "https"):
+                    raise FetchError(f"Not an http(s) URL: {url!r}")
+                async with self.client.stream("GET", url, headers=headers) as response:
+                    if response.status_code == 304 and validators is not None:
+                        self._validators.move_to_end(url)
+                        raise NotModified(validators.digest)
+                    response.raise_for_status()
+                    length = response.headers.get("Content-Length")
+                    if length and length.isdigit() and int(length) > self.max_size:
+                        raise DocumentTooLarge(self.max_size)
+                    # Only the download is done here; a feed thread hashes
+                    # and parses the body as it comes.
+                    with self.pool.feed(read) as chunks:
+                        async for chunk in response.aiter_bytes():
+                            received += len(chunk)
+                            if received > self.max_size:
+                                raise DocumentTooLarge(self.max_size)
+                            await chunks.send(chunk)
+                        fetched = await chunks.close()
+            except (httpx.HTTPError, httpx.InvalidURL) as e:
+                raise FetchError(str(e)) from e
+        document_size(received)
+        self._remember(url, response.headers, fetched.digest)
+        return fetched
+
+    def _remember(self, url, headers, digest):
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if not (etag or last_modified) or self.validators_size <= 0:
+            self._validators.pop(url, None)
+            return
+        self._validators[url] = Validators(etag, last_modified, digest)
+        self._validators.move_to_end(url)
+        while len(self._validators) > self.validators_size:
+            self._validators.popitem(last=False)
+
+
+def _read_bytes(chunks):
+    digest = hashlib.sha256()
+    data = []
+    for chunk in chunks:
+        digest.update(chunk)
+        data.append(chunk)
+    return Fetched(b"".join(data), digest.hexdigest())
+
+
+def _parse_xml(chunks):
+    parser = etree.XMLParser()
+    digest = hashlib.sha256()
+    try:
+        for chunk in chunks:
+            digest.update(chunk)
+            parser.feed(chunk)
+        return Fetched(parser.close(), digest.hexdigest())
+    except etree.XMLSyntaxError as e:
+        raise XMLParseError(str(e)) from e
+
+
+fetcher = Fetcher()
@@ -0,0 +1,318 @@
+"""An index of the records validated in batches and collections, for finding
+duplicates across them.
+
+Validating a collection or a batch with a `harvest` name also adds each of its
+records to a SQLite database (PBCORE_INDEX_PATH) shared by every worker on the
+host: its first pbcoreIdentifier and pbcoreTitle, a hash of its content, and
+every pbcoreIdentifier and instantiationIdentifier in it with their sources.
+Records are read for this from the tree already parsed to validate them, and
+written `BATCH_SIZE` at a time, each batch in one transaction, so indexing
+adds little to the cost of validating.
+
+Identifiers collide when records hold the same value from the same source,
+whether in one harvest or across harvests. Records are the same content when
+their canonical XML (exclusive C14N) is, whatever document they came in.
+"""
+
+import time
+from enum import Enum
+from typing import NamedTuple
+
+from lxml import etree
+
+from app.config import INDEX_PATH
+from app.core import PBCoreError, XMLParseError, canonical_digest, parse_xml
+from app.database import SharedDatabase
+from app.metrics import stage
+from app.registry import schema_registry
+
+PBCORE_NS = "http://www.pbcore.org/PBCore/PBCoreNamespace.html"
+RECORD_TAG = f"{{{PBCORE_NS}}}pbcoreDescriptionDocument"
+IDENTIFIER_TAG = f"{{{PBCORE_NS}}}pbcoreIdentifier"
+TITLE_TAG = f"{{{PBCORE_NS}}}pbcoreTitle"
+INSTANTIATION_TAG = f"{{{PBCORE_NS}}}pbcoreInstantiation"
+INSTANTIATION_IDENTIFIER_TAG = f"{{{PBCORE_NS}}}instantiationIdentifier"
+# Records written to the index per transaction.
+BATCH_SIZE = 500
+MAX_RESULTS = 1000
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS harvests (name TEXT PRIMARY KEY,"
+    " created REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS records (id INTEGER PRIMARY KEY,"
+    " harvest TEXT NOT NULL, file TEXT, archive TEXT, position INTEGER NOT NULL,"
+    " valid INTEGER NOT NULL, identifier TEXT, title TEXT, digest TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS identifiers (record INTEGER NOT NULL,"
+    " kind TEXT NOT NULL, source TEXT NOT NULL, value TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS identifiers_value"
+    " ON identifiers (value, source, kind)",
+    "CREATE INDEX IF NOT EXISTS identifiers_record ON identifiers (record)",
+    "CREATE INDEX IF NOT EXISTS records_digest ON records (digest)",
+    "CREATE INDEX IF NOT EXISTS records_harvest ON records (harvest)",
+)
+
+
+class IdentifierKind(str, Enum):
+    pbcore = "pbcoreIdentifier"
+    instantiation = "instantiationIdentifier"
+
+
+class DuplicateKind(str, Enum):
+    pbcore = "pbcoreIdentifier"
+    instantiation = "instantiationIdentifier"
+    content = "content"
+
+
+class HarvestNotFound(PBCoreError):
+    """No records have been indexed under that harvest name."""
+
+
+class Entry(NamedTuple):
+    """What the index holds about a record."""
+
+    file: str | None
+    archive: str | None
+    position: int
+    valid: bool
+    identifier: str | None
+    title: str | None
+    digest: str
+    # (kind, source, value) of each identifier in the record.
+    identifiers: tuple
+
+
+def record_entry(record, position=0, valid=True, file=None, archive=None):
+    """The index entry of a parsed pbcoreDescriptionDocument."""
+    with stage("index"):
+        identifiers, title = [], None
+        # One pass over the record's children, rather than a search per kind.
+        for child in record.iterchildren(IDENTIFIER_TAG, TITLE_TAG, INSTANTIATION_TAG):
+            tag = child.tag
+            if tag == IDENTIFIER_TAG:
+                identifiers.append(_identifier(IdentifierKind.pbcore.value, child))
+            elif tag == TITLE_TAG:
+                if title is None:
+                    title = _text(child)
+            else:
+                identifiers += [
+                    _identifier(IdentifierKind.instantiation.value, element)
+                    for element in child.iterchildren(INSTANTIATION_IDENTIFIER_TAG)
+                ]
+        digest = canonical_digest(record)
+    first = next(
+        (value for kind, _, value in identifiers if kind == IdentifierKind.pbcore), None
+    )
+    return Entry(
+        file, archive, position, valid, first, title, digest, tuple(identifiers)
+    )
+
+
+def _identifier(kind, element):
+    return kind, element.get("source", ""), _text(element)
+
+
+def _text(element):
+    if len(element):
+        return " ".join("".join(element.itertext()).split())
+    return " ".join((element.text or "").split())
+
+
+def validation_entries(source, version=None):
+    """Validate a document like `core.validation_error`, and return why it is
+    invalid (or None) together with the index entries of its records, whether
+    it is a record or a pbcoreCollection."""
+    try:
+        pbcore_xml = parse_xml(source)
+    except XMLParseError as e:
+        return f"XML Parsing Error: {e}", []
+    error = None
+    with schema_registry.validator(version) as pbcore_schema, stage("validate"):
+        try:
+            pbcore_schema.assertValid(pbcore_xml)
+        except etree.DocumentInvalid as e:
+            error = f"PBCore XML Validation Error: {e}"
+    root = pbcore_xml.getroot() if hasattr(pbcore_xml, "getroot") else pbcore_xml
+    records = [root] if root.tag == RECORD_TAG else root.iterfind(RECORD_TAG)
+    return error, [
+        record_entry(record, position, error is None)
+        for position, record in enumerate(records)
+    ]
+
+
+class RecordIndex:
+    """Indexed records in a SQLite database shared by every worker on a host.
+
+    All methods block.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = SharedDatabase(path, SCHEMA)
+
+    def add(self, harvest, entries):
+        """Add records to a harvest, in one transaction."""
+        with self.db.transaction() as db:
+            db.execute(
+                "INSERT OR IGNORE INTO harvests (name, created) VALUES (?, ?)",
+                (harvest, time.time()),
+            )
+            # Record IDs are handed out here, so that the records can be
+            # inserted in bulk like their identifiers.
+            (last,) = db.execute("SELECT COALESCE(MAX(id), 0) FROM records").fetchone()
+            records, identifiers = [], []
+            for id, entry in enumerate(entries, last + 1):
+                records.append((id, harvest, *entry[:7]))
+                identifiers += [(id, *identifier) for identifier in entry[7]]
+            db.executemany(
+                "INSERT INTO records (id, harvest, file, archive, position, valid,"
+                " identifier, title, digest) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                records,
+            )
+            db.executemany(
+                "INSERT INTO identifiers (record, kind, source, value)"
+                " VALUES (?, ?, ?, ?)",
+                identifiers,
+            )
+
+    def lookup(self, identifier, kind=None, limit=MAX_RESULTS):
+        """The records holding an identifier, with the source it has in each."""
+        sql = (
+            "SELECT i.kind, i.source, r.* FROM identifiers i"
+            " JOIN records r ON r.id = i.record WHERE i.value = ?"
+        )
+        params = [identifier]
+        if kind is not None:
+            sql += " AND i.kind = ?"
+            params.append(IdentifierKind(kind).value)
+        sql += " ORDER BY r.id LIMIT ?"
+        rows = self._query(sql, [*params, limit])
+        return [
+            {"kind": row[0], "source": row[1], **self._record(row[2:])} for row in rows
+        ]
+
+    def duplicates(self, kind, harvest=None, limit=100, offset=0):
+        """Identifiers (or content) shared by more than one record, each with
+        the records that share it. With `harvest`, only those that a record of
+        that harvest shares, with it or with other harvests."""
+        kind = DuplicateKind(kind)
+        having = "COUNT(DISTINCT r.id) > 1"
+        params = []
+        if harvest is not None:
+            having += " AND MAX(r.harvest = ?) = 1"
+            params.append(harvest)
+        if kind == DuplicateKind.content:
+            groups = self._query(
+                "SELECT r.digest FROM records r GROUP BY r.digest"
+                f" HAVING {having} ORDER BY r.digest LIMIT ? OFFSET ?",
+                [*params, limit, offset],
+            )
+            return [
+                {
+                    "kind": kind.value,
+                    "digest": digest,
+                    "records": self._records(
+                        "SELECT r.* FROM records r WHERE r.digest = ? ORDER BY r.id",
+                        [digest],
+                    ),
+                }
+                for (digest,) in groups
+            ]
+        groups = self._query(
+            "SELECT i.source, i.value FROM identifiers i"
+            " JOIN records r ON r.id = i.record WHERE i.kind = ?"
+            f" GROUP BY i.source, i.value HAVING {having}"
+            " ORDER BY i.value, i.source LIMIT ? OFFSET ?",
+            [kind.value, *params, limit, offset],
+        )
+        return [
+            {
+                "kind": kind.value,
+                "source": source,
+                "value": value,
+                "records": self._records(
+                    "SELECT DISTINCT r.* FROM identifiers i"
+                    " JOIN records r ON r.id = i.record"
+                    " WHERE i.kind = ? AND i.source = ? AND i.value = ? ORDER BY r.id",
+                    [kind.value, source, value],
+                ),
+            }
+            for source, value in groups
+        ]
+
+    def harvests(self):
+        rows = self._query(
+            "SELECT h.name, h.created, COUNT(r.id) FROM harvests h"
+            " LEFT JOIN records r ON r.harvest = h.name"
+            " GROUP BY h.name ORDER BY h.created",
+            [],
+        )
+        return [
+            {"name": name, "created": created, "records": records}
+            for name, created, records in rows
+        ]
+
+    def delete_harvest(self, harvest):
+        """Remove a harvest and its records from the index."""
+        with self.db.transaction() as db:
+            db.execute(
+                "DELETE FROM identifiers WHERE record IN"
+                " (SELECT id FROM records WHERE harvest = ?)",
+                (harvest,),
+            )
+            db.execute("DELETE FROM records WHERE harvest = ?", (harvest,))
+            deleted = db.execute(
+                "DELETE FROM harvests WHERE name = ?", (harvest,)
+            ).rowcount
+        if not deleted:
+            raise HarvestNotFound(f"No harvest named {harvest!r}")
+
+    def _records(self, sql, params):
+        return [self._record(row) for row in self._query(sql, params)]
+
+    @staticmethod
+    def _record(row):
+        _, harvest, file, archive, position, valid, identifier, title, digest = row
+        return {
+            "harvest": harvest,
+            "file": file,
+            "archive": archive,
+            "position": position,
+            "valid": bool(valid),
+            "identifier": identifier,
+            "title": title,
+            "digest": digest,
+        }
+
+    def _query(self, sql, params):
+        with self.db.connection() as db:
+            return db.execute(sql, params).fetchall()
+
+
+class IndexBuffer:
+    """Entries on their way to the index under a harvest name, written
+    `BATCH_SIZE` at a time. Use as a context manager to write the rest."""
+
+    def __init__(self, index, harvest, size=BATCH_SIZE):
+        self.index = index
+        self.harvest = harvest
+        self.size = size
+        self._entries = []
+
+    def add(self, entries):
+        self._entries.extend(entries)
+        if len(self._entries) >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self._entries:
+            with stage("index"):
+                self.index.add(self.harvest, self._entries)
+            self._entries = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
+record_index = RecordIndex(INDEX_PATH)
@@ -0,0 +1,467 @@
+"""Background jobs: long validations and conversions, polled for instead of
+waited on.
+
+Converting a collection of thousands of records can take longer than a client,
+or gunicorn's `timeout`, will wait for a response. Submitted as a job instead,
+the upload is saved to PBCORE_JOB_DIR and the job's ID comes back at once. The
+client polls `/jobs/{id}` for its progress, and fetches the result from
+`/jobs/{id}/result` once it's done.
+
+Jobs run the same streaming functions as the endpoints, writing their output
+to a file as it comes. They run in threads of their own (PBCORE_JOB_WORKERS
+per worker process) rather than in the work pool, so that they never take its
+room from interactive requests. Jobs waiting to run are queued smallest upload
+first, so that a quick job isn't stuck behind a huge one, and at most
+PBCORE_JOB_QUEUE_SIZE of them per worker, counted in the same transaction that
+queues a job: beyond that, submitting fails with `Overloaded` like a full work
+pool.
+
+The state of every job is kept in a SQLite database in the job directory,
+shared by every worker on the host, so that any of them can answer a poll. A
+job whose worker process has gone away is reported as failed, when polled or
+when a worker process first queues a job, whichever comes first. Finished jobs
+and their files are deleted PBCORE_JOB_TTL seconds after they finish, by the
+next submit or poll.
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from enum import Enum
+
+from app import batch, collection, core
+from app.config import JOB_DIR, JOB_QUEUE_SIZE, JOB_TTL, JOB_WORKERS, RETRY_AFTER
+from app.core import Engine, PBCoreError
+from app.database import SharedDatabase
+from app.executor import Overloaded
+from app.index import IndexBuffer, record_index, validation_entries
+
+logger = logging.getLogger(__name__)
+
+# Seconds between progress updates of a running job.
+PROGRESS_INTERVAL = 1
+COPY_SIZE = 2**20
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL,"
+    " filename TEXT, params TEXT NOT NULL, size INTEGER NOT NULL,"
+    " status TEXT NOT NULL, progress REAL, error TEXT, pid INTEGER NOT NULL,"
+    " created REAL NOT NULL, started REAL, finished REAL, expires REAL)",
+    "CREATE INDEX IF NOT EXISTS jobs_expires ON jobs (expires)",
+)
+
+
+class JobKind(str, Enum):
+    validate_collection = "validate-collection"
+    validate_batch = "validate-batch"
+    xml_to_json_collection = "xml-to-json-collection"
+    json_to_xml_collection = "json-to-xml-collection"
+    roundtrip = "roundtrip"
+
+
+class JobNotFound(PBCoreError):
+    """No job with that ID, or it has expired."""
+
+
+class JobNotDone(PBCoreError):
+    """The job has no result yet, or failed."""
+
+    def __init__(self, status):
+        super().__init__(f"Job is {status}")
+        self.status = status
+
+
+def _validate_collection(source, filename, params):
+    return collection.validate_collection(source, harvest=params.get("harvest"))
+
+
+def _xml_to_json_collection(source, filename, params):
+    return collection.convert_collection(
+        source, Engine(params["engine"]), params["validate"]
+    )
+
+
+def _json_to_xml_collection(source, filename, params):
+    return collection.json_to_xml_collection(source)
+
+
+def _validate_batch(source, filename, params):
+    summary = batch.summarize([])
+    harvest = params.get("harvest")
+    buffer = IndexBuffer(record_index, harvest) if harvest else nullcontext()
+    with buffer:
+        documents = batch.iter_documents([(filename, source)])
+        for index, document in enumerate(documents):
+            error = document.error
+            if error is None and harvest:
+                error, entries = validation_entries(document.content)
+                buffer.add(
+                    entry._replace(file=document.name, archive=document.archive)
+                    for entry in entries
+                )
+            elif error is None:
+                error = core.validation_error(document.content)
+            result = {
+                "index": index,
+                "file": document.name,
+                "archive": document.archive,
+                "valid": error is None,
+            }
+            if error is not None:
+                result["error"] = error
+            batch.summarize([result], summary)
+            yield _line(result)
+    yield _line({"summary": summary})
+
+
+def _roundtrip(source, filename, params):
+    summary = batch.summarize_roundtrips([])
+    engine = Engine(params["engine"])
+    for index, record in enumerate(batch.iter_records([(filename, source)])):
+        if record.error is not None:
+            result = {"error": record.error}
+        else:
+            (result,) = core.roundtrip_records([record.content], engine)
+        result = {
+            "index": index,
+            "file": record.name,
+            "archive": record.archive,
+            "identifier": record.identifier,
+            **result,
+        }
+        batch.summarize_roundtrips([result], summary)
+        yield _line(result)
+    yield _line({"summary": summary})
+
+
+def _line(result):
+    return (json.dumps(result) + "\n").encode()
+
+
+# What each kind of job runs, given the upload as a binary file, its filename
+# and the job's parameters, and the media type of the output it yields.
+KINDS = {
+    JobKind.validate_collection: (_validate_collection, "application/x-ndjson"),
+    JobKind.validate_batch: (_validate_batch, "application/x-ndjson"),
+    JobKind.xml_to_json_collection: (_xml_to_json_collection, "application/x-ndjson"),
+    JobKind.json_to_xml_collection: (_json_to_xml_collection, "application/xml"),
+    JobKind.roundtrip: (_roundtrip, "application/x-ndjson"),
+}
+
+
+class JobStore:
+    """The state of every job in a SQLite database shared by every worker on a
+    host."""
+
+    def __init__(self, path):
+        self.path = path
+        self.db = SharedDatabase(path, SCHEMA)
+
+    def create(self, id, kind, filename, params, size, max_queue):
+        """Record a queued job, returning the IDs of the jobs that expired and
+        were deleted to make way for it. Raises `Overloaded`, recording
+        nothing, if this worker already has `max_queue` jobs queued."""
+        now = time.time()
+        with self.db.transaction() as db:
+            expired = self._expire(db, now)
+            (queued,) = db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND pid = ?",
+                (os.getpid(),),
+            ).fetchone()
+            if queued >= max_queue:
+                raise Overloaded(RETRY_AFTER)
+            db.execute(
+                "INSERT INTO jobs (id, kind, filename, params, size, status,"
+                " progress, pid, created) VALUES (?, ?, ?, ?, ?, 'queued', 0, ?, ?)",
+                (id, kind, filename, json.dumps(params), size, os.getpid(), now),
+            )
+        return expired
+
+    def expire(self):
+        """Delete the jobs that have expired, returning their IDs."""
+        now = time.time()
+        # Polls check this, so only take the write lock if there's work.
+        with self.db.connection() as db:
+            if not db.execute(
+                "SELECT 1 FROM jobs WHERE expires < ? LIMIT 1", (now,)
+            ).fetchone():
+                return []
+        with self.db.transaction() as db:
+            return self._expire(db, now)
+
+    def get(self, id):
+        with self.db.connection() as db:
+            cursor = db.execute("SELECT * FROM jobs WHERE id = ?", (id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([column[0] for column in cursor.description], row))
+
+    def start(self, id):
+        """Mark a queued job as running. False if it's gone."""
+        return self._update(
+            "UPDATE jobs SET status = 'running', started = ?"
+            " WHERE id = ? AND status = 'queued'",
+            (time.time(), id),
+        )
+
+    def progress(self, id, progress):
+        """Record how far a running job has got. False if it's gone."""
+        return self._update(
+            "UPDATE jobs SET progress = ? WHERE id = ? AND status = 'running'",
+            (progress, id),
+        )
+
+    def finish(self, id, error=None, ttl=JOB_TTL):
+        """Mark an unfinished job as done, or as failed with `error`. False if
+        it's gone."""
+        now = time.time()
+        return self._update(
+            "UPDATE jobs SET status = ?, progress = ?, error = ?, finished = ?,"
+            " expires = ? WHERE id = ? AND status IN ('queued', 'running')",
+            (
+                "done" if error is None else "failed",
+                1 if error is None else None,
+                error,
+                now,
+                now + ttl,
+                id,
+            ),
+        )
+
+    def delete(self, id):
+        return self._update("DELETE FROM jobs WHERE id = ?", (id,))
+
+    def fail_stopped(self, stopped, error, ttl=JOB_TTL):
+        """Mark the unfinished jobs of every worker process for which
+        `stopped(pid)` is true as failed with `error`, returning how many
+        there were."""
+        now = time.time()
+        failed = 0
+        with self.db.transaction() as db:
+            pids = db.execute(
+                "SELECT DISTINCT pid FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchall()
+            for (pid,) in pids:
+                if stopped(pid):
+                    failed += db.execute(
+                        "UPDATE jobs SET status = 'failed', progress = NULL,"
+                        " error = ?, finished = ?, expires = ?"
+                        " WHERE pid = ? AND status IN ('queued', 'running')",
+                        (error, now, now + ttl, pid),
+                    ).rowcount
+        return failed
+
+    def _expire(self, db, now):
+        expired = [
+            row[0]
+            for row in db.execute("SELECT id FROM jobs WHERE expires < ?", (now,))
+        ]
+        db.execute("DELETE FROM jobs WHERE expires < ?", (now,))
+        return expired
+
+    def _update(self, sql, params):
+        with self.db.connection() as db:
+            return db.execute(sql, params).rowcount > 0
+
+
+class JobQueue:
+    """Runs jobs in `workers` threads of this process, smallest first, with at
+    most `max_queue` waiting. Their uploads, results and state are kept in
+    `directory`.
+
+    All methods block, and are meant to be run in the work pool's threads.
+    """
+
+    def __init__(self, directory, workers, max_queue, ttl):
+        self.directory = directory
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.ttl = ttl
+        self.store = JobStore(os.path.join(directory, "jobs.sqlite3"))
+        self._queue = []
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._threads_pid = None
+
+    def submit(self, kind, fileobj, filename=None, params=None):
+        """Save the upload `fileobj` and queue a job of `kind` for it, with
+        `params` for the function it runs (see `KINDS`), returning the job's
+        status. Raises `Overloaded` if the queue is full."""
+        kind = JobKind(kind)
+        params = params or {}
+        with self._condition:
+            self._start_threads()
+        id = uuid.uuid4().hex
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(id, "input"), "wb") as f:
+            shutil.copyfileobj(fileobj, f, COPY_SIZE)
+            size = f.tell()
+        try:
+            expired = self.store.create(
+                id, kind.value, filename, params, size, self.max_queue
+            )
+        except BaseException:
+            self._remove_files(id)
+            raise
+        self._remove_expired(expired)
+        with self._condition:
+            heapq.heappush(self._queue, (size, next(self._order), id))
+            self._condition.notify()
+        return self.status(id)
+
+    def status(self, id):
+        self._remove_expired(self.store.expire())
+        job = self.store.get(id)
+        if job is None:
+            raise JobNotFound(f"No job {id}")
+        if (
+            job["status"] in ("queued", "running")
+            and job["pid"] != os.getpid()
+            and not _alive(job["pid"])
+        ):
+            self.store.finish(id, "Worker process stopped", self.ttl)
+            job = self.store.get(id) or job
+        status = {
+            "id": job["id"],
+            "kind": job["kind"],
+            "file": job["filename"],
+            "size": job["size"],
+            "status": job["status"],
+            "progress": job["progress"],
+        }
+        if job["error"] is not None:
+            status["error"] = job["error"]
+        for name in ("created", "started", "finished", "expires"):
+            if job[name] is not None:
+                status[name] = _timestamp(job[name])
+        if job["status"] == "done":
+            status["result"] = f"/jobs/{id}/result"
+        return status
+
+    def result(self, id):
+        """The path of a done job's result, and its media type."""
+        status = self.status(id)
+        if status["status"] != "done":
+            raise JobNotDone(status["status"])
+        return self._path(id, "result"), KINDS[JobKind(status["kind"])][1]
+
+    def delete(self, id):
+        """Delete a job and its files, stopping it if it's queued or
+        running."""
+        if not self.store.delete(id):
+            raise JobNotFound(f"No job {id}")
+        self._remove_files(id)
+
+    def _start_threads(self):
+        # Threads don't survive a fork, so a forked worker starts its own.
+        if self._threads_pid != os.getpid():
+            self._threads_pid = os.getpid()
+            self._queue = []
+            # Before this process queues anything, fail the jobs no process is
+            # left to run, which no poll might ever come for: those of stopped
+            # processes, and of a previous process with the same PID, as is
+            # common in a restarted container.
+            self.store.fail_stopped(
+                lambda pid: pid == os.getpid() or not _alive(pid),
+                "Worker process stopped",
+                self.ttl,
+            )
+            for _ in range(self.workers):
+                threading.Thread(
+                    target=self._work, name="pbcore-job", daemon=True
+                ).start()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                _, _, id = heapq.heappop(self._queue)
+            try:
+                self._run(id)
+            except Exception as e:
+                # E.g. the database failed: the thread carries on with the
+                # next job.
+                logger.exception("Job %s failed", id)
+                self._fail(id, f"{type(e).__name__}: {e}")
+
+    def _fail(self, id, error):
+        _remove(self._path(id, "input"))
+        try:
+            if not self.store.finish(id, error, self.ttl):
+                self._remove_files(id)
+        except Exception:
+            logger.exception("Couldn't record job %s as failed", id)
+
+    def _run(self, id):
+        if not self.store.start(id):
+            return
+        job = self.store.get(id)
+        if job is None:
+            # Deleted since it started.
+            self._remove_files(id)
+            return
+        run, _ = KINDS[JobKind(job["kind"])]
+        input_path, result_path = self._path(id, "input"), self._path(id, "result")
+        error = None
+        try:
+            with open(input_path, "rb") as source, open(result_path, "wb") as out:
+                last = time.monotonic()
+                for chunk in run(source, job["filename"], json.loads(job["params"])):
+                    out.write(chunk)
+                    if time.monotonic() - last >= PROGRESS_INTERVAL:
+                        last = time.monotonic()
+                        progress = source.tell() / job["size"] if job["size"] else 0
+                        if not self.store.progress(id, min(progress, 1)):
+                            # Deleted while running.
+                            self._remove_files(id)
+                            return
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            _remove(input_path)
+        if not self.store.finish(id, error, self.ttl):
+            self._remove_files(id)
+
+    def _remove_expired(self, ids):
+        for id in ids:
+            self._remove_files(id)
+
+    def _path(self, id, name):
+        return os.path.join(self.directory, f"{id}.{name}")
+
+    def _remove_files(self, id):
+        for name in ("input", "result"):
+            _remove(self._path(id, name))
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _timestamp(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat()
+
+
+jobs = JobQueue(JOB_DIR, JOB_WORKERS, JOB_QUEUE_SIZE, JOB_TTL)
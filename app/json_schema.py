@@ -0,0 +1,259 @@
+"""A JSON Schema for PBCore JSON, derived from the XSD.
+
+The schema describes the JSON the xml-to-json converters produce: every element
+becomes an object holding its attributes as strings, a "text" string unless it
+has sub-elements, and its sub-elements by name, as arrays for repeatable ones.
+Whether an element is repeatable or has sub-elements comes from the same
+element tables the converters use; everything else (attributes, which elements
+are required, choices, text patterns) is read off the XSD.
+
+Regenerate schemas/pbcore-schema.json after changing the XSD, or with
+PBCORE_DERIVED_ELEMENT_TABLES set to describe the JSON converted with it, with:
+
+    python -m app.json_schema
+"""
+
+import json
+from itertools import combinations
+
+from lxml import etree
+
+from app.config import DEFAULT_PBCORE_VERSION, JSON_SCHEMA_PATHS, XSD_PATHS
+from app.elements import XSD, derive_element_tables, has_element_content, local_name
+
+ROOT = "pbcoreDescriptionDocument"
+STRING = {"type": "string"}
+# Attributes such as xsi:schemaLocation are allowed on any element.
+PREFIXED_ATTRIBUTES = {"^xsi:": STRING}
+BUILTIN_TYPES = {
+    "anyURI": {"type": "string", "format": "uri-reference"},
+}
+
+
+def derive_json_schema(xsd, tables=None, version=DEFAULT_PBCORE_VERSION):
+    """Build the PBCore JSON Schema from a parsed XSD root element."""
+    builder = _Builder(xsd, tables or derive_element_tables(xsd))
+    root = builder.element_schema(builder.global_elements[ROOT], ROOT)
+    return {
+        "$schema": "https://json-schema.org/draft/2020-12/schema",
+        "title": f"PBCore {version} JSON",
+        "description": (
+            f"PBCore {version} documents as converted from XML by pbcore-util."
+            " Generated from the PBCore XSD by app/json_schema.py."
+        ),
+        "type": "object",
+        "properties": {ROOT: root},
+        "required": [ROOT],
+        "additionalProperties": False,
+        "$defs": dict(sorted(builder.defs.items())),
+    }
+
+
+class _Builder:
+    def __init__(self, xsd, tables):
+        self.tables = tables
+        self.complex_types = _named(xsd, "complexType")
+        self.simple_types = _named(xsd, "simpleType")
+        self.attribute_groups = _named(xsd, "attributeGroup")
+        self.global_elements = _named(xsd, "element")
+        self.defs = {}
+
+    def element_schema(self, declaration, name):
+        """The schema for one element as it appears in its parent object."""
+        text = name not in self.tables.with_sub_elements
+        inline = declaration.find(XSD + "complexType")
+        inline_simple = declaration.find(XSD + "simpleType")
+        type_name = declaration.get("type")
+        if inline is not None:
+            return self.object_schema(inline, text)
+        if inline_simple is not None:
+            return self.object_schema(None, text, self.restriction(inline_simple))
+        if type_name is None:
+            # xsd:anyType
+            return {"type": "object"}
+        local = local_name(type_name)
+        if local in self.complex_types:
+            return self.type_ref(local, text)
+        return self.object_schema(None, text, self.simple_schema(type_name))
+
+    def type_ref(self, type_name, text):
+        complex_type = self.complex_types[type_name]
+        key = type_name
+        if text != (not has_element_content(complex_type, self.complex_types)):
+            # The element tables go by name, so an element can differ from
+            # its type about whether it has text.
+            key = f"{type_name}-{'text' if text else 'no-text'}"
+        if key not in self.defs:
+            # Reserve the name first: types can contain themselves.
+            self.defs[key] = None
+            self.defs[key] = self.object_schema(complex_type, text)
+        return {"$ref": f"#/$defs/{key}"}
+
+    def object_schema(self, complex_type, text, text_schema=STRING):
+        content = _Content()
+        if complex_type is not None:
+            self.complex_content(complex_type, content)
+        properties = {}
+        required = []
+        if text:
+            properties["text"] = content.text_schema or text_schema
+            required.append("text")
+        properties.update(content.attributes)
+        required.extend(content.required_attributes)
+        properties.update(content.elements)
+        required.extend(content.required_elements)
+
+        schema = {"type": "object", "properties": properties}
+        if required:
+            schema["required"] = required
+        schema["patternProperties"] = PREFIXED_ATTRIBUTES
+        schema["additionalProperties"] = content.open
+        if content.constraints:
+            schema["allOf"] = content.constraints
+        return schema
+
+    def complex_content(self, complex_type, content):
+        for child in complex_type:
+            if child.tag in (XSD + "simpleContent", XSD + "complexContent"):
+                for derivation in child.iterfind(XSD + "*"):
+                    self.derivation(derivation, content)
+            elif child.tag in (XSD + "attribute", XSD + "attributeGroup"):
+                self.attribute(child, content)
+            elif child.tag in (XSD + "sequence", XSD + "choice", XSD + "all"):
+                self.particle(child, content, optional=False)
+
+    def derivation(self, derivation, content):
+        base = derivation.get("base")
+        local = local_name(base)
+        if local in self.complex_types:
+            self.complex_content(self.complex_types[local], content)
+        elif derivation.getparent().tag == XSD + "simpleContent":
+            content.text_schema = self.simple_schema(base)
+        for child in derivation:
+            if child.tag in (XSD + "attribute", XSD + "attributeGroup"):
+                self.attribute(child, content)
+            elif child.tag in (XSD + "sequence", XSD + "choice", XSD + "all"):
+                self.particle(child, content, optional=False)
+
+    def attribute(self, attribute, content):
+        if attribute.tag == XSD + "attributeGroup":
+            group = self.attribute_groups[local_name(attribute.get("ref"))]
+            for child in group:
+                if child.tag in (XSD + "attribute", XSD + "attributeGroup"):
+                    self.attribute(child, content)
+            return
+        name = attribute.get("name") or attribute.get("ref")
+        inline_simple = attribute.find(XSD + "simpleType")
+        if inline_simple is not None:
+            content.attributes[name] = self.restriction(inline_simple)
+        else:
+            content.attributes[name] = self.simple_schema(attribute.get("type"))
+        if attribute.get("use") == "required" and name not in (
+            content.required_attributes
+        ):
+            content.required_attributes.append(name)
+
+    def particle(self, particle, content, optional):
+        optional = optional or particle.get("minOccurs") == "0"
+        if particle.tag == XSD + "any":
+            content.open = True
+            return
+        if particle.tag == XSD + "element":
+            name = particle.get("name") or local_name(particle.get("ref"))
+            declaration = particle
+            if particle.get("ref"):
+                declaration = self.global_elements[name]
+            schema = self.element_schema(declaration, name)
+            if name in self.tables.repeatable:
+                schema = {"type": "array", "items": schema, "minItems": 1}
+                max_occurs = particle.get("maxOccurs", "1")
+                if max_occurs != "unbounded":
+                    schema["maxItems"] = int(max_occurs)
+            content.elements[name] = schema
+            if not optional and name not in content.required_elements:
+                content.required_elements.append(name)
+            return
+
+        is_choice = particle.tag == XSD + "choice"
+        members = [child for child in particle if child.tag != XSD + "annotation"]
+        for member in members:
+            self.particle(member, content, optional or is_choice)
+        names = [
+            member.get("name") or local_name(member.get("ref"))
+            for member in members
+            if member.tag == XSD + "element"
+        ]
+        if not is_choice or particle.get("maxOccurs", "1") != "1" or len(names) < 2:
+            return
+        if not optional and len(names) == len(members):
+            if all(member.get("minOccurs", "1") != "0" for member in members):
+                content.constraints.append(
+                    {"oneOf": [{"required": [name]} for name in names]}
+                )
+                return
+        # At most one of the choices.
+        content.constraints.append(
+            {
+                "not": {
+                    "anyOf": [
+                        {"required": list(pair)} for pair in combinations(names, 2)
+                    ]
+                }
+            }
+        )
+
+    def simple_schema(self, type_name):
+        """The schema for text or an attribute value of a simple type."""
+        if type_name is None:
+            return STRING
+        local = local_name(type_name)
+        simple_type = self.simple_types.get(local)
+        if simple_type is None:
+            return BUILTIN_TYPES.get(local, STRING)
+        return self.restriction(simple_type)
+
+    def restriction(self, simple_type):
+        restriction = simple_type.find(XSD + "restriction")
+        if restriction is None:
+            # Lists and unions
+            return STRING
+        schema = dict(self.simple_schema(restriction.get("base")))
+        patterns = [p.get("value") for p in restriction.iterfind(XSD + "pattern")]
+        if patterns:
+            # XSD patterns match the whole value.
+            schema["pattern"] = "^(?:" + "|".join(patterns) + ")$"
+        enumeration = [
+            e.get("value") for e in restriction.iterfind(XSD + "enumeration")
+        ]
+        if enumeration:
+            schema["enum"] = enumeration
+        return schema
+
+
+class _Content:
+    def __init__(self):
+        self.text_schema = None
+        self.attributes = {}
+        self.required_attributes = []
+        self.elements = {}
+        self.required_elements = []
+        self.constraints = []
+        self.open = False
+
+
+def _named(xsd, kind):
+    return {node.get("name"): node for node in xsd.iterfind(XSD + kind)}
+
+
+def write_json_schema(version=DEFAULT_PBCORE_VERSION):
+    schema = derive_json_schema(
+        etree.parse(XSD_PATHS[version]).getroot(), version=version
+    )
+    with open(JSON_SCHEMA_PATHS[version], "w") as f:
+        json.dump(schema, f, indent=2)
+        f.write("\n")
+
+
+if __name__ == "__main__":
+    for version in JSON_SCHEMA_PATHS:
+        write_json_schema(version)
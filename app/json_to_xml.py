@@ -0,0 +1,174 @@
+"""PBCore JSON to XML conversion.
+
+The inverse of the xml-to-json conversion: string values are attributes, a
+"text" string is the element's content, objects are child elements and arrays
+are repeated child elements. Children are written in the order the XSD puts
+them in, whatever order the JSON has them in; anything the XSD doesn't know
+about comes after, in JSON order.
+
+XML is written with `etree.xmlfile`, straight to the output as each element is
+reached, without building a tree or concatenating strings. Keys that aren't XML
+names, and strings holding characters XML can't (e.g. NUL), are reported as a
+`ConversionError` like any other misshapen JSON, rather than written out or
+left to lxml to refuse, as is JSON nested too deeply to convert.
+"""
+
+import re
+from contextlib import contextmanager
+
+from lxml import etree
+
+PBCORE_NS = "http://www.pbcore.org/PBCore/PBCoreNamespace.html"
+XSI_NS = "http://www.w3.org/2001/XMLSchema-instance"
+XML_NS = "http://www.w3.org/XML/1998/namespace"
+NSMAP = {None: PBCORE_NS, "xsi": XSI_NS}
+PREFIXES = {"xsi": XSI_NS, "xml": XML_NS}
+ROOT = "pbcoreDescriptionDocument"
+# An XML name without a prefix (an NCName), leaving out the rarer characters
+# XML also allows.
+NCNAME = re.compile(r"[^\W\d][\w.-]*")
+
+
+class ConversionError(ValueError):
+    """The JSON isn't shaped like PBCore JSON.
+
+    `path` holds the keys and indexes leading to the offending value.
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.path = []
+
+    def __str__(self):
+        location = "".join(f"/{part}" for part in self.path)
+        return f"{self.args[0]} at {location or '/'}"
+
+
+def record(document):
+    """The pbcoreDescriptionDocument object of a PBCore JSON document."""
+    if not isinstance(document, dict) or set(document) != {ROOT}:
+        raise ConversionError(f'Expected an object with a single "{ROOT}" key')
+    return document[ROOT]
+
+
+def json_to_xml(document, tables):
+    """Convert a parsed PBCore JSON document to PBCore XML bytes."""
+    out = OutputBuffer()
+    with etree.xmlfile(out, encoding="UTF-8") as xf:
+        xf.write_declaration()
+        write_record(xf, record(document), tables, NSMAP)
+    return out.drain()
+
+
+def write_record(xf, pbcore, tables, nsmap=None):
+    """Write a pbcoreDescriptionDocument object with an `etree.xmlfile`."""
+    try:
+        _element(xf, ROOT, pbcore, tables.child_order, nsmap)
+    except ConversionError as e:
+        e.path.insert(0, ROOT)
+        raise
+    except RecursionError as e:
+        error = ConversionError("JSON is nested too deeply")
+        error.path.append(ROOT)
+        raise error from e
+
+
+def _element(xf, name, value, child_order, nsmap=None):
+    if not isinstance(value, dict):
+        raise ConversionError(f"Expected an object, got {_kind(value)}")
+    attrib = {}
+    text = None
+    children = {}
+    for key, item in value.items():
+        if key == "text":
+            text = _string(key, item)
+        elif isinstance(item, (dict, list)):
+            children[key] = item
+        else:
+            attrib[_qname(key, attribute=True)] = _string(key, item)
+
+    with _xml_strings(), xf.element(_qname(name), attrib, nsmap=nsmap):
+        if text:
+            with _xml_strings("text"):
+                xf.write(text)
+        for key in _ordered(children, child_order.get(name, ())):
+            items = children[key]
+            if isinstance(items, dict):
+                items = [items]
+            for index, item in enumerate(items):
+                try:
+                    _element(xf, key, item, child_order)
+                except ConversionError as e:
+                    e.path.insert(0, index)
+                    e.path.insert(0, key)
+                    raise
+
+
+def _ordered(children, order):
+    if not order:
+        return list(children)
+    known = [name for name in order if name in children]
+    if len(known) == len(children):
+        return known
+    return known + [name for name in children if name not in order]
+
+
+def _qname(name, attribute=False):
+    prefix, colon, local = name.rpartition(":")
+    if not NCNAME.fullmatch(local):
+        error = ConversionError(f"{name!r} isn't an XML name")
+        if attribute:
+            error.path.append(name)
+        raise error
+    if not colon:
+        # Unprefixed attributes are in no namespace.
+        return name if attribute else f"{{{PBCORE_NS}}}{name}"
+    uri = PREFIXES.get(prefix)
+    if uri is None:
+        raise ConversionError(f"Unknown namespace prefix {prefix!r}")
+    return f"{{{uri}}}{local}"
+
+
+@contextmanager
+def _xml_strings(key=None):
+    """Report lxml refusing to write a string as a `ConversionError`."""
+    try:
+        yield
+    except ConversionError:
+        raise
+    except ValueError as e:
+        error = ConversionError(str(e))
+        if key is not None:
+            error.path.append(key)
+        raise error from e
+
+
+def _string(key, value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    error = ConversionError(f"Expected a string, got {_kind(value)}")
+    error.path.append(key)
+    raise error
+
+
+def _kind(value):
+    return {dict: "an object", list: "an array", str: "a string"}.get(
+        type(value), "null" if value is None else type(value).__name__
+    )
+
+
+class OutputBuffer:
+    """A file-like object for `etree.xmlfile` that hands back what it got."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(data)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
@@ -1,116 +1,948 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Query
-from lxml import etree
-import httpx
+import asyncio
 import json
+from contextlib import asynccontextmanager, contextmanager
+from operator import itemgetter
+from typing import Literal
 
-app = FastAPI(title="PBCore Validation and Conversion API")
+from fastapi import (
+    FastAPI,
+    File,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+)
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
 
-# Placeholder paths
-XSD_PATH = "schemas/pbcore-2.1.xsd"
-XSL_PATH = "stylesheets/pbcore-xml-to-json.xsl"
-JSON_SCHEMA_PATH = "schemas/pbcore-schema.json"
+from app import batch, collection, core, process, tabular
+from app.cache import MISS, result_cache, result_key
+from app.config import MAX_VALIDATION_ERRORS, VERIFY_JSON
+from app.core import Engine, JSONConversionError, JSONParseError, XMLParseError
+from app.elements import element_tables
+from app.executor import Overloaded, work_pool
+from app.fetch import DocumentTooLarge, FetchError, NotModified, fetcher
+from app.index import (
+    MAX_RESULTS,
+    DuplicateKind,
+    HarvestNotFound,
+    IdentifierKind,
+    record_index,
+)
+from app.jobs import JobKind, JobNotDone, JobNotFound, jobs
+from app.metrics import MetricsMiddleware, document_size, exposition, stage
+from app.process import ProcessError
+from app.projection import ProjectionError, compile_projection, project
+from app.registry import json_schema_registry, schema_registry, stylesheet_registry
+from app.sessions import (
+    PatchError,
+    RevisionConflict,
+    SessionNotFound,
+    fragment_schema_registry,
+    sessions,
+    skeleton_schema_registry,
+)
+from app.tabular import Format, Table
+from app.upload import UploadError, receive
 
 
-@app.post("/validate/xml-file", tags=["XML Validation"])
-async def validate_xml(file: UploadFile = File(...)):
+def warm_up(fill=False):
+    """Compile the schemas and stylesheets and derive the element tables, so
+    that no request has to. With `fill`, compile every pooled copy of the XSDs
+    and stylesheet too, as gunicorn_conf.py does in the master process before
+    forking, so that the workers share them rather than each compiling its own.
+    """
+    for registry in (
+        schema_registry,
+        stylesheet_registry,
+        fragment_schema_registry,
+        skeleton_schema_registry,
+    ):
+        registry.load(fill)
+    # JSON Schema validators take far longer to compile, and as Python objects,
+    # are copied into a worker's own memory as soon as it uses them anyway.
+    json_schema_registry.load()
+    for version in schema_registry.paths:
+        element_tables(version)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Once per worker, before it accepts any requests. Nothing is left to do if
+    # the master already did it before forking.
+    warm_up()
+    yield
+    await fetcher.aclose()
+    work_pool.shutdown()
+
+
+app = FastAPI(title="PBCore Validation and Conversion API", lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+async def upload_document(request: Request):
+    """The XML document uploaded as `file`, parsed as it arrives (or as bytes,
+    for worker processes, which can't be sent a tree), its filename, and its
+    content digest if results are cached."""
+    with upload_errors():
+        upload = await receive(request, parse=not work_pool.processes)
+    digest = upload.digest if result_cache.enabled else None
+    return upload.document, upload.filename, digest
+
+
+@contextmanager
+def upload_errors():
     try:
-        pbcore_xml = etree.parse(file.file)
-        pbcore_schema = etree.XMLSchema(etree.parse(XSD_PATH))
-        pbcore_schema.assertValid(pbcore_xml)
-        return {"valid": True, "file": file.filename}
-    except etree.DocumentInvalid as e:
-        raise HTTPException(
-            status_code=422, detail=f"PBCore XML Validation Error: {str(e)}"
-        )
-    except etree.XMLSyntaxError as e:
-        raise HTTPException(status_code=422, detail=f"XML Parsing Error: {str(e)}")
+        yield
+    except UploadError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except DocumentTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
 
 
-@app.post("/validate/xml-url", tags=["XML Validation"])
-async def validate_xml_from_url(
-    url: str = Query(..., description="URL pointing to a PBCore XML document")
-):
+# Endpoints that read their upload with `upload_document` take it from the
+# request themselves, so FastAPI is told what the body looks like for the docs.
+XML_UPLOAD = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {
+                        "file": {
+                            "type": "string",
+                            "format": "binary",
+                            "description": "A PBCore XML document, "
+                            "which may be gzipped",
+                        }
+                    },
+                }
+            }
+        },
+    }
+}
+
+
+async def read_upload(file: UploadFile):
+    with stage("read"):
+        content = await file.read()
+    document_size(len(content))
+    return content
+
+
+def upload_stream(file: UploadFile):
+    """The upload's file, to be read as it is processed."""
+    document_size(file.size)
+    return file.file
+
+
+async def url_source(url: str, conditional=False):
+    """Fetch a document to hand to the work pool, and its content digest:
+    parsed as it downloads, or as bytes for worker processes. Raises
+    `NotModified` if fetching conditionally and it hasn't changed."""
+    with fetch_errors():
+        if work_pool.processes:
+            return await fetcher.fetch_bytes(url, conditional)
+        return await fetcher.fetch_xml(url, conditional)
+
+
+@contextmanager
+def fetch_errors():
     try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            response = await client.get(url)
-            response.raise_for_status()
-    except Exception as e:
+        yield
+    except FetchError as e:
         raise HTTPException(status_code=400, detail=f"Error fetching URL: {str(e)}")
+    except DocumentTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+
+async def cached(operation, source, digest, fn, *args, if_none_match=None):
+    """Run `fn(source, *args)` in the work pool, or take its result from the
+    cache. Returns the result and headers with its ETag and whether the cache
+    was hit.
+
+    Raises a 304 instead if `if_none_match` has the result's ETag.
+    """
+    if digest is None:
+        return await work_pool.run(fn, source, *args), {}
+    key = result_key(operation, digest)
+    headers = {"ETag": f'"{key}"'}
+    check_not_modified(headers, if_none_match)
+    if result_cache.enabled:
+        value = await cache_lookup(key)
+        if value is not MISS:
+            return value, {**headers, "X-Cache": "hit"}
+
+    value = await work_pool.run(fn, source, *args)
+    if result_cache.enabled:
+        await cache_put(key, value)
+        headers["X-Cache"] = "miss"
+    return value, headers
+
+
+async def cached_url(operation, url, fn, *args, if_none_match=None):
+    """`cached` for a document fetched from a URL.
 
+    If a result is cached for what the URL returned last time, the URL is
+    fetched conditionally, and if upstream answers 304 the result is reused
+    without downloading or parsing the document again.
+    """
+    conditional = False
+    digest = fetcher.last_digest(url)
+    if digest is not None and result_cache.enabled:
+        conditional = await cache_lookup(result_key(operation, digest)) is not MISS
     try:
-        pbcore_xml = etree.fromstring(response.content)
-        pbcore_schema = etree.XMLSchema(etree.parse(XSD_PATH))
-        pbcore_schema.assertValid(pbcore_xml)
-    except etree.XMLSchemaError as e:
-        raise HTTPException(status_code=422, detail=f"XML Validation Error: {str(e)}")
-    except etree.XMLSyntaxError as e:
-        raise HTTPException(status_code=422, detail=f"XML Parsing Error: {str(e)}")
+        source, digest = await url_source(url, conditional)
+    except NotModified as e:
+        key = result_key(operation, e.digest)
+        headers = {"ETag": f'"{key}"'}
+        check_not_modified(headers, if_none_match)
+        value = await cache_lookup(key)
+        if value is not MISS:
+            return value, {**headers, "X-Cache": "hit"}
+        # Evicted since we looked.
+        source, digest = await url_source(url)
+    return await cached(
+        operation, source, digest, fn, *args, if_none_match=if_none_match
+    )
+
+
+async def cache_lookup(key):
+    value = result_cache.get(key)
+    if value is MISS and result_cache.path is not None:
+        value = await asyncio.to_thread(result_cache.lookup, key)
+    return value
+
+
+async def cache_put(key, value):
+    if result_cache.path is not None:
+        await asyncio.to_thread(result_cache.put, key, value)
+    else:
+        result_cache.put(key, value)
+
+
+def json_response(json_str, headers):
+    """Send converted JSON as the converter wrote it, rather than parsing it into
+    Python objects for FastAPI to serialize again."""
+    with stage("serialize"):
+        content = json_str.encode()
+        if VERIFY_JSON:
+            try:
+                core.check_json(content)
+            except ValueError as e:
+                raise HTTPException(
+                    status_code=500, detail=f"Converter produced invalid JSON: {e}"
+                )
+    return Response(content=content, media_type="application/json", headers=headers)
+
+
+def check_not_modified(headers, if_none_match):
+    if if_none_match is None:
+        return
+    etags = {etag.strip().removeprefix("W/") for etag in if_none_match.split(",")}
+    if "*" in etags or headers["ETag"] in etags:
+        raise HTTPException(status_code=304, headers=headers)
+
+
+@app.get("/health", tags=["Health"])
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/metrics", tags=["Health"])
+async def metrics():
+    content, media_type = await asyncio.to_thread(exposition)
+    return Response(content=content, media_type=media_type)
+
+
+def max_errors_query():
+    return Query(
+        MAX_VALIDATION_ERRORS,
+        ge=1,
+        le=MAX_VALIDATION_ERRORS,
+        description="Most errors to report",
+    )
+
+
+@app.post("/validate/xml-file", tags=["XML Validation"], openapi_extra=XML_UPLOAD)
+async def validate_xml(
+    request: Request,
+    response: Response,
+    all_errors: bool = Query(
+        False, description="Report every error found, as structured objects"
+    ),
+    max_errors: int = max_errors_query(),
+    fail_fast: bool = Query(
+        False,
+        description="Only say whether the document is valid, as cheaply as possible",
+    ),
+    if_none_match: str | None = Header(None),
+):
+    try:
+        source, filename, digest = await upload_document(request)
+    except XMLParseError as e:
+        parse_error(e, all_errors, fail_fast)
+    operation, fn, args = validation_job(all_errors, max_errors, fail_fast)
+    result, headers = await cached(
+        operation, source, digest, fn, *args, if_none_match=if_none_match
+    )
+    check_valid(result, headers)
+    response.headers.update(headers)
+    return {"valid": True, "file": filename}
+
 
+@app.post("/validate/xml-url", tags=["XML Validation"])
+async def validate_xml_from_url(
+    response: Response,
+    url: str = Query(..., description="URL pointing to a PBCore XML document"),
+    all_errors: bool = Query(
+        False, description="Report every error found, as structured objects"
+    ),
+    max_errors: int = max_errors_query(),
+    fail_fast: bool = Query(
+        False,
+        description="Only say whether the document is valid, as cheaply as possible",
+    ),
+    if_none_match: str | None = Header(None),
+):
+    operation, fn, args = validation_job(all_errors, max_errors, fail_fast)
+    try:
+        result, headers = await cached_url(
+            operation, url, fn, *args, if_none_match=if_none_match
+        )
+    except XMLParseError as e:
+        parse_error(e, all_errors, fail_fast)
+    check_valid(result, headers)
+    response.headers.update(headers)
     return {
         "valid": True,
         "url": url,
     }
 
 
+def validation_job(all_errors, max_errors, fail_fast):
+    """The cache operation, function and extra arguments that validate a
+    document in the requested mode."""
+    if fail_fast:
+        return "validate-fast", core.is_valid, ()
+    if all_errors:
+        return f"validate-all:{max_errors}", core.validation_report, (None, max_errors)
+    return "validate", core.validation_error, ()
+
+
+def parse_error(error, all_errors, fail_fast):
+    """Raise a 422 for a document that was parsed before it got to a
+    `validation_job`, e.g. while it downloaded, as the job would have."""
+    if fail_fast:
+        check_valid(False, {})
+    if all_errors:
+        raise HTTPException(status_code=422, detail=core.parse_error_report(error))
+    raise HTTPException(status_code=422, detail=f"XML Parsing Error: {str(error)}")
+
+
+def check_valid(result, headers):
+    """Raise a 422 if a `validation_job` result says the document is invalid."""
+    if result is None or result is True:
+        return
+    if result is False:
+        result = "PBCore XML Validation Error"
+    raise HTTPException(status_code=422, detail=result, headers=headers)
+
+
+def harvest_query():
+    return Query(
+        None,
+        max_length=200,
+        description="Also add the records to the record index under this name",
+    )
+
+
+@app.post("/validate/xml-collection-file", tags=["XML Validation"])
+async def validate_xml_collection(
+    file: UploadFile = File(...), harvest: str | None = harvest_query()
+):
+    return StreamingResponse(
+        work_pool.iterate(collection.validate_collection, upload_stream(file), harvest),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.post("/validate/xml-batch", tags=["XML Validation"])
+async def validate_xml_batch(
+    files: list[UploadFile] = File(
+        ..., description="PBCore XML files, or zip or tar archives of them"
+    ),
+    stream: bool = Query(False, description="Stream results as NDJSON"),
+    harvest: str | None = harvest_query(),
+):
+    documents = batch.iter_documents(
+        [(file.filename, upload_stream(file)) for file in files]
+    )
+    results = batch.validate_documents(documents, harvest=harvest)
+    if not stream:
+        collected = sorted(
+            [result async for result in results], key=itemgetter("index")
+        )
+        return {"results": collected, "summary": batch.summarize(collected)}
+
+    # Wait for the first result before starting the response, so that a full
+    # work pool is still reported as a 503.
+    first = await anext(results, None)
+    return StreamingResponse(
+        _batch_lines(first, results), media_type="application/x-ndjson"
+    )
+
+
+async def _batch_lines(first, results, summarize=batch.summarize):
+    summary = summarize([])
+    if first is not None:
+        summarize([first], summary)
+        yield json.dumps(first) + "\n"
+    async for result in results:
+        summarize([result], summary)
+        yield json.dumps(result) + "\n"
+    yield json.dumps({"summary": summary}) + "\n"
+
+
 @app.post("/validate/json-file", tags=["JSON Validation"])
 async def validate_json(file: UploadFile = File(...)):
-    raise HTTPException(
-        status_code=400, detail="PBCore JSON validation not yet implemented"
-    )
+    await validate_json_document(await read_upload(file))
+    return {"valid": True, "file": file.filename}
 
 
 @app.post("/validate/json-url", tags=["JSON Validation"])
 async def validate_json_from_url(
     url: str = Query(..., description="URL pointing to a PBCore JSON document")
 ):
-    raise HTTPException(
-        status_code=400, detail="PBCore JSON validation not yet implemented"
+    with fetch_errors():
+        fetched = await fetcher.fetch_bytes(url)
+    await validate_json_document(fetched.document)
+    return {"valid": True, "url": url}
+
+
+async def validate_json_document(content):
+    try:
+        errors = await work_pool.run(core.json_validation_errors, content)
+    except JSONParseError as e:
+        raise HTTPException(status_code=422, detail=f"JSON Parsing Error: {str(e)}")
+    if errors:
+        raise HTTPException(
+            status_code=422,
+            detail={"message": "PBCore JSON Validation Error", "errors": errors},
+        )
+
+
+class Patch(BaseModel):
+    op: Literal["replace", "insert", "remove"]
+    path: str = Field(
+        ...,
+        description="Path of the element, e.g. "
+        "/pbcoreDescriptionDocument/pbcoreInstantiation[3]. "
+        "Insert puts the new element before the one there, or after the last of "
+        "its name if it's one past them",
     )
+    xml: str | None = Field(None, description="The new element, for replace and insert")
 
 
-@app.post("/convert/xml-to-json-file", tags=["Conversion"])
-async def convert_xml_to_json_from_file(file: UploadFile = File(...)):
+class SessionPatches(BaseModel):
+    patches: list[Patch]
+    revision: int | None = Field(
+        None,
+        description="Only apply the patches if the session is at this revision, "
+        "or else fail with 409",
+    )
+
+
+@contextmanager
+def session_errors():
     try:
-        pbcore_xml = etree.parse(file.file)
-        xslt_doc = etree.parse(XSL_PATH)
-        transform = etree.XSLT(xslt_doc)
-        json_str = str(transform(pbcore_xml))
-        return json.loads(json_str)
+        yield
+    except SessionNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except RevisionConflict as e:
+        raise HTTPException(
+            status_code=409, detail={"message": str(e), "revision": e.revision}
+        )
+    except PatchError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except XMLParseError as e:
+        raise HTTPException(status_code=422, detail=f"XML Parsing Error: {str(e)}")
+
+
+@app.post("/validate/xml-sessions", status_code=201, tags=["XML Validation Sessions"])
+async def create_validation_session(file: UploadFile = File(...)):
+    content = await read_upload(file)
+    with session_errors():
+        return await work_pool.run(sessions.create, content, threads=True)
+
+
+@app.get("/validate/xml-sessions/{session_id}", tags=["XML Validation Sessions"])
+async def get_validation_session(session_id: str, max_errors: int = max_errors_query()):
+    with session_errors():
+        return await work_pool.run(
+            sessions.report, session_id, max_errors, threads=True
+        )
+
+
+@app.patch("/validate/xml-sessions/{session_id}", tags=["XML Validation Sessions"])
+async def patch_validation_session(
+    session_id: str, body: SessionPatches, max_errors: int = max_errors_query()
+):
+    patches = [patch.model_dump(exclude_none=True) for patch in body.patches]
+    with session_errors():
+        return await work_pool.run(
+            sessions.patch,
+            session_id,
+            patches,
+            body.revision,
+            max_errors,
+            threads=True,
+        )
+
+
+@app.get(
+    "/validate/xml-sessions/{session_id}/document", tags=["XML Validation Sessions"]
+)
+async def get_validation_session_document(session_id: str):
+    with session_errors():
+        content = await work_pool.run(sessions.document, session_id, threads=True)
+    return Response(content=content, media_type="application/xml")
+
+
+@app.delete(
+    "/validate/xml-sessions/{session_id}",
+    status_code=204,
+    tags=["XML Validation Sessions"],
+)
+async def delete_validation_session(session_id: str):
+    with session_errors():
+        await work_pool.run(sessions.delete, session_id, threads=True)
+    return Response(status_code=204)
+
+
+@app.post("/convert/xml-to-json-file", tags=["Conversion"], openapi_extra=XML_UPLOAD)
+async def convert_xml_to_json_from_file(
+    request: Request,
+    engine: Engine = Query(Engine.xslt, description="Conversion engine"),
+    if_none_match: str | None = Header(None),
+):
+    try:
+        source, _, digest = await upload_document(request)
+        json_str, headers = await cached(
+            f"xml-to-json:{engine.value}",
+            source,
+            digest,
+            core.xml_to_json,
+            engine,
+            if_none_match=if_none_match,
+        )
+        return json_response(json_str, headers)
+    except (HTTPException, Overloaded):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/convert/xml-to-json-url", tags=["Conversion"])
 async def convert_xml_to_json_from_url(
-    url: str = Query(..., description="URL pointing to a PBCore XML document")
+    url: str = Query(..., description="URL pointing to a PBCore XML document"),
+    engine: Engine = Query(Engine.xslt, description="Conversion engine"),
+    if_none_match: str | None = Header(None),
 ):
     try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            response = await client.get(url)
-            response.raise_for_status()
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error fetching URL: {str(e)}")
-
-    try:
-        pbcore_xml = etree.fromstring(response.content)
-        xslt_doc = etree.parse(XSL_PATH)
-        transform = etree.XSLT(xslt_doc)
-        json_str = str(transform(pbcore_xml))
-        return json.loads(json_str)
+        json_str, headers = await cached_url(
+            f"xml-to-json:{engine.value}",
+            url,
+            core.xml_to_json,
+            engine,
+            if_none_match=if_none_match,
+        )
+        return json_response(json_str, headers)
+    except (HTTPException, Overloaded):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/convert/xml-to-json-collection-file", tags=["Conversion"])
+async def convert_xml_to_json_collection(
+    file: UploadFile = File(...),
+    engine: Engine = Query(Engine.xslt, description="Conversion engine"),
+    validate: bool = Query(
+        False,
+        description="Report records that don't validate instead of converting them",
+    ),
+):
+    return StreamingResponse(
+        work_pool.iterate(
+            collection.convert_collection, upload_stream(file), engine, validate
+        ),
+        media_type="application/x-ndjson",
+    )
+
+
 @app.post("/convert/json-to-xml", tags=["PBCore Conversion"])
 async def convert_json_to_xml(file: UploadFile = File(...)):
-    raise HTTPException(
-        status_code=400, detail="PBCore JSON to XML Conversion not yet implemented"
+    try:
+        pbcore_xml = await work_pool.run(core.json_to_xml, await read_upload(file))
+    except JSONParseError as e:
+        raise HTTPException(status_code=422, detail=f"JSON Parsing Error: {str(e)}")
+    except JSONConversionError as e:
+        raise HTTPException(
+            status_code=422, detail=f"PBCore JSON Conversion Error: {str(e)}"
+        )
+    return Response(content=pbcore_xml, media_type="application/xml")
+
+
+@app.post("/convert/json-to-xml-collection-file", tags=["PBCore Conversion"])
+async def convert_json_to_xml_collection(
+    file: UploadFile = File(
+        ..., description="NDJSON, one PBCore JSON document per line"
+    )
+):
+    return StreamingResponse(
+        work_pool.iterate(collection.json_to_xml_collection, upload_stream(file)),
+        media_type="application/xml",
     )
 
 
+@app.post("/convert/xml-to-table-file", tags=["Conversion"])
+async def convert_xml_to_table(
+    file: UploadFile = File(..., description="A PBCore XML collection or document"),
+    table: Table = Query(
+        Table.assets,
+        description="A row per record (assets), per instantiation, or per "
+        "essence track, keyed by record and asset identifier",
+    ),
+    format: Format = Query(Format.csv, description="Parquet needs pyarrow"),
+):
+    """Flatten records into a table, a column per element and attribute the
+    XSD allows, written as the collection is read."""
+    if format == Format.parquet and tabular.pyarrow is None:
+        raise HTTPException(
+            status_code=422,
+            detail="Parquet output needs pyarrow (pip install -e .[parquet])",
+        )
+    write = tabular.parquet_table if format == Format.parquet else tabular.csv_table
+    chunks = work_pool.iterate(write, upload_stream(file), table)
+    # Wait for the first rows before starting the response, so that a document
+    # that isn't XML at all gets a 422, and a full work pool a 503.
+    try:
+        first = await anext(chunks, b"")
+    except XMLParseError as e:
+        raise HTTPException(status_code=422, detail=f"XML Parsing Error: {str(e)}")
+    return StreamingResponse(
+        _prepend(first, chunks),
+        media_type=tabular.MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{table.value}.{format.value}"'
+        },
+    )
+
+
+async def _prepend(first, chunks):
+    yield first
+    async for chunk in chunks:
+        yield chunk
+
+
 @app.post("/convert/roundtrip/xml-json/file", tags=["PBCore Conversion"])
-async def validate_roundtrip(file: UploadFile = File(...)):
-    raise HTTPException(
-        status_code=400,
-        detail="PBCore XML-to-JSON round-trip validation not yet implemented",
+async def validate_roundtrip(
+    file: UploadFile = File(
+        ...,
+        description=(
+            "A PBCore XML document or collection, or a zip or tar archive of them"
+        ),
+    ),
+    engine: Engine = Query(Engine.xslt, description="Conversion engine"),
+):
+    results = batch.roundtrip_documents([(file.filename, upload_stream(file))], engine)
+    # Wait for the first result before starting the response, so that a full
+    # work pool is still reported as a 503.
+    first = await anext(results, None)
+    return StreamingResponse(
+        _batch_lines(first, results, batch.summarize_roundtrips),
+        media_type="application/x-ndjson",
+    )
+
+
+def paths_query():
+    return Query(
+        ...,
+        description="Paths from pbcoreDescriptionDocument to the fields to extract, "
+        "e.g. pbcoreTitle, pbcoreInstantiation/instantiationDuration or "
+        "pbcoreTitle/@titleType. Repeat the parameter or separate paths with commas",
     )
+
+
+@contextmanager
+def projection_errors():
+    try:
+        yield
+    except ProjectionError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except XMLParseError as e:
+        raise HTTPException(status_code=422, detail=f"XML Parsing Error: {str(e)}")
+
+
+@app.post("/extract/xml-file", tags=["Field Extraction"], openapi_extra=XML_UPLOAD)
+async def extract_fields(
+    request: Request,
+    paths: list[str] = paths_query(),
+    if_none_match: str | None = Header(None),
+):
+    """Only the fields at `paths` from a record, as a JSON object with a list of
+    what was found at each path, without converting the whole record."""
+    with projection_errors():
+        projection = compile_projection(paths)
+        source, _, digest = await upload_document(request)
+        json_str, headers = await cached(
+            f"extract:{','.join(projection.paths)}",
+            source,
+            digest,
+            project,
+            projection.paths,
+            if_none_match=if_none_match,
+        )
+    return json_response(json_str, headers)
+
+
+@app.post("/extract/xml-url", tags=["Field Extraction"])
+async def extract_fields_from_url(
+    url: str = Query(..., description="URL pointing to a PBCore XML document"),
+    paths: list[str] = paths_query(),
+    if_none_match: str | None = Header(None),
+):
+    with projection_errors():
+        projection = compile_projection(paths)
+        json_str, headers = await cached_url(
+            f"extract:{','.join(projection.paths)}",
+            url,
+            project,
+            projection.paths,
+            if_none_match=if_none_match,
+        )
+    return json_response(json_str, headers)
+
+
+@app.post("/extract/xml-collection-file", tags=["Field Extraction"])
+async def extract_collection_fields(
+    file: UploadFile = File(...), paths: list[str] = paths_query()
+):
+    """The fields at `paths` from each record of a pbcoreCollection, as NDJSON,
+    one line per record."""
+    with projection_errors():
+        projection = compile_projection(paths)
+    return StreamingResponse(
+        work_pool.iterate(
+            collection.project_collection, upload_stream(file), projection.paths
+        ),
+        media_type="application/x-ndjson",
+    )
+
+
+def operations_query():
+    return Query(
+        ["validate", "convert"],
+        description="What to do with the document: any of validate, hash, convert "
+        "and extract. Repeat the parameter or separate operations with commas",
+    )
+
+
+def process_job(operation_names, paths, engine, all_errors, max_errors, skip_invalid):
+    """The cache operation, and `process` with its extra arguments, for a
+    `/process` request."""
+    with process_errors():
+        operations = process.operations(operation_names, paths)
+        if process.Operation.extract in operations:
+            paths = compile_projection(paths).paths
+        else:
+            paths = ()
+    options = [
+        ",".join(operation.value for operation in operations),
+        engine.value,
+        f"all_errors={all_errors}:{max_errors}",
+        f"skip_invalid={skip_invalid}",
+        ",".join(paths),
+    ]
+    args = (operations, engine, paths, all_errors, max_errors, skip_invalid)
+    return f"process:{':'.join(options)}", process.process, args
+
+
+@contextmanager
+def process_errors():
+    try:
+        yield
+    except (ProcessError, ProjectionError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except XMLParseError as e:
+        raise HTTPException(status_code=422, detail=f"XML Parsing Error: {str(e)}")
+
+
+@app.post("/process/xml-file", tags=["Processing"], openapi_extra=XML_UPLOAD)
+async def process_xml(
+    request: Request,
+    operations: list[str] = operations_query(),
+    paths: list[str] = Query([], description="extract: the fields to extract"),
+    engine: Engine = Query(Engine.xslt, description="convert: conversion engine"),
+    all_errors: bool = Query(
+        False, description="validate: report every error found, as structured objects"
+    ),
+    max_errors: int = max_errors_query(),
+    skip_invalid: bool = Query(
+        False, description="Don't convert or extract from an invalid document"
+    ),
+    if_none_match: str | None = Header(None),
+):
+    """Run several operations on a document, uploaded and parsed only once, and
+    return what each one found in one JSON object."""
+    operation, fn, args = process_job(
+        operations, paths, engine, all_errors, max_errors, skip_invalid
+    )
+    with process_errors():
+        source, _, digest = await upload_document(request)
+        json_str, headers = await cached(
+            operation, source, digest, fn, *args, if_none_match=if_none_match
+        )
+    return json_response(json_str, headers)
+
+
+@app.post("/process/xml-url", tags=["Processing"])
+async def process_xml_from_url(
+    url: str = Query(..., description="URL pointing to a PBCore XML document"),
+    operations: list[str] = operations_query(),
+    paths: list[str] = Query([], description="extract: the fields to extract"),
+    engine: Engine = Query(Engine.xslt, description="convert: conversion engine"),
+    all_errors: bool = Query(
+        False, description="validate: report every error found, as structured objects"
+    ),
+    max_errors: int = max_errors_query(),
+    skip_invalid: bool = Query(
+        False, description="Don't convert or extract from an invalid document"
+    ),
+    if_none_match: str | None = Header(None),
+):
+    operation, fn, args = process_job(
+        operations, paths, engine, all_errors, max_errors, skip_invalid
+    )
+    with process_errors():
+        json_str, headers = await cached_url(
+            operation, url, fn, *args, if_none_match=if_none_match
+        )
+    return json_response(json_str, headers)
+
+
+@contextmanager
+def job_errors():
+    try:
+        yield
+    except JobNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except JobNotDone as e:
+        raise HTTPException(
+            status_code=409, detail={"message": str(e), "status": e.status}
+        )
+
+
+@app.post("/jobs/{kind}", status_code=202, tags=["Jobs"])
+async def submit_job(
+    kind: JobKind,
+    response: Response,
+    file: UploadFile = File(
+        ...,
+        description="A PBCore XML collection, NDJSON for json-to-xml-collection, "
+        "or for validate-batch and roundtrip, a document or a zip or tar archive",
+    ),
+    engine: Engine = Query(Engine.xslt, description="Conversion engine"),
+    validate: bool = Query(
+        False,
+        description="xml-to-json-collection: report records that don't validate "
+        "instead of converting them",
+    ),
+    harvest: str | None = harvest_query(),
+):
+    """Queue a long validation or conversion, returning its status at once.
+    Poll `/jobs/{id}` for its progress, then fetch `/jobs/{id}/result`."""
+    params = {"engine": engine.value, "validate": validate, "harvest": harvest}
+    status = await work_pool.run(
+        jobs.submit, kind, upload_stream(file), file.filename, params, threads=True
+    )
+    response.headers["Location"] = f"/jobs/{status['id']}"
+    return status
+
+
+@app.get("/jobs/{job_id}", tags=["Jobs"])
+async def get_job(job_id: str):
+    with job_errors():
+        return await work_pool.run(jobs.status, job_id, threads=True)
+
+
+@app.get("/jobs/{job_id}/result", tags=["Jobs"])
+async def get_job_result(job_id: str):
+    with job_errors():
+        path, media_type = await work_pool.run(jobs.result, job_id, threads=True)
+    return FileResponse(path, media_type=media_type)
+
+
+@app.delete("/jobs/{job_id}", status_code=204, tags=["Jobs"])
+async def delete_job(job_id: str):
+    with job_errors():
+        await work_pool.run(jobs.delete, job_id, threads=True)
+    return Response(status_code=204)
+
+
+@app.get("/index/records", tags=["Record Index"])
+async def lookup_records(
+    identifier: str = Query(
+        ..., description="A pbcoreIdentifier or instantiationIdentifier"
+    ),
+    kind: IdentifierKind | None = Query(None, description="Which kind of identifier"),
+):
+    """The indexed records holding an identifier."""
+    records = await work_pool.run(record_index.lookup, identifier, kind, threads=True)
+    return {"records": records}
+
+
+@app.get("/index/duplicates", tags=["Record Index"])
+async def find_duplicates(
+    kind: DuplicateKind = Query(
+        DuplicateKind.pbcore,
+        description="Records sharing an identifier of this kind, or their content",
+    ),
+    harvest: str | None = Query(
+        None, description="Only duplicates involving a record of this harvest"
+    ),
+    limit: int = Query(100, ge=1, le=MAX_RESULTS),
+    offset: int = Query(0, ge=0),
+):
+    duplicates = await work_pool.run(
+        record_index.duplicates, kind, harvest, limit, offset, threads=True
+    )
+    return {"duplicates": duplicates}
+
+
+@app.get("/index/harvests", tags=["Record Index"])
+async def list_harvests():
+    return {"harvests": await work_pool.run(record_index.harvests, threads=True)}
+
+
+@app.delete("/index/harvests/{name}", status_code=204, tags=["Record Index"])
+async def delete_harvest(name: str):
+    try:
+        await work_pool.run(record_index.delete_harvest, name, threads=True)
+    except HarvestNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return Response(status_code=204)
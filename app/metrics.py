@@ -0,0 +1,196 @@
+"""Prometheus metrics and per-stage timings.
+
+Every request is counted and timed by `MetricsMiddleware`, labelled with its
+route. Within a request, blocking steps are timed with `stage`, which adds to
+the request's `Timings` wherever the step runs: the event loop, a work pool
+thread, or a worker process (see `timed`). When the request finishes, its stage
+timings go into the stage histogram, and as it starts responding they are sent
+in a `Server-Timing` header.
+
+Under gunicorn, set PROMETHEUS_MULTIPROC_DIR (gunicorn_conf.py does) so that
+each worker writes its metrics to files there, and /metrics adds them all up,
+whichever worker serves it.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from app.config import SERVER_TIMING
+
+# Seconds, from a small document's validation to a large collection's.
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+SIZE_BUCKETS = tuple(2**n for n in range(10, 31, 2))
+
+REQUESTS = Counter(
+    "pbcore_requests_total", "Requests handled", ["endpoint", "method", "status"]
+)
+REQUEST_SECONDS = Histogram(
+    "pbcore_request_duration_seconds",
+    "Time to handle a request, streaming included",
+    ["endpoint", "method"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "pbcore_stage_duration_seconds",
+    "Time spent in each stage of handling a request",
+    ["endpoint", "stage"],
+    buckets=LATENCY_BUCKETS,
+)
+DOCUMENT_BYTES = Histogram(
+    "pbcore_document_size_bytes",
+    "Size of uploaded and fetched documents",
+    ["endpoint"],
+    buckets=SIZE_BUCKETS,
+)
+
+_timings = ContextVar("timings", default=None)
+
+
+class Timings:
+    """Seconds spent in each stage of one request, and the size of the
+    documents it handled."""
+
+    def __init__(self):
+        self.stages = {}
+        self.document_sizes = []
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0) + seconds
+
+    def merge(self, stages):
+        for stage, seconds in stages.items():
+            self.add(stage, seconds)
+
+    def server_timing(self):
+        return ", ".join(
+            f"{stage};dur={seconds * 1000:.3f}"
+            for stage, seconds in self.stages.items()
+        )
+
+
+def current_timings():
+    return _timings.get()
+
+
+@contextmanager
+def stage(name):
+    """Time a stage of the current request, if there is one."""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+def document_size(size):
+    """Record the size of a document the current request handles."""
+    timings = _timings.get()
+    if timings is not None and size is not None:
+        timings.document_sizes.append(size)
+
+
+def timed(fn, *args):
+    """Run a work pool job, returning its result along with the stages timed
+    while it ran, so that they can be added to the request's timings even if
+    it ran in another process."""
+    timings = Timings()
+    token = _timings.set(timings)
+    try:
+        return fn(*args), timings.stages
+    finally:
+        _timings.reset(token)
+
+
+class MetricsMiddleware:
+    """ASGI middleware that counts and times requests, and sends their stage
+    timings in a `Server-Timing` header."""
+
+    def __init__(self, app, server_timing=SERVER_TIMING):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = Timings()
+        token = _timings.set(timings)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_timings(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing and timings.stages:
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (b"server-timing", timings.server_timing().encode()),
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            _timings.reset(token)
+            route = scope.get("route")
+            # Unmatched paths share one label, so they can't blow up the
+            # number of series.
+            endpoint = getattr(route, "path", None) or "unmatched"
+            _observe(endpoint, scope["method"], status, start, timings)
+
+
+def _observe(endpoint, method, status, start, timings):
+    REQUESTS.labels(endpoint, method, str(status)).inc()
+    REQUEST_SECONDS.labels(endpoint, method).observe(time.perf_counter() - start)
+    for name, seconds in timings.stages.items():
+        STAGE_SECONDS.labels(endpoint, name).observe(seconds)
+    for size in timings.document_sizes:
+        DOCUMENT_BYTES.labels(endpoint).observe(size)
+
+
+def exposition():
+    """The metrics in Prometheus text format, and its content type. Adds up
+    every worker's metrics if running with PROMETHEUS_MULTIPROC_DIR."""
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,60 @@
+import queue
+import threading
+from contextlib import ExitStack, contextmanager
+
+
+class Pool:
+    """A bounded pool of objects that must not be used by two threads at once.
+
+    Objects are created lazily by `factory`, up to `size` of them. When all of
+    them are checked out, `acquire` blocks until one is returned.
+    """
+
+    def __init__(self, factory, size):
+        self._factory = factory
+        self._size = max(1, size)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @property
+    def created(self):
+        return self._created
+
+    @contextmanager
+    def acquire(self):
+        item = self._get()
+        try:
+            yield item
+        finally:
+            self._idle.put(item)
+
+    def prime(self):
+        """Create one object up front so the first request doesn't pay for it."""
+        with self.acquire():
+            pass
+
+    def fill(self):
+        """Create all `size` objects up front, e.g. before forking worker
+        processes that will share them."""
+        with ExitStack() as stack:
+            for _ in range(self._size):
+                stack.enter_context(self.acquire())
+
+    def _get(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self._size
+            if create:
+                self._created += 1
+        if not create:
+            return self._idle.get()
+        try:
+            return self._factory()
+        except BaseException:
+            with self._lock:
+                self._created -= 1
+            raise
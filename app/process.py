@@ -0,0 +1,109 @@
+"""Several operations on one PBCore XML document, parsed once.
+
+Validating a document and then converting it takes two requests, each of which
+uploads and parses it. `process` runs any of
+
+- `validate`, as `/validate/xml-file` does: the first error, or with
+  `all_errors`, a report of every one,
+- `hash`, the SHA-256 of the document as canonical XML (see
+  `core.canonical_digest`), which the record index compares records by,
+- `convert`, to PBCore JSON, as `/convert/xml-to-json-file` does, and
+- `extract`, the fields at a list of paths, as `/extract/xml-file` does,
+
+on the same parsed tree, and returns what each one found in one JSON object:
+`valid` and `error` (or `errors`), `hash`, `json` and `fields`. It is written
+as a string, like the conversion's own, which goes into it as it was written.
+With `skip_invalid`, a document that fails validation isn't converted or
+extracted from, and says so in `skipped`.
+"""
+
+import json
+from enum import Enum
+
+from app import core
+from app.config import MAX_VALIDATION_ERRORS
+from app.core import Engine, PBCoreError, parse_xml
+from app.metrics import stage
+from app.projection import compile_projection
+
+
+class Operation(str, Enum):
+    validate = "validate"
+    hash = "hash"
+    convert = "convert"
+    extract = "extract"
+
+
+# Operations that a document failing validation skips with `skip_invalid`.
+SKIPPABLE = (Operation.convert, Operation.extract)
+
+
+class ProcessError(PBCoreError):
+    """The operations asked for can't be run as asked."""
+
+
+def operations(values, paths=()):
+    """The operations in a list of names, each of which may also be a
+    comma-separated list, in the order they run.
+
+    Raises `ProcessError` for a name that isn't an operation, or if fields are
+    to be extracted without `paths`.
+    """
+    names = {name.strip() for value in values for name in value.split(",")}
+    names.discard("")
+    unknown = names - {operation.value for operation in Operation}
+    if unknown:
+        raise ProcessError(
+            f"Unknown operations: {', '.join(sorted(unknown))}. "
+            f"Expected any of {', '.join(operation.value for operation in Operation)}"
+        )
+    if not names:
+        raise ProcessError("No operations given")
+    if Operation.extract.value in names and not paths:
+        raise ProcessError("extract needs the paths of the fields to extract")
+    return tuple(operation for operation in Operation if operation.value in names)
+
+
+def process(
+    source,
+    operations,
+    engine=Engine.xslt,
+    paths=(),
+    all_errors=False,
+    max_errors=MAX_VALIDATION_ERRORS,
+    skip_invalid=False,
+    version=None,
+):
+    """Run `operations` on a PBCore XML document, parsing it only once, and
+    return what they found as a JSON object string."""
+    pbcore_xml = parse_xml(source)
+    fields = []
+    valid = True
+    if Operation.validate in operations:
+        if all_errors:
+            report = core.validation_report(pbcore_xml, version, max_errors)
+            valid = report is None
+            fields.append(("valid", json.dumps(valid)))
+            if report is not None:
+                fields.append(("errors", json.dumps(report)))
+        else:
+            error = core.validation_error(pbcore_xml, version)
+            valid = error is None
+            fields.append(("valid", json.dumps(valid)))
+            if error is not None:
+                fields.append(("error", json.dumps(error)))
+    if Operation.hash in operations:
+        with stage("transform"):
+            fields.append(("hash", json.dumps(core.canonical_digest(pbcore_xml))))
+    skipped = []
+    if not valid and skip_invalid:
+        skipped = [operation for operation in SKIPPABLE if operation in operations]
+        fields.append(
+            ("skipped", json.dumps([operation.value for operation in skipped]))
+        )
+    if Operation.convert in operations and Operation.convert not in skipped:
+        fields.append(("json", core.convert(pbcore_xml, engine)))
+    if Operation.extract in operations and Operation.extract not in skipped:
+        projection = compile_projection(paths, version)
+        fields.append(("fields", projection.extract(pbcore_xml)))
+    return "{" + ",".join(f'"{name}":{value}' for name, value in fields) + "}"
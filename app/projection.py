@@ -0,0 +1,132 @@
+"""Extracting a few fields from PBCore records without converting them whole.
+
+A projection is a list of paths from a pbcoreDescriptionDocument down to the
+elements wanted, e.g. `pbcoreTitle` or `pbcoreInstantiation/instantiationDuration`,
+optionally ending in an attribute, e.g. `pbcoreTitle/@titleType`. Paths are
+checked against the element tables derived from the XSD, and compiled to XPath
+once per projection. Each record becomes a JSON object with a list per path:
+of the elements found, as the XML-to-JSON conversion would write them, or of
+the attribute values.
+
+Records in a pbcoreCollection are read a record at a time as usual (see
+`app.collection`), but children of each record that no path goes into are
+dropped as soon as they have been parsed, rather than kept until the end of
+their record.
+"""
+
+import json
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+
+from lxml import etree
+
+from app import native
+from app.config import WORK_POOL_SIZE
+from app.core import PBCoreError, escape_controls, parse_xml
+from app.elements import ElementTables, element_tables
+from app.metrics import stage
+from app.pool import Pool
+from app.registry import schema_registry
+
+PBCORE_NS = "http://www.pbcore.org/PBCore/PBCoreNamespace.html"
+RECORD = "pbcoreDescriptionDocument"
+MAX_PATHS = 50
+# Compiled projections kept per worker, least recently used dropped first.
+CACHE_SIZE = 128
+ATTRIBUTE = re.compile(r"@[A-Za-z_][\w.-]*")
+
+
+class ProjectionError(PBCoreError):
+    """The paths asked for aren't paths through a PBCore record."""
+
+
+@dataclass(frozen=True)
+class Projection:
+    paths: tuple
+    # The children of a record that the paths go into.
+    top_level: frozenset
+    tables: ElementTables
+    xpaths: Pool
+
+    def extract(self, record):
+        """The fields of a parsed record (or document), as a JSON string."""
+        if isinstance(record, etree._ElementTree):
+            record = record.getroot()
+        if record.tag != f"{{{PBCORE_NS}}}{RECORD}":
+            raise ProjectionError(f"Expected a {RECORD}, not {record.tag}")
+        fields = []
+        with self.xpaths.acquire() as xpaths, stage("transform"):
+            for path, xpath in zip(self.paths, xpaths):
+                values = [
+                    (
+                        json.dumps(match, ensure_ascii=False)
+                        if isinstance(match, str)
+                        else native.element_json(match, self.tables)
+                    )
+                    for match in xpath(record)
+                ]
+                fields.append(f'{json.dumps(path)}:[{",".join(values)}]')
+        return escape_controls("{" + ",".join(fields) + "}")
+
+
+def compile_projection(paths, version=None):
+    """The projection of a list of paths, each of which may also be a
+    comma-separated list. Compiled projections are cached.
+
+    Raises `ProjectionError` if a path isn't a path through a PBCore record.
+    """
+    paths = tuple(
+        dict.fromkeys(
+            path.strip().strip("/").removeprefix(f"{RECORD}/")
+            for value in paths
+            for path in value.split(",")
+            if path.strip()
+        )
+    )
+    if not paths:
+        raise ProjectionError("No paths given")
+    if len(paths) > MAX_PATHS:
+        raise ProjectionError(f"At most {MAX_PATHS} paths can be given")
+    version = version or schema_registry.default
+    return _compile(paths, version, schema_registry.digest(version))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _compile(paths, version, digest):
+    tables = element_tables(version)
+    expressions = [_xpath(path, tables) for path in paths]
+    return Projection(
+        paths=paths,
+        top_level=frozenset(path.split("/")[0] for path in paths),
+        tables=tables,
+        xpaths=Pool(
+            lambda: [
+                etree.XPath(expression, namespaces={"p": PBCORE_NS})
+                for expression in expressions
+            ],
+            WORK_POOL_SIZE,
+        ),
+    )
+
+
+def _xpath(path, tables):
+    steps = path.split("/")
+    attribute = steps.pop() if steps[-1].startswith("@") else None
+    if attribute is not None and not ATTRIBUTE.fullmatch(attribute):
+        raise ProjectionError(f"{path!r}: {attribute!r} isn't an attribute name")
+    if not steps:
+        raise ProjectionError(f"{path!r}: an attribute of what?")
+    parent = RECORD
+    for step in steps:
+        if step not in tables.child_order.get(parent, ()):
+            raise ProjectionError(f"{path!r}: {parent} has no {step!r} element")
+        parent = step
+    expression = "/".join(f"p:{step}" for step in steps)
+    return f"{expression}/{attribute}" if attribute else expression
+
+
+def project(source, paths, version=None):
+    """Extract the fields at `paths` from a PBCore XML document, as a JSON
+    object string with a list of what was found at each path."""
+    return compile_projection(paths, version).extract(parse_xml(source))
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from jsonschema.validators import validator_for
+from lxml import etree
+from referencing import Registry as ResourceRegistry
+from referencing import Resource
+from referencing.jsonschema import DRAFT202012
+
+from app.config import (
+    DEFAULT_PBCORE_VERSION,
+    JSON_SCHEMA_PATHS,
+    JSON_SCHEMA_POOL_SIZE,
+    SCHEMA_POOL_SIZE,
+    XSD_PATHS,
+    XSL_PATH,
+    XSLT_POOL_SIZE,
+)
+from app.pool import Pool
+
+
+@dataclass
+class CompiledFile:
+    path: str
+    mtime_ns: int
+    digest: str
+    pool: Pool
+
+    def is_stale(self):
+        try:
+            return os.stat(self.path).st_mtime_ns != self.mtime_ns
+        except OSError:
+            # Keep serving what we have if the file is mid-replacement.
+            return False
+
+
+class Registry:
+    """Objects compiled from files on disk, loaded once per worker and shared
+    by all requests.
+
+    Compiled lxml objects keep per-call state, so each file is held in a small
+    pool of compiled copies and every request checks one out for as long as it
+    uses it. A file is recompiled when it changes on disk, or explicitly
+    through `reload`.
+    """
+
+    def __init__(self, paths, default, pool_size=1):
+        self.paths = dict(paths)
+        self.default = default
+        self.pool_size = pool_size
+        self._compiled = {}
+        self._lock = threading.Lock()
+
+    def compile(self, content, path):
+        raise NotImplementedError
+
+    def load(self, fill=False):
+        """Compile every known file that isn't compiled yet, and with `fill`,
+        as many copies of each as the pool holds."""
+        for name in self.paths:
+            compiled = self._get(name)
+            if fill:
+                compiled.pool.fill()
+
+    def reload(self, name=None):
+        """Recompile one file, or all of them, from disk."""
+        for key in [name] if name else list(self.paths):
+            compiled = self._compile(key)
+            with self._lock:
+                self._compiled[key] = compiled
+
+    @contextmanager
+    def acquire(self, name=None):
+        with self._get(name).pool.acquire() as compiled:
+            yield compiled
+
+    def digest(self, name=None):
+        """SHA-256 of the file, for keying anything derived from it."""
+        return self._get(name).digest
+
+    def _get(self, name=None):
+        name = name or self.default
+        compiled = self._compiled.get(name)
+        if compiled is None or compiled.is_stale():
+            with self._lock:
+                compiled = self._compiled.get(name)
+                if compiled is None or compiled.is_stale():
+                    compiled = self._compiled[name] = self._compile(name)
+        return compiled
+
+    def _compile(self, name):
+        path = self.paths[name]
+        mtime_ns = os.stat(path).st_mtime_ns
+        with open(path, "rb") as f:
+            content = f.read()
+
+        pool = Pool(lambda: self.compile(content, path), self.pool_size)
+        # Compile the first copy now, so a broken file fails at load time.
+        pool.prime()
+        return CompiledFile(
+            path=path,
+            mtime_ns=mtime_ns,
+            digest=hashlib.sha256(content).hexdigest(),
+            pool=pool,
+        )
+
+
+class SchemaRegistry(Registry):
+    """Compiled PBCore XSDs, keyed by PBCore version."""
+
+    def __init__(self, paths, default_version=DEFAULT_PBCORE_VERSION, pool_size=1):
+        super().__init__(paths, default_version, pool_size)
+
+    def compile(self, content, path):
+        return etree.XMLSchema(etree.fromstring(content, base_url=path))
+
+    def validator(self, version=None):
+        return self.acquire(version)
+
+
+class StylesheetRegistry(Registry):
+    """Compiled XSLT stylesheets, keyed by name.
+
+    lxml XSLT objects must not run two transforms at once, hence the pool.
+    """
+
+    def compile(self, content, path):
+        return etree.XSLT(etree.fromstring(content, base_url=path))
+
+    def transform(self, name=None):
+        return self.acquire(name)
+
+
+class JSONSchemaRegistry(Registry):
+    """Compiled PBCore JSON Schema validators, keyed by PBCore version.
+
+    The schema is checked against its metaschema when it is compiled, and its
+    `$ref`s are resolved up front: each one is replaced by the definition it
+    points to, unless that would recurse, which halves validation time.
+    Validators check formats.
+    """
+
+    def __init__(self, paths, default_version=DEFAULT_PBCORE_VERSION, pool_size=1):
+        super().__init__(paths, default_version, pool_size)
+
+    def compile(self, content, path):
+        schema = json.loads(content)
+        cls = validator_for(schema)
+        cls.check_schema(schema)
+        schema = _inline_refs(schema, schema.get("$defs", {}))
+        resource = Resource.from_contents(schema, default_specification=DRAFT202012)
+        resources = ResourceRegistry().with_resource("", resource).crawl()
+        return cls(schema, registry=resources, format_checker=cls.FORMAT_CHECKER)
+
+    def validator(self, version=None):
+        return self.acquire(version)
+
+
+def _inline_refs(node, defs, expanding=frozenset()):
+    if isinstance(node, list):
+        return [_inline_refs(item, defs, expanding) for item in node]
+    if not isinstance(node, dict):
+        return node
+    ref = node.get("$ref", "")
+    if len(node) == 1 and ref.startswith("#/$defs/"):
+        name = ref.removeprefix("#/$defs/")
+        if name not in expanding:
+            return _inline_refs(defs[name], defs, expanding | {name})
+    return {key: _inline_refs(value, defs, expanding) for key, value in node.items()}
+
+
+schema_registry = SchemaRegistry(XSD_PATHS, pool_size=SCHEMA_POOL_SIZE)
+stylesheet_registry = StylesheetRegistry(
+    {"xml-to-json": XSL_PATH}, "xml-to-json", pool_size=XSLT_POOL_SIZE
+)
+json_schema_registry = JSONSchemaRegistry(
+    JSON_SCHEMA_PATHS, pool_size=JSON_SCHEMA_POOL_SIZE
+)
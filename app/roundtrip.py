@@ -0,0 +1,149 @@
+"""Round-trip checks of the PBCore XML to JSON conversion.
+
+A record is converted to PBCore JSON and back to XML, and both sides are
+canonicalized with exclusive C14N, without comments. If the canonical forms
+differ, the two trees are compared element by element to say what was lost,
+added or altered on the way.
+
+Exclusive C14N 1.0 is done by libxml2 and is an order of magnitude faster
+than lxml's C14N 2.0, but it keeps whitespace, so parse the original without
+blank text (`remove_blank_text=True`) for identical records to compare equal.
+
+Siblings are matched up by name, the n-th of a name on one side with the n-th
+of that name on the other, so children that are written back in XSD order
+don't count as changes. Text is compared with its whitespace normalized.
+"""
+
+from itertools import zip_longest
+
+from lxml import etree
+
+MAX_DIFFERENCES = 100
+
+
+class _Full(Exception):
+    pass
+
+
+def canonicalize(pbcore_xml):
+    """Exclusive C14N form of a parsed document or element, without comments."""
+    return etree.tostring(
+        pbcore_xml, method="c14n", exclusive=True, with_comments=False
+    )
+
+
+def compare(original, roundtripped, limit=MAX_DIFFERENCES):
+    """Compare a parsed record with its round-tripped version.
+
+    Returns whether their canonical forms are identical, whether the record
+    came back without losing or altering anything, and the differences found:
+    at most `limit` of them, with "truncated" set if there were more.
+    """
+    expected = canonicalize(original)
+    actual = canonicalize(roundtripped)
+    if expected == actual:
+        return {"identical": True, "lossless": True, "differences": []}
+
+    differences = []
+    expected, actual = _root(original), _root(roundtripped)
+    try:
+        if expected.tag == actual.tag:
+            _compare(expected, actual, f"/{_name(expected)}", differences, limit)
+        else:
+            _add(differences, limit, f"/{_name(expected)}", "lost")
+            _add(differences, limit, f"/{_name(actual)}", "added")
+    except _Full:
+        pass
+    result = {
+        "identical": False,
+        "lossless": not differences,
+        "differences": differences[:limit],
+    }
+    if len(differences) > limit:
+        result["truncated"] = True
+    return result
+
+
+def _compare(expected, actual, path, differences, limit):
+    for name, value in expected.attrib.items():
+        _compare_values(
+            f"{path}/@{_attribute_name(expected, name)}",
+            value,
+            actual.get(name),
+            differences,
+            limit,
+        )
+    for name, value in actual.attrib.items():
+        if name not in expected.attrib:
+            _compare_values(
+                f"{path}/@{_attribute_name(actual, name)}",
+                None,
+                value,
+                differences,
+                limit,
+            )
+    _compare_values(
+        f"{path}/text()",
+        _normalize(expected.text),
+        _normalize(actual.text),
+        differences,
+        limit,
+    )
+
+    children = {}
+    for side, parent in enumerate((expected, actual)):
+        for child in parent.iterchildren(tag=etree.Element):
+            children.setdefault(child.tag, ([], []))[side].append(child)
+    for expected_children, actual_children in children.values():
+        pairs = zip_longest(expected_children, actual_children)
+        for position, (expected_child, actual_child) in enumerate(pairs, 1):
+            child = expected_child if expected_child is not None else actual_child
+            child_path = f"{path}/{_name(child)}[{position}]"
+            if actual_child is None:
+                _add(differences, limit, child_path, "lost")
+            elif expected_child is None:
+                _add(differences, limit, child_path, "added")
+            else:
+                _compare(expected_child, actual_child, child_path, differences, limit)
+
+
+def _compare_values(path, expected, actual, differences, limit):
+    if expected == actual or (not expected and not actual):
+        return
+    if not actual:
+        _add(differences, limit, path, "lost", expected=expected)
+    elif not expected:
+        _add(differences, limit, path, "added", actual=actual)
+    else:
+        _add(differences, limit, path, "altered", expected=expected, actual=actual)
+
+
+def _add(differences, limit, path, change, **values):
+    differences.append({"path": path, "change": change, **values})
+    if len(differences) > limit:
+        raise _Full
+
+
+def _root(pbcore_xml):
+    if isinstance(pbcore_xml, etree._ElementTree):
+        return pbcore_xml.getroot()
+    return pbcore_xml
+
+
+def _normalize(text):
+    return " ".join(text.split()) if text else ""
+
+
+def _name(element):
+    local = etree.QName(element).localname
+    return f"{element.prefix}:{local}" if element.prefix else local
+
+
+def _attribute_name(element, name):
+    qname = etree.QName(name)
+    if qname.namespace is None:
+        return name
+    for prefix, uri in element.nsmap.items():
+        if prefix and uri == qname.namespace:
+            return f"{prefix}:{qname.localname}"
+    return name
@@ -0,0 +1,628 @@
+"""Validation sessions: re-validating a document part by part as it's edited.
+
+A client registers a pbcoreDescriptionDocument once, then sends patches that
+replace, insert or remove elements by path, and gets back the validity of the
+whole document after each one. Only the parts a patch touches are validated
+again, so checking an edit costs about as much as the edit is big, however big
+the record is.
+
+The parts are the children of the pbcoreDescriptionDocument: its titles,
+instantiations and so on. Each is validated on its own, in place, against a
+copy of the XSD that also declares it as a global element. The document's own
+attributes and the order and number of its children are validated against a
+copy in which those children may hold anything, using a stand-in document of
+empty children. A document is valid exactly when all of these checks pass,
+and they find the same errors as validating it whole, along with any that a
+single pass over the whole document would have stopped short of. Error paths
+are worked out when the state is reported, so they follow the document as it
+changes; line numbers are left out, as they no longer mean anything once it
+has been patched.
+
+Sessions are kept in each worker's memory. With PBCORE_SESSION_PATH set (as
+gunicorn_conf.py does), each session's document and the patches made to it
+are also stored in a SQLite database that all workers share, so that whichever
+worker gets a request can carry on with the session, replaying any patches it
+hasn't seen. A fresh copy of the document is stored every `SNAPSHOT_EVERY`
+revisions, so that replaying never takes long.
+"""
+
+import copy
+import json
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import NamedTuple
+
+from lxml import etree
+
+from app import core
+from app.config import (
+    MAX_VALIDATION_ERRORS,
+    SCHEMA_POOL_SIZE,
+    SESSION_PATH,
+    SESSION_SIZE,
+    SESSION_TTL,
+    XSD_PATHS,
+)
+from app.core import PBCoreError, XMLParseError
+from app.database import SharedDatabase
+from app.elements import XSD, element_tables, local_name
+from app.metrics import stage
+from app.registry import SchemaRegistry
+
+PBCORE_NS = "http://www.pbcore.org/PBCore/PBCoreNamespace.html"
+ROOT = "pbcoreDescriptionDocument"
+OPERATIONS = ("replace", "insert", "remove")
+SNAPSHOT_EVERY = 100
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, version TEXT,"
+    " base BLOB NOT NULL, base_revision INTEGER NOT NULL,"
+    " revision INTEGER NOT NULL, used REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS patches (session TEXT NOT NULL,"
+    " revision INTEGER NOT NULL, patches TEXT NOT NULL,"
+    " PRIMARY KEY (session, revision))",
+    "CREATE INDEX IF NOT EXISTS sessions_used ON sessions (used)",
+)
+
+_STEP = re.compile(r"([A-Za-z_][\w.-]*)(?:\[([1-9][0-9]*)\])?")
+
+
+class SessionNotFound(PBCoreError):
+    """No session with that ID, or it has expired."""
+
+
+class PatchError(PBCoreError):
+    """A patch can't be applied, or the document can't be used for a session."""
+
+
+class RevisionConflict(PBCoreError):
+    """The session isn't at the revision the patches were written for."""
+
+    def __init__(self, revision):
+        super().__init__(f"Session is at revision {revision}")
+        self.revision = revision
+
+
+def fragment_schema(xsd):
+    """A copy of a PBCore XSD that also declares each child of
+    pbcoreDescriptionDocument as a global element, so that it can be validated
+    on its own."""
+    xsd = copy.deepcopy(xsd)
+    for element in _document_children(xsd):
+        declaration = copy.deepcopy(element)
+        declaration.attrib.pop("minOccurs", None)
+        declaration.attrib.pop("maxOccurs", None)
+        xsd.append(declaration)
+    return xsd
+
+
+def skeleton_schema(xsd):
+    """A copy of a PBCore XSD in which the children of pbcoreDescriptionDocument
+    may hold anything, so that validating a document of empty children checks
+    only the document's attributes and their order and number."""
+    xsd = copy.deepcopy(xsd)
+    for element in _document_children(xsd):
+        element.attrib.pop("type", None)
+        for definition in element.findall(XSD + "complexType") + element.findall(
+            XSD + "simpleType"
+        ):
+            element.remove(definition)
+    return xsd
+
+
+def _document_children(xsd):
+    root = xsd.find(f"{XSD}element[@name='{ROOT}']")
+    document_type = xsd.find(
+        f"{XSD}complexType[@name='{local_name(root.get('type'))}']"
+    )
+    return [
+        element
+        for element in document_type.find(XSD + "sequence").iterfind(XSD + "element")
+        if element.get("name")
+    ]
+
+
+class FragmentSchemaRegistry(SchemaRegistry):
+    """PBCore XSDs that can validate a child of pbcoreDescriptionDocument on
+    its own (see `fragment_schema`)."""
+
+    def compile(self, content, path):
+        xsd = etree.fromstring(content, base_url=path)
+        return etree.XMLSchema(fragment_schema(xsd))
+
+
+class SkeletonSchemaRegistry(SchemaRegistry):
+    """PBCore XSDs that validate a pbcoreDescriptionDocument's attributes and
+    children, but not what's in them (see `skeleton_schema`)."""
+
+    def compile(self, content, path):
+        xsd = etree.fromstring(content, base_url=path)
+        return etree.XMLSchema(skeleton_schema(xsd))
+
+
+fragment_schema_registry = FragmentSchemaRegistry(XSD_PATHS, pool_size=SCHEMA_POOL_SIZE)
+skeleton_schema_registry = SkeletonSchemaRegistry(XSD_PATHS, pool_size=SCHEMA_POOL_SIZE)
+
+
+class Change(NamedTuple):
+    """What applying some patches did: how to undo it, which children of the
+    document need validating again, which ones are gone, and whether the
+    document's children changed."""
+
+    undo: list
+    touched: list
+    removed: list
+    reshaped: bool
+
+
+class Session:
+    """A registered pbcoreDescriptionDocument and the errors in each part of it.
+
+    Not thread-safe: hold `lock` while using it.
+    """
+
+    def __init__(self, id, pbcore_xml, version=None, revision=0):
+        root = pbcore_xml.getroot() if hasattr(pbcore_xml, "getroot") else pbcore_xml
+        if root.tag != f"{{{PBCORE_NS}}}{ROOT}":
+            raise PatchError(f"Expected a {ROOT}, not {etree.QName(root).localname}")
+        self.id = id
+        self.root = root
+        self.version = version
+        self.revision = revision
+        self.lock = threading.Lock()
+        self.used = time.monotonic()
+        # Child of the document -> its errors, as (element, entry) pairs.
+        self._errors = {}
+        self._skeleton_errors = []
+        self._check_skeleton()
+        for child in self.root.iterchildren(tag=etree.Element):
+            self._check_child(child)
+
+    def apply(self, patches):
+        """Apply a list of patches, each a dict with an "op" (replace, insert
+        or remove), a "path" like /pbcoreDescriptionDocument/pbcoreTitle[2],
+        and for replace and insert the new element as "xml".
+
+        Either every patch is applied or, raising `PatchError`, none are.
+        Returns a `Change` to `revalidate` or `undo`.
+        """
+        change = Change([], [], [], False)
+        try:
+            for number, patch in enumerate(patches, 1):
+                try:
+                    change = self._apply(patch, change)
+                except PatchError as e:
+                    raise PatchError(f"Patch {number}: {e}") from e
+        except BaseException:
+            self.undo(change)
+            raise
+        return change
+
+    def undo(self, change):
+        for undo in reversed(change.undo):
+            undo()
+
+    def revalidate(self, change):
+        """Validate what a `Change` touched, and move on to the next revision."""
+        for child in change.removed:
+            self._errors.pop(child, None)
+        if change.reshaped:
+            self._check_skeleton()
+        for child in dict.fromkeys(change.touched):
+            if child.getparent() is self.root:
+                self._check_child(child)
+        self.revision += 1
+
+    def report(self, limit=MAX_VALIDATION_ERRORS):
+        """The validity of the whole document, and at most `limit` of its
+        errors."""
+        entries = list(self._skeleton_errors)
+        for child in self.root.iterchildren(tag=etree.Element):
+            entries.extend(self._errors.get(child, ()))
+        return {
+            "session": self.id,
+            "revision": self.revision,
+            "valid": not entries,
+            "error_count": len(entries),
+            "errors": [
+                {"path": core.element_path(element), **entry}
+                for element, entry in entries[:limit]
+            ],
+        }
+
+    def document(self):
+        return etree.tostring(self.root, xml_declaration=True, encoding="UTF-8")
+
+    def _apply(self, patch, change):
+        op, path = patch.get("op"), patch.get("path")
+        if op not in OPERATIONS:
+            raise PatchError(f"Unknown op {op!r}, expected one of {OPERATIONS}")
+        if not isinstance(path, str):
+            raise PatchError('Expected a "path"')
+        parent, name, position, target = self._resolve(path)
+        if parent is None:
+            raise PatchError(f"Can't {op} the {ROOT} itself")
+        if op == "remove":
+            if target is None:
+                raise PatchError(f"No element at {path}")
+            index = parent.index(target)
+            parent.remove(target)
+            change.undo.append(lambda: parent.insert(index, target))
+            return self._changed(change, parent, target, removed=True)
+
+        new = _fragment(patch.get("xml"))
+        if op == "replace":
+            if target is None:
+                raise PatchError(f"No element at {path}")
+            parent.replace(target, new)
+            change.undo.append(lambda: parent.replace(new, target))
+            change = self._changed(change, parent, target, True, False)
+            return self._changed(change, parent, new, False, new.tag != target.tag)
+
+        if etree.QName(new).localname != name:
+            raise PatchError(f"Can't insert a {etree.QName(new).localname} at {path}")
+        if target is not None:
+            target.addprevious(new)
+        else:
+            self._append(parent, name, position, new, path)
+        change.undo.append(lambda: parent.remove(new))
+        return self._changed(change, parent, new)
+
+    def _changed(self, change, parent, element, removed=False, reshaped=True):
+        if parent is self.root:
+            if removed:
+                change.removed.append(element)
+            else:
+                change.touched.append(element)
+            return change._replace(reshaped=change.reshaped or reshaped)
+        # Deeper down, only the document's child above the change is affected.
+        while parent.getparent() is not self.root:
+            parent = parent.getparent()
+        change.touched.append(parent)
+        return change
+
+    def _resolve(self, path):
+        """The parent of the element a path points to, the element's name and
+        position, and the element itself, or None if there isn't one."""
+        steps = path.strip("/").split("/")
+        if steps[0] != ROOT:
+            raise PatchError(f"Expected a path starting /{ROOT}, not {path}")
+        parent, element = None, self.root
+        name, position = ROOT, 1
+        for step in steps[1:]:
+            match = _STEP.fullmatch(step)
+            if match is None:
+                raise PatchError(f"Can't make sense of {step!r} in {path}")
+            if element is None:
+                raise PatchError(f"No element at {path}")
+            parent = element
+            name, position = match[1], int(match[2] or 1)
+            siblings = parent.findall(f"{{{PBCORE_NS}}}{name}")
+            element = siblings[position - 1] if position <= len(siblings) else None
+        return parent, name, position, element
+
+    def _append(self, parent, name, position, new, path):
+        """Insert a new element after the last of its name, or where the XSD
+        puts it if it's the first one."""
+        siblings = parent.findall(f"{{{PBCORE_NS}}}{name}")
+        if position != len(siblings) + 1:
+            raise PatchError(
+                f"Can't insert at {path}: there are only {len(siblings)} {name}"
+            )
+        if siblings:
+            siblings[-1].addnext(new)
+            return
+        order = element_tables(self.version).child_order.get(
+            etree.QName(parent).localname, ()
+        )
+        rank = {child: i for i, child in enumerate(order)}
+        last = rank.get(name, len(order))
+        index = 0
+        for i, child in enumerate(parent):
+            if not isinstance(child.tag, str):
+                continue
+            if rank.get(etree.QName(child).localname, len(order)) < last:
+                index = i + 1
+        parent.insert(index, new)
+
+    def _check_child(self, child):
+        with (
+            fragment_schema_registry.validator(self.version) as schema,
+            stage("validate"),
+        ):
+            if schema.validate(child):
+                self._errors.pop(child, None)
+                return
+            self._errors[child] = [
+                _entry(entry, child, child)
+                for entry in schema.error_log.filter_from_errors()
+            ]
+
+    def _check_skeleton(self):
+        children = list(self.root.iterchildren(tag=etree.Element))
+        skeleton = etree.Element(self.root.tag, self.root.attrib, nsmap=self.root.nsmap)
+        for child in children:
+            etree.SubElement(skeleton, child.tag)
+        with (
+            skeleton_schema_registry.validator(self.version) as schema,
+            stage("validate"),
+        ):
+            if schema.validate(skeleton):
+                self._skeleton_errors = []
+                return
+            entries = schema.error_log.filter_from_errors()
+        self._skeleton_errors = []
+        for entry in entries:
+            element, entry = _entry(entry, skeleton, skeleton)
+            if element is not skeleton:
+                element = children[skeleton.index(element)]
+            else:
+                element = self.root
+            self._skeleton_errors.append((element, entry))
+
+
+def _fragment(xml):
+    """Parse a patch's new element."""
+    if not isinstance(xml, str):
+        raise PatchError('Expected the new element as "xml"')
+    try:
+        element = core.parse_xml(xml.encode())
+    except XMLParseError as e:
+        raise PatchError(f"XML Parsing Error: {e}") from e
+    if etree.QName(element).namespace != PBCORE_NS:
+        raise PatchError(f"Expected an element in the {PBCORE_NS} namespace")
+    return element
+
+
+def _entry(entry, root, default):
+    """An error log entry as the element it's about and a dict of the rest.
+
+    libxml2 gives paths from the root it validated, like /*/*[8]/*[2], which
+    may be an element inside the document; look them up from there.
+    """
+    element = default
+    if entry.path and entry.path.startswith("/*"):
+        nodes = root.xpath("." + entry.path[2:])
+        if nodes and isinstance(nodes[0], etree._Element):
+            element = nodes[0]
+    return element, {
+        "domain": entry.domain_name,
+        "type": entry.type_name,
+        "message": entry.message,
+    }
+
+
+class SessionStore:
+    """Sessions' documents and patches in a SQLite database shared by every
+    worker on a host."""
+
+    def __init__(self, path):
+        self.path = path
+        self.db = SharedDatabase(path, SCHEMA)
+
+    def create(self, id, version, content, ttl):
+        now = time.time()
+        with self.db.transaction() as db:
+            expired = [
+                row[0]
+                for row in db.execute(
+                    "SELECT id FROM sessions WHERE used < ?", (now - ttl,)
+                )
+            ]
+            for old in expired:
+                self._delete(db, old)
+            db.execute(
+                "INSERT INTO sessions (id, version, base, base_revision,"
+                " revision, used) VALUES (?, ?, ?, 0, 0, ?)",
+                (id, version, content, now),
+            )
+
+    def load(self, id, after, ttl):
+        """A session's state for a worker that has it at revision `after`
+        (-1 if not at all): its PBCore version and revision, its stored
+        document and that document's revision if it's needed, and the patches
+        to apply on top as a list of (revision, patches) pairs. None if there's
+        no such session, or it has gone unused for more than `ttl` seconds."""
+        now = time.time()
+        with self.db.connection() as db:
+            row = db.execute(
+                "SELECT version, base_revision, revision FROM sessions"
+                " WHERE id = ? AND used >= ?",
+                (id, now - ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            version, base_revision, revision = row
+            db.execute("UPDATE sessions SET used = ? WHERE id = ?", (now, id))
+            base = None
+            if after < base_revision:
+                (base,) = db.execute(
+                    "SELECT base FROM sessions WHERE id = ?", (id,)
+                ).fetchone()
+                after = base_revision
+            patches = [
+                (patch_revision, json.loads(patch))
+                for patch_revision, patch in db.execute(
+                    "SELECT revision, patches FROM patches"
+                    " WHERE session = ? AND revision > ? ORDER BY revision",
+                    (id, after),
+                )
+            ]
+        return {
+            "version": version,
+            "revision": revision,
+            "base": base,
+            "base_revision": base_revision,
+            "patches": patches,
+        }
+
+    def append(self, id, revision, patches, snapshot=None):
+        """Store the patches that made a session's `revision`, and optionally
+        the document as it now is. Returns False, storing nothing, if another
+        worker got to that revision first, or the session is gone."""
+        with self.db.transaction() as db:
+            updated = db.execute(
+                "UPDATE sessions SET revision = ?, used = ?"
+                " WHERE id = ? AND revision = ?",
+                (revision, time.time(), id, revision - 1),
+            ).rowcount
+            if not updated:
+                return False
+            db.execute(
+                "INSERT INTO patches (session, revision, patches) VALUES (?, ?, ?)",
+                (id, revision, json.dumps(patches)),
+            )
+            if snapshot is not None:
+                db.execute(
+                    "UPDATE sessions SET base = ?, base_revision = ? WHERE id = ?",
+                    (snapshot, revision, id),
+                )
+                db.execute(
+                    "DELETE FROM patches WHERE session = ? AND revision <= ?",
+                    (id, revision),
+                )
+        return True
+
+    def delete(self, id):
+        with self.db.transaction() as db:
+            return self._delete(db, id)
+
+    def _delete(self, db, id):
+        db.execute("DELETE FROM patches WHERE session = ?", (id,))
+        return db.execute("DELETE FROM sessions WHERE id = ?", (id,)).rowcount > 0
+
+
+class Sessions:
+    """Validation sessions, kept in this worker's memory, least recently used
+    first out, and in a shared `SessionStore` if given a path.
+
+    All methods block, and are meant to be run in the work pool's threads, as
+    the documents live in this process.
+    """
+
+    def __init__(self, size, ttl, path=None):
+        self.size = size
+        self.ttl = ttl
+        self.store = SessionStore(path) if path is not None else None
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, content, version=None):
+        """Register a document, given as bytes, returning its first report."""
+        session = Session(uuid.uuid4().hex, core.parse_xml(content), version)
+        if self.store is not None:
+            self.store.create(session.id, version, content, self.ttl)
+        self._remember(session)
+        return session.report()
+
+    def report(self, id, limit=MAX_VALIDATION_ERRORS):
+        session = self._get(id)
+        with session.lock:
+            self._catch_up(session)
+            return session.report(limit)
+
+    def document(self, id):
+        session = self._get(id)
+        with session.lock:
+            self._catch_up(session)
+            return session.document()
+
+    def patch(self, id, patches, revision=None, limit=MAX_VALIDATION_ERRORS):
+        """Apply a list of patches (see `Session.apply`) and report the
+        result. With `revision`, raise `RevisionConflict` unless that's the
+        revision the session is at."""
+        session = self._get(id)
+        with session.lock:
+            while True:
+                self._catch_up(session)
+                if revision is not None and revision != session.revision:
+                    raise RevisionConflict(session.revision)
+                change = session.apply(patches)
+                if self._store(session, patches):
+                    break
+                # Another worker patched the session first.
+                session.undo(change)
+            session.revalidate(change)
+            return session.report(limit)
+
+    def delete(self, id):
+        with self._lock:
+            found = self._memory.pop(id, None) is not None
+        if self.store is not None:
+            found = self.store.delete(id) or found
+        if not found:
+            raise SessionNotFound(f"No session {id}")
+
+    def _get(self, id):
+        with self._lock:
+            session = self._memory.get(id)
+            if session is not None:
+                if time.monotonic() - session.used > self.ttl:
+                    del self._memory[id]
+                    session = None
+                else:
+                    self._memory.move_to_end(id)
+                    session.used = time.monotonic()
+        if session is not None:
+            return session
+        if self.store is not None:
+            state = self.store.load(id, -1, self.ttl)
+            if state is not None:
+                session = Session(
+                    id,
+                    core.parse_xml(state["base"]),
+                    state["version"],
+                    state["base_revision"],
+                )
+                self._replay(session, state["patches"])
+                return self._remember(session)
+        raise SessionNotFound(f"No session {id}")
+
+    def _catch_up(self, session):
+        """Apply patches other workers made to a session since this one last
+        saw it."""
+        if self.store is None:
+            return
+        state = self.store.load(session.id, session.revision, self.ttl)
+        if state is None:
+            with self._lock:
+                self._memory.pop(session.id, None)
+            raise SessionNotFound(f"No session {session.id}")
+        if state["base"] is not None:
+            fresh = Session(
+                session.id,
+                core.parse_xml(state["base"]),
+                session.version,
+                state["base_revision"],
+            )
+            session.root, session.revision = fresh.root, fresh.revision
+            session._errors = fresh._errors
+            session._skeleton_errors = fresh._skeleton_errors
+        self._replay(session, state["patches"])
+
+    def _replay(self, session, patches):
+        for revision, patch in patches:
+            session.revalidate(session.apply(patch))
+            session.revision = revision
+
+    def _store(self, session, patches):
+        if self.store is None:
+            return True
+        revision = session.revision + 1
+        snapshot = None
+        if revision % SNAPSHOT_EVERY == 0:
+            snapshot = session.document()
+        return self.store.append(session.id, revision, patches, snapshot)
+
+    def _remember(self, session):
+        with self._lock:
+            session = self._memory.setdefault(session.id, session)
+            self._memory.move_to_end(session.id)
+            while len(self._memory) > self.size:
+                self._memory.popitem(last=False)
+        return session
+
+
+sessions = Sessions(SESSION_SIZE, SESSION_TTL, path=SESSION_PATH)
@@ -0,0 +1,268 @@
+"""Flattening PBCore records into tables, as CSV or Parquet.
+
+A collection becomes three tables:
+
+- `assets`, a row per pbcoreDescriptionDocument,
+- `instantiations`, a row per pbcoreInstantiation, and
+- `essence_tracks`, a row per instantiationEssenceTrack.
+
+Every row starts with the index of its record in the collection and the
+record's first pbcoreIdentifier (`record`, `asset_identifier`), then the index
+of its instantiation and essence track within their parents. The other columns
+come from the element tables: one for each element the XSD allows below the
+row's element, named by its path from there (`pbcoreCreator/creator`), and one
+for each attribute (`pbcoreTitle@titleType`), leaving out the elements that
+have a table of their own and parts (pbcorePart, instantiationPart), which
+repeat the structure of what they're part of. The values of a repeatable
+element go in the one cell, joined by `SEPARATOR`, with an empty value for an
+attribute one of them doesn't have (unless none of them do), so that its
+attributes' columns line up with it.
+
+Records are read a record at a time (see `app.collection`), leaving out the
+parts no column comes from, and rows are written in batches, so memory use
+doesn't grow with the size of the collection. Parquet needs pyarrow (install
+with `pip install -e .[parquet]`).
+"""
+
+import csv
+import io
+from dataclasses import dataclass
+from enum import Enum
+from functools import lru_cache
+
+from lxml import etree
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from app.collection import BATCH_SIZE, PBCORE_NS, iter_records, record_identifier
+from app.core import XMLParseError
+from app.elements import element_tables
+from app.metrics import stage
+from app.registry import schema_registry
+
+SEPARATOR = " | "
+# Rows per Parquet row group.
+PARQUET_BATCH_SIZE = 1000
+PREFIX = f"{{{PBCORE_NS}}}"
+# Elements that repeat the structure of the element they're in.
+PARTS = frozenset({"pbcorePart", "instantiationPart"})
+
+
+class Table(str, Enum):
+    assets = "assets"
+    instantiations = "instantiations"
+    essence_tracks = "essence_tracks"
+
+
+class Format(str, Enum):
+    csv = "csv"
+    parquet = "parquet"
+
+
+# The element each table has a row per, and the keys its rows start with.
+ROW_ELEMENTS = {
+    Table.assets: "pbcoreDescriptionDocument",
+    Table.instantiations: "pbcoreInstantiation",
+    Table.essence_tracks: "instantiationEssenceTrack",
+}
+KEYS = {
+    Table.assets: ("record", "asset_identifier"),
+    Table.instantiations: ("record", "asset_identifier", "instantiation"),
+    Table.essence_tracks: (
+        "record",
+        "asset_identifier",
+        "instantiation",
+        "essence_track",
+    ),
+}
+MEDIA_TYPES = {Format.csv: "text/csv", Format.parquet: "application/vnd.apache.parquet"}
+
+
+@dataclass(frozen=True)
+class Layout:
+    """The columns of a table, and where each one's values come from."""
+
+    keys: tuple
+    columns: tuple
+    # Path of an element from the row's element ("" for the row's element
+    # itself) -> the index of the column for its text (or None) and
+    # (attribute, index) pairs for its attributes.
+    slots: dict
+
+    @property
+    def header(self):
+        return self.keys + self.columns
+
+    def row(self, keys, element):
+        cells = [[] for _ in self.columns]
+        self._collect(element, "", cells)
+        return [
+            *keys,
+            *(SEPARATOR.join(values) if any(values) else "" for values in cells),
+        ]
+
+    def _collect(self, element, path, cells):
+        text_index, attributes = self.slots[path]
+        if text_index is not None:
+            cells[text_index].append(" ".join("".join(element.itertext()).split()))
+        for name, index in attributes:
+            cells[index].append(element.get(name, ""))
+        for child in element.iterchildren(etree.Element):
+            tag = child.tag
+            if not tag.startswith(PREFIX):
+                continue
+            child_path = f"{path}/{tag[len(PREFIX):]}" if path else tag[len(PREFIX) :]
+            if child_path in self.slots:
+                self._collect(child, child_path, cells)
+
+
+def layout(table, version=None):
+    """The layout of a table, recomputed if the XSD changes."""
+    version = version or schema_registry.default
+    return _layout(Table(table), version, schema_registry.digest(version))
+
+
+@lru_cache(maxsize=8)
+def _layout(table, version, digest):
+    tables = element_tables(version)
+    # Elements with tables of their own are left out of the others.
+    skip = PARTS | set(ROW_ELEMENTS.values())
+    columns, slots = [], {}
+
+    def add(name, path, ancestors):
+        text_index = None
+        if path and name not in tables.child_order:
+            text_index = len(columns)
+            columns.append(path)
+        attributes = []
+        for attribute in tables.attributes.get(name, ()):
+            attributes.append((attribute, len(columns)))
+            columns.append(f"{path}@{attribute}")
+        slots[path] = (text_index, tuple(attributes))
+        for child in tables.child_order.get(name, ()):
+            if child not in skip and child not in ancestors:
+                add(child, f"{path}/{child}" if path else child, ancestors | {child})
+
+    element = ROW_ELEMENTS[table]
+    add(element, "", frozenset({element}))
+    return Layout(KEYS[table], tuple(columns), slots)
+
+
+def iter_rows(source, table, version=None):
+    """Yield the rows of a table from a collection (or a single record).
+
+    Raises `XMLParseError` on reaching anything that isn't well-formed.
+    """
+    table = Table(table)
+    table_layout = layout(table, version)
+    # Only what the table's rows come from is kept of each record.
+    keep = {"pbcoreIdentifier", "pbcoreInstantiation"}
+    if table == Table.assets:
+        top_level = element_tables(version).child_order["pbcoreDescriptionDocument"]
+        keep = set(top_level) - {"pbcoreInstantiation"} - PARTS
+    try:
+        for index, record in enumerate(iter_records(source, keep=keep)):
+            with stage("transform"):
+                rows = list(_record_rows(table, table_layout, index, record))
+            yield from rows
+    except etree.XMLSyntaxError as e:
+        raise XMLParseError(str(e)) from e
+
+
+def _record_rows(table, table_layout, index, record):
+    identifier = record_identifier(record)
+    if table == Table.assets:
+        yield table_layout.row((index, identifier), record)
+        return
+    instantiations = record.iterfind(f"{PREFIX}pbcoreInstantiation")
+    for i, instantiation in enumerate(instantiations):
+        if table == Table.instantiations:
+            yield table_layout.row((index, identifier, i), instantiation)
+            continue
+        tracks = instantiation.iterfind(f"{PREFIX}instantiationEssenceTrack")
+        for j, track in enumerate(tracks):
+            yield table_layout.row((index, identifier, i, j), track)
+
+
+def csv_table(source, table, version=None, batch_size=BATCH_SIZE):
+    """A table from a collection as CSV, yielded `batch_size` rows at a time,
+    the first time with the header."""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(layout(table, version).header)
+    for count, row in enumerate(iter_rows(source, table, version), 1):
+        writer.writerow(row)
+        if count % batch_size == 0:
+            yield _drain(out).encode()
+    data = _drain(out)
+    if data:
+        yield data.encode()
+
+
+def parquet_table(source, table, version=None, batch_size=PARQUET_BATCH_SIZE):
+    """A table from a collection as Parquet, yielded a row group of
+    `batch_size` rows at a time."""
+    table_layout = layout(table, version)
+    schema = pyarrow.schema(
+        [
+            (key, pyarrow.string() if key == "asset_identifier" else pyarrow.int64())
+            for key in table_layout.keys
+        ]
+        + [(column, pyarrow.string()) for column in table_layout.columns]
+    )
+    out = _ParquetBuffer()
+    with pyarrow.parquet.ParquetWriter(out, schema) as writer:
+        rows = []
+        for row in iter_rows(source, table, version):
+            rows.append(row)
+            if len(rows) >= batch_size:
+                writer.write_table(_record_batch(rows, schema))
+                rows = []
+                yield out.drain()
+        if rows:
+            writer.write_table(_record_batch(rows, schema))
+    yield out.drain()
+
+
+def _record_batch(rows, schema):
+    with stage("serialize"):
+        columns = [
+            [value if value != "" else None for value in column]
+            for column in zip(*rows)
+        ]
+        return pyarrow.Table.from_arrays(columns, schema=schema)
+
+
+def _drain(out):
+    data = out.getvalue()
+    out.seek(0)
+    out.truncate()
+    return data
+
+
+class _ParquetBuffer(io.RawIOBase):
+    """A write-only stream for pyarrow that hands back what it got."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
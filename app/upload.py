@@ -0,0 +1,215 @@
+"""Reading uploaded XML documents straight from the request body.
+
+FastAPI's `UploadFile` has the whole multipart body spooled to a temporary
+file before the endpoint runs, and the endpoint then reads it back, into bytes
+or into lxml, so a large upload is held twice over. Endpoints that take a
+single XML document instead read the `file` part from the body as it arrives,
+the way documents fetched from URLs are read (see app/fetch.py): each chunk is
+handed to a job in a feed thread (see `WorkPool.feed`), which takes the part
+apart, decompresses it if the upload is gzipped, counts it against a maximum
+size, hashes it for the result cache, and feeds it straight to lxml's
+incremental parser, leaving the event loop only the reading. The job waits for
+the data outside the work pool, so slow uploads don't hold up other requests.
+Nothing but the parsed tree is kept, and an upload over the maximum is rejected
+as soon as it is known to be, without reading the rest.
+"""
+
+import hashlib
+import zlib
+from typing import NamedTuple
+
+from lxml import etree
+from python_multipart.exceptions import FormParserError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from app.config import MAX_UPLOAD_SIZE
+from app.core import XMLParseError
+from app.executor import work_pool
+from app.fetch import DocumentTooLarge
+from app.metrics import document_size, stage
+
+GZIP_MAGIC = b"\x1f\x8b"
+# Room for the multipart boundaries and part headers around the file.
+MULTIPART_OVERHEAD = 2**16
+INFLATE_SIZE = 2**16
+
+
+class UploadError(Exception):
+    """The request isn't a multipart upload with the expected file in it."""
+
+
+class Upload(NamedTuple):
+    document: object
+    filename: str | None
+    digest: str
+
+
+async def receive(request, field="file", parse=True, max_size=None):
+    """Read the file uploaded as `field` from a multipart request, returning
+    it parsed (or as bytes, without `parse`) with its name and the SHA-256 of
+    its (decompressed) content.
+
+    Raises `DocumentTooLarge` once it's bigger than `max_size` (by default
+    PBCORE_MAX_UPLOAD_SIZE) after gunzip, `XMLParseError` if it isn't
+    well-formed, and `UploadError` if there's no such file.
+    """
+    max_size = max_size or MAX_UPLOAD_SIZE
+    length = request.headers.get("Content-Length")
+    if length and length.isdigit() and int(length) > max_size + MULTIPART_OVERHEAD:
+        raise DocumentTooLarge(max_size)
+    content_type, params = parse_options_header(request.headers.get("Content-Type"))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadError("Expected a multipart/form-data upload")
+
+    # Only reading the body is done here, timed as "read"; a feed thread
+    # decodes it as it comes.
+    stream = request.stream()
+    with work_pool.feed(
+        _read_file, params[b"boundary"], field, parse, max_size
+    ) as chunks:
+        while True:
+            with stage("read"):
+                chunk = await anext(stream, None)
+            if chunk is None:
+                break
+            await chunks.send(chunk)
+        upload, size = await chunks.close()
+    document_size(size)
+    return upload
+
+
+def _read_file(chunks, boundary, field, parse, max_size):
+    """Decode the multipart body in `chunks`, returning the upload of `field`
+    (see `receive`) and its size. Runs in a feed thread."""
+    if parse:
+        parser = etree.XMLParser()
+
+        def feed(data):
+            with stage("parse"):
+                parser.feed(data)
+
+        sink = _Sink(feed, max_size)
+    else:
+        data = []
+        sink = _Sink(data.append, max_size)
+    part = _FilePart(field.encode(), sink)
+    multipart = MultipartParser(boundary, part.callbacks())
+    try:
+        for chunk in chunks:
+            multipart.write(chunk)
+        multipart.finalize()
+        if not part.found:
+            raise UploadError(f"No file uploaded as {field!r}")
+        sink.close()
+        if parse:
+            with stage("parse"):
+                document = parser.close()
+        else:
+            document = b"".join(data)
+    except FormParserError as e:
+        raise UploadError(f"Invalid multipart data: {e}") from e
+    except etree.XMLSyntaxError as e:
+        raise XMLParseError(str(e)) from e
+    return Upload(document, part.filename, sink.digest.hexdigest()), sink.size
+
+
+class _FilePart:
+    """Multipart parser callbacks that send the data of the part named `field`
+    to `sink`, and ignore any other part."""
+
+    def __init__(self, field, sink):
+        self.field = field
+        self.sink = sink
+        self.found = False
+        self.filename = None
+        self._in_field = False
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+
+    def callbacks(self):
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+        }
+
+    def on_part_begin(self):
+        self._in_field = False
+        self._disposition = b""
+
+    def on_header_field(self, data, start, end):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data, start, end):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        # Only the first part of that name is read.
+        if options.get(b"name") == self.field and not self.found:
+            self._in_field = self.found = True
+            filename = options.get(b"filename")
+            self.filename = filename.decode("utf-8", "replace") if filename else None
+
+    def on_part_data(self, data, start, end):
+        if self._in_field:
+            self.sink.write(data[start:end])
+
+
+class _Sink:
+    """Gunzips (if need be), counts and hashes data on its way to `write`."""
+
+    def __init__(self, write, max_size):
+        self._write = write
+        self.max_size = max_size
+        self.size = 0
+        self.digest = hashlib.sha256()
+        self._head = b""
+        self._gunzip = None
+        self._started = False
+
+    def write(self, data):
+        if not self._started:
+            # Wait for enough to tell whether it's gzipped.
+            self._head += data
+            if len(self._head) < len(GZIP_MAGIC):
+                return
+            data, self._head = self._head, b""
+            self._started = True
+            if data.startswith(GZIP_MAGIC):
+                self._gunzip = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self._gunzip is None:
+            self._out(data)
+            return
+        try:
+            # A bit at a time, so that a gzip bomb is caught before it
+            # has been inflated whole.
+            while data:
+                self._out(self._gunzip.decompress(data, INFLATE_SIZE))
+                data = self._gunzip.unconsumed_tail
+        except zlib.error as e:
+            raise UploadError(f"Invalid gzip data: {e}") from e
+
+    def close(self):
+        if not self._started:
+            self._out(self._head)
+        elif self._gunzip is not None and not self._gunzip.eof:
+            raise UploadError("Invalid gzip data: it ends too soon")
+
+    def _out(self, data):
+        if not data:
+            return
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise DocumentTooLarge(self.max_size)
+        self.digest.update(data)
+        self._write(data)
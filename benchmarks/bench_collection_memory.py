@@ -0,0 +1,87 @@
+"""Peak memory of streaming collection validation vs. parsing the whole tree.
+
+Writes synthetic pbcoreCollection files with the given numbers of records, then
+validates each one in a fresh process, either streaming it record by record or
+with `etree.parse` as the single-document endpoints do, and reports peak RSS.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_collection_memory --records 10000 100000
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+RECORD = "tests/sample_data/pbcore_xml/100-009w0w2t.xml"
+
+
+def write_collection(path, records):
+    with open(RECORD, "rb") as f:
+        record = f.read().split(b"?>", 1)[1].strip()
+    with open(path, "wb") as f:
+        f.write(
+            b'<?xml version="1.0" encoding="UTF-8"?>\n<pbcoreCollection'
+            b' xmlns="http://www.pbcore.org/PBCore/PBCoreNamespace.html">\n'
+        )
+        for _ in range(records):
+            f.write(record)
+            f.write(b"\n")
+        f.write(b"</pbcoreCollection>\n")
+
+
+def measure(mode, path):
+    """Runs in the child process."""
+    from lxml import etree
+
+    from app.collection import validate_collection
+    from app.registry import schema_registry
+
+    schema_registry.load()
+    start = time.perf_counter()
+    if mode == "stream":
+        for _ in validate_collection(path):
+            pass
+    else:
+        pbcore_xml = etree.parse(path)
+        with schema_registry.validator() as pbcore_schema:
+            pbcore_schema.validate(pbcore_xml)
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{elapsed:.2f} {peak_mb:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--modes", nargs="+", default=["stream", "tree"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for records in args.records:
+            path = os.path.join(tmp, f"collection-{records}.xml")
+            write_collection(path, records)
+            size_mb = os.path.getsize(path) / 1024 / 1024
+            for mode in args.modes:
+                output = subprocess.run(
+                    [sys.executable, "-m", __spec__.name, "--measure", mode, path],
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout
+                elapsed, peak_mb = output.split()
+                print(
+                    f"{records:>8} records {size_mb:>7.1f} MB  {mode:<6}"
+                    f" {float(elapsed):>7.2f}s  peak RSS {float(peak_mb):>8.1f} MB"
+                )
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--measure"]:
+        measure(sys.argv[2], sys.argv[3])
+    else:
+        main()
@@ -0,0 +1,119 @@
+"""Tail latency of small requests while large conversions are in flight.
+
+Drives the app in-process (as a single Uvicorn worker would), mixing a few
+clients converting a large document with many clients validating small ones,
+and reports latency percentiles for the small requests. `--inline` runs the
+XML work on the event loop, the way the endpoints used to.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_concurrency --seconds 10
+"""
+
+import argparse
+import asyncio
+import glob
+import statistics
+import time
+
+import httpx
+
+from app import main
+from app.executor import work_pool
+
+SAMPLES = sorted(glob.glob("tests/sample_data/pbcore_xml/*.xml"))
+
+
+class InlinePool:
+    processes = False
+
+    async def run(self, fn, *args):
+        return fn(*args)
+
+
+def large_document(titles):
+    with open("tests/sample_data/pbcore_xml/100-009w0w2t.xml", "rb") as f:
+        content = f.read()
+    title = b'<pbcoreTitle titleType="Program">The Debt Culture</pbcoreTitle>\n'
+    return content.replace(
+        b"<pbcoreDescription>", title * titles + b"<pbcoreDescription>", 1
+    )
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def client_loop(client, path, documents, deadline, latencies):
+    i = 0
+    while time.perf_counter() < deadline:
+        content = documents[i % len(documents)]
+        start = time.perf_counter()
+        response = await client.post(path, files={"file": content})
+        if response.status_code != 503:
+            latencies.append(time.perf_counter() - start)
+        i += 1
+
+
+async def run(args):
+    small = []
+    for path in SAMPLES:
+        with open(path, "rb") as f:
+            small.append(f.read())
+    large = [large_document(args.titles)]
+
+    small_latencies, large_latencies = [], []
+    deadline = time.perf_counter() + args.seconds
+    transport = httpx.ASGITransport(main.app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=None
+    ) as client:
+        await asyncio.gather(
+            *[
+                client_loop(
+                    client,
+                    "/convert/xml-to-json-file",
+                    large,
+                    deadline,
+                    large_latencies,
+                )
+                for _ in range(args.large_clients)
+            ],
+            *[
+                client_loop(
+                    client, "/validate/xml-file", small, deadline, small_latencies
+                )
+                for _ in range(args.small_clients)
+            ],
+        )
+
+    for label, latencies in (("small", small_latencies), ("large", large_latencies)):
+        if not latencies:
+            print(f"{label:<6} n=0      (starved)")
+            continue
+        print(
+            f"{label:<6} n={len(latencies):<6}"
+            f" p50={statistics.median(latencies) * 1000:8.1f}ms"
+            f" p95={percentile(latencies, 95) * 1000:8.1f}ms"
+            f" p99={percentile(latencies, 99) * 1000:8.1f}ms"
+        )
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--titles", type=int, default=2000)
+    parser.add_argument("--large-clients", type=int, default=2)
+    parser.add_argument("--small-clients", type=int, default=16)
+    parser.add_argument("--inline", action="store_true")
+    args = parser.parse_args()
+
+    if args.inline:
+        main.work_pool = InlinePool()
+    asyncio.run(run(args))
+    work_pool.shutdown()
+
+
+if __name__ == "__main__":
+    main_()
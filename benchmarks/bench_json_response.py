@@ -0,0 +1,88 @@
+"""Latency and allocations of building a conversion response from the JSON.
+
+Converts a large synthetic pbcoreDescriptionDocument (one of the sample
+records with its pbcoreInstantiation repeated) once, then times turning the
+converter's JSON string into a response body three ways: parsing it into a dict
+for FastAPI to encode and serialize again, as the endpoints used to; sending
+the string's bytes as they are; and sending them after a well-formedness check
+(with orjson if it's installed), as PBCORE_VERIFY_JSON does.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_json_response --instantiations 2000
+"""
+
+import argparse
+import copy
+import json
+import statistics
+import time
+import tracemalloc
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from lxml import etree
+
+from app import core
+from app.core import Engine
+
+RECORD = "tests/sample_data/pbcore_xml/100-009w0w2t.xml"
+PBCORE_NS = "http://www.pbcore.org/PBCore/PBCoreNamespace.html"
+
+
+def large_document(instantiations):
+    pbcore_xml = etree.parse(RECORD)
+    root = pbcore_xml.getroot()
+    instantiation = root.find(f"{{{PBCORE_NS}}}pbcoreInstantiation")
+    index = root.index(instantiation)
+    for i in range(1, instantiations):
+        root.insert(index + i, copy.deepcopy(instantiation))
+    return pbcore_xml
+
+
+def via_dict(json_str):
+    return JSONResponse(jsonable_encoder(json.loads(json_str))).body
+
+
+def as_bytes(json_str):
+    return json_str.encode()
+
+
+def checked_bytes(json_str):
+    content = json_str.encode()
+    core.check_json(content)
+    return content
+
+
+def measure(label, fn, json_str, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(json_str)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn(json_str)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{label:<24} {statistics.median(times) * 1000:>9.2f} ms"
+        f" {peak / 2**20:>9.1f} MiB peak"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--instantiations", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    json_str = core.convert(large_document(args.instantiations), Engine.native)
+    checker = "orjson" if core.orjson is not None else "json"
+    print(f"{len(json_str.encode()) / 2**20:.1f} MiB of JSON, checked with {checker}")
+    measure("dict (old)", via_dict, json_str, args.repeat)
+    measure("bytes", as_bytes, json_str, args.repeat)
+    measure("bytes, checked", checked_bytes, json_str, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Documents/sec for JSON Schema validation vs. XSD validation of the same record.
+
+Each sample PBCore XML document is converted to PBCore JSON, then both forms
+are validated in a loop: the XML with the compiled XSD (parsing included), the
+JSON with the compiled JSON Schema validator (parsing included), and the JSON
+with a validator built on every call, as a naive implementation would.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_json_validation --seconds 5
+"""
+
+import argparse
+import glob
+import json
+import time
+
+from jsonschema import Draft202012Validator
+from lxml import etree
+
+from app import core
+from app.config import JSON_SCHEMA_PATH
+from app.registry import json_schema_registry, schema_registry
+
+SAMPLES = sorted(glob.glob("tests/sample_data/pbcore_xml/*.xml"))
+
+
+def xsd_validation(content):
+    pbcore_xml = etree.fromstring(content)
+    with schema_registry.validator() as pbcore_schema:
+        return pbcore_schema.validate(pbcore_xml)
+
+
+def json_schema_validation(content):
+    return core.json_validation_errors(content)
+
+
+def json_schema_per_call(content):
+    with open(JSON_SCHEMA_PATH) as f:
+        validator = Draft202012Validator(json.load(f))
+    return list(validator.iter_errors(json.loads(content)))
+
+
+def run(label, fn, documents, seconds):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        fn(documents[count % len(documents)])
+        count += 1
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {count / elapsed:>10.1f} docs/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    xml_documents = []
+    json_documents = []
+    for path in SAMPLES:
+        with open(path, "rb") as f:
+            content = f.read()
+        xml_documents.append(content)
+        json_documents.append(core.xml_to_json(content).encode())
+    schema_registry.load()
+    json_schema_registry.load()
+
+    run("XSD (compiled)", xsd_validation, xml_documents, args.seconds)
+    run("JSON Schema (compiled)", json_schema_validation, json_documents, args.seconds)
+    run("JSON Schema (per call)", json_schema_per_call, json_documents, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
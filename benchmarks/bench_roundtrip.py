@@ -0,0 +1,70 @@
+"""Records/sec for round-trip checks of a collection, threads vs. processes.
+
+Builds a pbcoreCollection from the sample records, then runs it through
+`batch.roundtrip_documents` with a thread and a process work pool of the given
+size, as the /convert/roundtrip/xml-json/file endpoint does.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_roundtrip --records 20000 --workers 4
+"""
+
+import argparse
+import asyncio
+import glob
+import io
+import time
+
+from app import batch
+from app.core import Engine
+from app.executor import WorkPool
+
+SAMPLES = sorted(glob.glob("tests/sample_data/pbcore_xml/*.xml"))
+
+
+def make_collection(records):
+    samples = []
+    for path in SAMPLES:
+        with open(path, "rb") as f:
+            samples.append(f.read().split(b"?>", 1)[1].strip())
+    return (
+        b'<pbcoreCollection xmlns="http://www.pbcore.org/PBCore/PBCoreNamespace.html">'
+        + b"\n".join(samples[i % len(samples)] for i in range(records))
+        + b"</pbcoreCollection>"
+    )
+
+
+async def check(pbcore_collection, engine):
+    summary = batch.summarize_roundtrips([])
+    uploads = [("collection.xml", io.BytesIO(pbcore_collection))]
+    async for result in batch.roundtrip_documents(uploads, engine):
+        batch.summarize_roundtrips([result], summary)
+    return summary
+
+
+def run(label, pool, pbcore_collection, engine):
+    batch.work_pool = pool
+    start = time.perf_counter()
+    summary = asyncio.run(check(pbcore_collection, engine))
+    elapsed = time.perf_counter() - start
+    pool.shutdown()
+    rate = summary["records"] / elapsed
+    print(f"{label:<12} {rate:>10.1f} records/s  {summary}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--engine", choices=[e.value for e in Engine], default="xslt")
+    args = parser.parse_args()
+
+    pbcore_collection = make_collection(args.records)
+    engine = Engine(args.engine)
+    for label, processes in (("threads", False), ("processes", True)):
+        pool = WorkPool(args.workers, args.workers, processes=processes)
+        run(label, pool, pbcore_collection, engine)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Latency of checking an edit to a large record: whole vs. a validation session.
+
+Generates a record with many instantiations, then times replacing one
+instantiation and checking the record two ways: uploading the whole edited
+record to /validate/xml-file, as a cataloging UI would after each edit, and
+sending just the new instantiation as a patch to a validation session.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_sessions --instantiations 2000
+"""
+
+import argparse
+import statistics
+import time
+
+from fastapi.testclient import TestClient
+from lxml import etree
+
+from app.main import app
+from benchmarks import corpus
+
+PBCORE_NS = "http://www.pbcore.org/PBCore/PBCoreNamespace.html"
+
+
+def run(label, fn, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        response = fn(i)
+        times.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.text
+    print(f"{label:<24} {statistics.median(times) * 1000:>9.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--instantiations", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    sizes = {**corpus.PROFILES["medium"], "instantiations": args.instantiations}
+    record = etree.fromstring(corpus.document(**sizes))
+    instantiations = record.findall(f"{{{PBCORE_NS}}}pbcoreInstantiation")
+    print(f"{len(etree.tostring(record)) / 2**20:.1f} MiB record")
+
+    with TestClient(app) as client:
+
+        def whole(i):
+            edited = instantiations[i % len(instantiations)]
+            edited.set("source", f"edit {i}")
+            return client.post(
+                "/validate/xml-file?fail_fast=true",
+                files={"file": etree.tostring(record)},
+            )
+
+        session = client.post(
+            "/validate/xml-sessions", files={"file": etree.tostring(record)}
+        ).json()["session"]
+
+        def patch(i):
+            index = i % len(instantiations)
+            edited = instantiations[index]
+            edited.set("source", f"edit {i}")
+            return client.patch(
+                f"/validate/xml-sessions/{session}",
+                json={
+                    "patches": [
+                        {
+                            "op": "replace",
+                            "path": "/pbcoreDescriptionDocument"
+                            f"/pbcoreInstantiation[{index + 1}]",
+                            "xml": etree.tostring(edited).decode(),
+                        }
+                    ]
+                },
+            )
+
+        run("whole record", whole, args.repeat)
+        run("session patch", patch, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
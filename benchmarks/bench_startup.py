@@ -0,0 +1,180 @@
+"""Worker startup time and memory under gunicorn, with and without preloading.
+
+Starts gunicorn with gunicorn_conf.py once per mode, and reports how long it
+takes until the first request is answered and until every worker is ready, how
+long one more worker takes to be ready once added (with SIGTTIN, as when
+scaling out or replacing a worker), and each worker's memory after serving a
+few requests: RSS, PSS (with pages shared between processes divided among
+them) and private, i.e. not shared, memory. Preloading shows up as lower PSS
+and private memory, rather than RSS, which counts shared pages in full.
+
+Linux only (memory is read from /proc). Run from the repository root:
+
+    python -m benchmarks.bench_startup --workers 4
+"""
+
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+SAMPLE = "tests/sample_data/pbcore_xml/100-009w0w2t.xml"
+READY = "Application startup complete"
+
+
+class Server:
+    """gunicorn running in the background, noting when each worker is ready."""
+
+    def __init__(self, workers, preload, directory):
+        self.port = free_port()
+        env = dict(
+            os.environ,
+            PBCORE_WORKERS=str(workers),
+            PBCORE_PRELOAD="true" if preload else "false",
+            PROMETHEUS_MULTIPROC_DIR=os.path.join(directory, "metrics"),
+            PBCORE_SESSION_PATH=os.path.join(directory, "sessions.sqlite3"),
+            PBCORE_JOB_DIR=os.path.join(directory, "jobs"),
+        )
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn_conf.py"]
+        command += ["app.main:app", "--bind", f"127.0.0.1:{self.port}"]
+        self.started = time.perf_counter()
+        self.ready = []
+        self._changed = threading.Condition()
+        self.process = subprocess.Popen(
+            command,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        threading.Thread(target=self._read_log, daemon=True).start()
+
+    def _read_log(self):
+        for line in self.process.stderr:
+            if READY in line:
+                with self._changed:
+                    self.ready.append(time.perf_counter() - self.started)
+                    self._changed.notify_all()
+
+    def wait_ready(self, count, timeout=60):
+        """Seconds since starting until `count` workers were ready."""
+        with self._changed:
+            if not self._changed.wait_for(lambda: len(self.ready) >= count, timeout):
+                raise RuntimeError(f"{count} workers not ready after {timeout}s")
+            return self.ready[count - 1]
+
+    def workers(self):
+        with open(f"/proc/{self.process.pid}/task/{self.process.pid}/children") as f:
+            return [int(pid) for pid in f.read().split()]
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def memory(pid):
+    """RSS, PSS and private memory of a process, in MiB."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if value.strip().endswith("kB"):
+                fields[name] = int(value.split()[0]) / 1024
+    private = fields["Private_Clean"] + fields["Private_Dirty"]
+    return fields["Rss"], fields["Pss"], private
+
+
+def first_response(url, content, started, timeout=60):
+    """Seconds from `started` until `url` first answers an upload of `content`
+    with 200."""
+    while time.perf_counter() - started < timeout:
+        try:
+            response = httpx.post(url, files={"file": content})
+            if response.status_code == 200:
+                return time.perf_counter() - started
+        except httpx.TransportError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f"No response after {timeout}s")
+
+
+def measure(workers, preload, requests, content):
+    with tempfile.TemporaryDirectory() as directory:
+        server = Server(workers, preload, directory)
+        base_url = f"http://127.0.0.1:{server.port}"
+        try:
+            first = first_response(
+                f"{base_url}/validate/xml-file", content, server.started
+            )
+            ready = server.wait_ready(workers)
+
+            # Let every worker run each kind of job, so the memory it uses
+            # serving requests is counted too.
+            with httpx.Client(base_url=base_url) as client:
+                for _ in range(requests):
+                    for path in ("/validate/xml-file", "/convert/xml-to-json-file"):
+                        client.post(path, files={"file": content})
+            usage = [memory(pid) for pid in server.workers()]
+            master = memory(server.process.pid)
+
+            before = time.perf_counter()
+            os.kill(server.process.pid, signal.SIGTTIN)
+            server.wait_ready(workers + 1)
+            scale_out = server.ready[workers] - (before - server.started)
+        finally:
+            server.stop()
+
+    return {
+        "first_request_s": first,
+        "all_ready_s": ready,
+        "new_worker_ready_s": scale_out,
+        "master_rss_mb": master[0],
+        "worker_rss_mb": sum(rss for rss, _, _ in usage) / len(usage),
+        "worker_pss_mb": sum(pss for _, pss, _ in usage) / len(usage),
+        "worker_private_mb": sum(private for _, _, private in usage) / len(usage),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--requests", type=int, default=50, help="Of each kind, before measuring."
+    )
+    args = parser.parse_args()
+
+    with open(SAMPLE, "rb") as f:
+        content = f.read()
+    print(
+        f"{'mode':<12}{'first req':>10}{'all ready':>10}{'new worker':>11}"
+        f"{'master RSS':>11}{'worker RSS':>11}{'PSS':>8}{'private':>9}"
+    )
+    for preload in (False, True):
+        result = measure(args.workers, preload, args.requests, content)
+        print(
+            f"{'preload' if preload else 'no preload':<12}"
+            f"{result['first_request_s']:>9.2f}s"
+            f"{result['all_ready_s']:>9.2f}s"
+            f"{result['new_worker_ready_s']:>10.2f}s"
+            f"{result['master_rss_mb']:>8.1f}MiB"
+            f"{result['worker_rss_mb']:>8.1f}MiB"
+            f"{result['worker_pss_mb']:>5.1f}MiB"
+            f"{result['worker_private_mb']:>6.1f}MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
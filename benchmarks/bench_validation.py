@@ -0,0 +1,66 @@
+"""Requests/sec for XML validation, compiling the XSD per request vs. once.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_validation --seconds 5
+"""
+
+import argparse
+import glob
+import time
+
+from fastapi.testclient import TestClient
+from lxml import etree
+
+from app.config import XSD_PATH
+from app.main import app
+from app.registry import schema_registry
+
+SAMPLES = sorted(glob.glob("tests/sample_data/pbcore_xml/*.xml"))
+
+
+def compile_per_request(content):
+    pbcore_xml = etree.fromstring(content)
+    pbcore_schema = etree.XMLSchema(etree.parse(XSD_PATH))
+    return pbcore_schema.validate(pbcore_xml)
+
+
+def shared_registry(content):
+    pbcore_xml = etree.fromstring(content)
+    with schema_registry.validator() as pbcore_schema:
+        return pbcore_schema.validate(pbcore_xml)
+
+
+def run(label, fn, documents, seconds):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        fn(documents[count % len(documents)])
+        count += 1
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {count / elapsed:>10.1f} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    documents = []
+    for path in SAMPLES:
+        with open(path, "rb") as f:
+            documents.append(f.read())
+    schema_registry.load()
+    run("compile per request", compile_per_request, documents, args.seconds)
+    run("shared schema registry", shared_registry, documents, args.seconds)
+
+    with TestClient(app) as client:
+
+        def endpoint(content):
+            client.post("/validate/xml-file", files={"file": content})
+
+        run("POST /validate/xml-file", endpoint, documents, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
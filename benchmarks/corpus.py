@@ -0,0 +1,255 @@
+"""Synthetic, schema-valid PBCore documents of controllable size.
+
+Records are built as PBCore JSON from a seeded random generator and written
+out as XML by `app.json_to_xml`, which puts children in the order the XSD
+wants them, so every record validates however big it is made. The same seed
+and sizes always give the same bytes.
+
+Sizes:
+
+- `instantiations`: pbcoreInstantiation elements per record.
+- `essence_tracks`: instantiationEssenceTrack elements per instantiation.
+- `repeats`: how many of each repeatable descriptive element (identifiers,
+  titles, subjects, descriptions, genres, creators, contributors, ...).
+- `text_length`: roughly how many characters each description has.
+
+`PROFILES` names the sizes the benchmark suite uses. To write a corpus to disk,
+run from the repository root:
+
+    python -m benchmarks.corpus --profile large --records 100 --out corpus
+"""
+
+import argparse
+import json
+import os
+import random
+
+from lxml import etree
+
+from app import core
+from app import json_to_xml as json_xml
+from app.core import Engine
+from app.elements import element_tables
+
+PROFILES = {
+    "small": dict(instantiations=1, essence_tracks=1, repeats=1, text_length=200),
+    "medium": dict(instantiations=10, essence_tracks=2, repeats=3, text_length=1000),
+    "large": dict(instantiations=200, essence_tracks=3, repeats=5, text_length=5000),
+    "huge": dict(instantiations=2000, essence_tracks=4, repeats=10, text_length=20000),
+}
+
+# Plenty of plain words, plus markup characters and non-ASCII to escape.
+WORDS = (
+    "archive broadcast station program episode interview music news public "
+    "radio television community history report series local national film "
+    "documentary season concert debate election weather science education "
+    'Q&A <draft> "quoted" it\'s café naïve Zürich 東京 — ½'
+).split()
+ASSET_TYPES = ["Episode", "Program", "Segment", "Clip", "Promo", "Raw Footage"]
+TITLE_TYPES = ["Program", "Episode", "Series", "Segment", "Clip"]
+MEDIA_TYPES = ["Moving Image", "Sound"]
+TRACK_TYPES = ["Video", "Audio", "Text", "General"]
+ROLES = ["Producer", "Director", "Host", "Interviewee", "Reporter", "Engineer"]
+
+
+def document(instantiations=1, essence_tracks=1, repeats=1, text_length=200, seed=0):
+    """A pbcoreDescriptionDocument, as XML bytes."""
+    record = pbcore_json(instantiations, essence_tracks, repeats, text_length, seed)
+    return json_xml.json_to_xml(record, element_tables())
+
+
+def pbcore_json(instantiations=1, essence_tracks=1, repeats=1, text_length=200, seed=0):
+    """A pbcoreDescriptionDocument, as PBCore JSON ready for `json_to_xml`.
+
+    This is the shape `app.json_to_xml` reads, not necessarily the one the
+    converters write; see `json_document` for that.
+    """
+    rng = random.Random(seed)
+    n = range(repeats)
+    record = {
+        "pbcoreAssetType": [{"text": rng.choice(ASSET_TYPES)}],
+        "pbcoreAssetDate": [{"dateType": "broadcast", "text": _date(rng)}],
+        "pbcoreIdentifier": [
+            {"source": "http://americanarchiveinventory.org", "text": _id(rng, seed)}
+        ]
+        + [{"source": _words(rng, 2), "text": _id(rng, i)} for i in n],
+        "pbcoreTitle": [
+            {"titleType": rng.choice(TITLE_TYPES), "text": _words(rng, 5)} for _ in n
+        ],
+        "pbcoreSubject": [
+            {"subjectType": "Topic", "source": "LCSH", "text": _words(rng, 2)}
+            for _ in n
+        ],
+        "pbcoreDescription": [
+            {"descriptionType": "Abstract", "text": _text(rng, text_length)} for _ in n
+        ],
+        "pbcoreGenre": [
+            {"source": "AAPB Topical Genre", "text": _words(rng, 1)} for _ in n
+        ],
+        "pbcoreRelation": [
+            {
+                "pbcoreRelationType": {"text": "Is Part Of"},
+                "pbcoreRelationIdentifier": {"text": _id(rng, i)},
+            }
+            for i in n
+        ],
+        "pbcoreCoverage": [
+            {
+                "coverage": {"text": _words(rng, 2)},
+                "coverageType": {"text": rng.choice(["Spatial", "Temporal"])},
+            }
+            for _ in n
+        ],
+        "pbcoreCreator": [_agent(rng, "creator") for _ in n],
+        "pbcoreContributor": [_agent(rng, "contributor") for _ in n],
+        "pbcorePublisher": [_agent(rng, "publisher") for _ in n],
+        "pbcoreRightsSummary": [{"rightsSummary": {"text": _text(rng, 100)}}],
+        "pbcoreInstantiation": [
+            _instantiation(rng, i, essence_tracks, repeats)
+            for i in range(instantiations)
+        ],
+        "pbcoreAnnotation": [
+            {"annotationType": "last_modified", "text": _date(rng)},
+            {"annotationType": "organization", "text": _words(rng, 3)},
+        ],
+    }
+    return {json_xml.ROOT: record}
+
+
+def json_document(**sizes):
+    """A pbcoreDescriptionDocument as the native converter writes it, which
+    is the PBCore JSON the JSON endpoints expect, as UTF-8 bytes."""
+    pbcore_xml = etree.ElementTree(etree.fromstring(document(**sizes)))
+    return core.convert(pbcore_xml, Engine.native).encode()
+
+
+def collection(records, seed=0, **sizes):
+    """A pbcoreCollection of `records` different documents, as XML bytes."""
+    chunks = [
+        b'<?xml version="1.0" encoding="UTF-8"?>\n',
+        f'<pbcoreCollection xmlns="{json_xml.PBCORE_NS}">'.encode(),
+    ]
+    for i in range(records):
+        pbcore_xml = etree.fromstring(document(seed=seed + i, **sizes))
+        chunks.append(etree.tostring(pbcore_xml, encoding="UTF-8"))
+    chunks.append(b"</pbcoreCollection>\n")
+    return b"".join(chunks)
+
+
+def ndjson(records, seed=0, **sizes):
+    """NDJSON of `records` different PBCore JSON documents, one per line."""
+    return b"".join(
+        json_document(seed=seed + i, **sizes) + b"\n" for i in range(records)
+    )
+
+
+def _instantiation(rng, index, essence_tracks, repeats):
+    media_type = rng.choice(MEDIA_TYPES)
+    return {
+        "instantiationIdentifier": [
+            {"source": "synthetic", "text": f"{index}.{rng.randrange(10**6)}"}
+        ],
+        "instantiationDate": [{"dateType": "created", "text": _date(rng)}],
+        "instantiationDigital": {"text": rng.choice(["video/mp4", "audio/wav"])},
+        "instantiationLocation": {"text": _words(rng, 3)},
+        "instantiationMediaType": {"text": media_type},
+        "instantiationGenerations": [{"text": rng.choice(["Master", "Proxy"])}],
+        "instantiationFileSize": {
+            "unitsOfMeasure": "bytes",
+            "text": str(rng.randrange(10**6, 10**10)),
+        },
+        "instantiationDuration": {"text": _duration(rng)},
+        "instantiationTracks": {"text": str(essence_tracks)},
+        "instantiationLanguage": [{"text": "eng"}],
+        "instantiationEssenceTrack": [
+            _essence_track(rng, media_type) for _ in range(essence_tracks)
+        ],
+        "instantiationAnnotation": [
+            {"annotationType": "note", "text": _words(rng, 8)} for _ in range(repeats)
+        ],
+    }
+
+
+def _essence_track(rng, media_type):
+    track = {
+        "essenceTrackType": {"text": rng.choice(TRACK_TYPES)},
+        "essenceTrackIdentifier": [{"source": "synthetic", "text": _id(rng, 0)}],
+        "essenceTrackEncoding": {
+            "source": "codec",
+            "text": rng.choice(["h264", "aac"]),
+        },
+        "essenceTrackDataRate": {
+            "unitsOfMeasure": "bits/sec",
+            "text": str(rng.randrange(64000, 10**7)),
+        },
+        "essenceTrackDuration": {"text": _duration(rng)},
+        "essenceTrackLanguage": {"text": "eng"},
+    }
+    if media_type == "Moving Image":
+        track["essenceTrackFrameRate"] = {"unitsOfMeasure": "fps", "text": "29.97"}
+        track["essenceTrackFrameSize"] = {"text": "1920x1080"}
+        track["essenceTrackAspectRatio"] = {"text": "16:9"}
+    else:
+        track["essenceTrackSamplingRate"] = {"unitsOfMeasure": "kHz", "text": "48"}
+        track["essenceTrackBitDepth"] = {"text": "24"}
+    return track
+
+
+def _agent(rng, kind):
+    return {
+        kind: {"affiliation": _words(rng, 2), "text": _words(rng, 2)},
+        f"{kind}Role": {"text": rng.choice(ROLES)},
+    }
+
+
+def _words(rng, count):
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def _text(rng, length):
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+
+def _id(rng, index):
+    return f"cpb-aacip/{index}-{rng.getrandbits(40):010x}"
+
+
+def _date(rng):
+    return f"{rng.randrange(1950, 2025)}-{rng.randrange(1, 13):02}-{rng.randrange(1, 29):02}"
+
+
+def _duration(rng):
+    return f"{rng.randrange(3):02}:{rng.randrange(60):02}:{rng.randrange(60):02}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", required=True, help="Directory to write to")
+    parser.add_argument("--profile", choices=PROFILES, default="medium")
+    parser.add_argument("--records", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    sizes = PROFILES[args.profile]
+    os.makedirs(args.out, exist_ok=True)
+    for i in range(args.records):
+        path = os.path.join(args.out, f"{args.profile}-{args.seed + i}.xml")
+        with open(path, "wb") as f:
+            f.write(document(seed=args.seed + i, **sizes))
+    path = os.path.join(args.out, f"{args.profile}-collection.xml")
+    with open(path, "wb") as f:
+        f.write(collection(args.records, seed=args.seed, **sizes))
+    path = os.path.join(args.out, f"{args.profile}-collection.ndjson")
+    with open(path, "wb") as f:
+        f.write(ndjson(args.records, seed=args.seed, **sizes))
+    print(json.dumps({"profile": args.profile, "records": args.records, **sizes}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,536 @@
+"""Throughput, latency percentiles and peak memory of every endpoint and engine.
+
+Each scenario is one endpoint, with one engine where it has a choice of them,
+fed synthetic documents of one `benchmarks.corpus` profile. It runs either
+in-process, with requests sent straight to the ASGI app, or over HTTP, against
+a server started for it. Each scenario runs in a fresh process (or server), so
+that its peak RSS is its own, and with the result cache off unless `--cache`
+is given, so that repeated documents are really handled each time.
+
+The results are written as JSON, with the commit, library versions and
+machine they were measured on. Compare two runs with `compare`, which lists
+what got slower or bigger and exits 1 if anything regressed by more than the
+threshold.
+
+Run from the repository root:
+
+    python -m benchmarks.suite run --profiles small,large --output before.json
+    python -m benchmarks.suite run --profiles small,large --output after.json
+    python -m benchmarks.suite compare before.json after.json --threshold 0.1
+
+`--mode http` needs uvicorn (or gunicorn, with `--server gunicorn`), as
+installed with the service's dependencies.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from benchmarks import corpus
+
+ENGINES = ("xslt", "native")
+
+# Endpoint name: path, kind of input, query parameters, whether it takes an
+# engine.
+ENDPOINTS = {
+    "validate-xml": ("/validate/xml-file", "document", {}, False),
+    "validate-xml-all-errors": (
+        "/validate/xml-file",
+        "document",
+        {"all_errors": "true"},
+        False,
+    ),
+    "validate-json": ("/validate/json-file", "json", {}, False),
+    "xml-to-json": ("/convert/xml-to-json-file", "document", {}, True),
+    "json-to-xml": ("/convert/json-to-xml", "json", {}, False),
+    "validate-collection": ("/validate/xml-collection-file", "collection", {}, False),
+    "xml-to-json-collection": (
+        "/convert/xml-to-json-collection-file",
+        "collection",
+        {},
+        True,
+    ),
+    "json-to-xml-collection": (
+        "/convert/json-to-xml-collection-file",
+        "ndjson",
+        {},
+        False,
+    ),
+    "roundtrip": ("/convert/roundtrip/xml-json/file", "collection", {}, True),
+}
+
+# Records per collection for each profile, about 0.5-6 MiB of XML each.
+COLLECTION_RECORDS = {"small": 200, "medium": 40, "large": 4, "huge": 1}
+
+# Different documents sent in turn to the single-document endpoints.
+DOCUMENTS = 8
+
+# Checked for regressions by `compare`: the metric, and whether up is worse.
+CHECKS = (
+    ("throughput", False),
+    ("latency_ms.p50", True),
+    ("latency_ms.p99", True),
+    ("peak_rss_mb", True),
+)
+
+FILENAMES = {
+    "document": "document.xml",
+    "json": "document.json",
+    "collection": "collection.xml",
+    "ndjson": "collection.ndjson",
+}
+
+
+def scenarios(endpoints, engines, profiles, modes):
+    for mode in modes:
+        for profile in profiles:
+            for endpoint in endpoints:
+                path, kind, params, takes_engine = ENDPOINTS[endpoint]
+                for engine in engines if takes_engine else [None]:
+                    name = f"{endpoint}[{engine}]" if engine else endpoint
+                    yield {
+                        "id": f"{name}/{profile}/{mode}",
+                        "endpoint": endpoint,
+                        "engine": engine,
+                        "profile": profile,
+                        "mode": mode,
+                        "path": path,
+                        "kind": kind,
+                        "params": {**params, **({"engine": engine} if engine else {})},
+                    }
+
+
+def write_corpus(directory, profile):
+    """Write the inputs for a profile, returning their paths by kind."""
+    sizes = corpus.PROFILES[profile]
+    records = COLLECTION_RECORDS.get(profile, 10)
+    inputs = {
+        "document": [corpus.document(seed=i, **sizes) for i in range(DOCUMENTS)],
+        "json": [corpus.json_document(seed=i, **sizes) for i in range(DOCUMENTS)],
+        "collection": [corpus.collection(records, **sizes)],
+        "ndjson": [corpus.ndjson(records, **sizes)],
+    }
+    paths = {}
+    for kind, contents in inputs.items():
+        paths[kind] = []
+        for i, content in enumerate(contents):
+            path = os.path.join(directory, f"{profile}-{i}-{FILENAMES[kind]}")
+            with open(path, "wb") as f:
+                f.write(content)
+            paths[kind].append(path)
+    return paths
+
+
+async def load(client, scenario, inputs, settings):
+    """Send the scenario's requests with `concurrency` at once, for `seconds`
+    and at least `min_requests` of them, after `warmup` unmeasured ones."""
+    filename = FILENAMES[scenario["kind"]]
+
+    async def send(i):
+        content = inputs[i % len(inputs)]
+        start = time.perf_counter()
+        response = await client.post(
+            scenario["path"],
+            params=scenario["params"],
+            files={"file": (filename, content)},
+        )
+        return time.perf_counter() - start, response.status_code
+
+    for i in range(settings["warmup"]):
+        await send(i)
+
+    latencies = []
+    errors = 0
+    sent = 0
+    start = time.perf_counter()
+    deadline = start + settings["seconds"]
+
+    async def worker():
+        nonlocal errors, sent
+        while time.perf_counter() < deadline or sent < settings["min_requests"]:
+            i = sent
+            sent += 1
+            latency, status = await send(i)
+            latencies.append(latency)
+            if status >= 400:
+                errors += 1
+
+    await asyncio.gather(*(worker() for _ in range(settings["concurrency"])))
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, errors, elapsed, inputs)
+
+
+def summarize(latencies, errors, elapsed, inputs):
+    input_bytes = statistics.mean(len(content) for content in inputs)
+    if len(latencies) > 1:
+        cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+        p50, p90, p99 = cuts[49], cuts[89], cuts[98]
+    else:
+        p50 = p90 = p99 = latencies[0]
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "input_bytes": round(input_bytes),
+        "throughput": round(len(latencies) / elapsed, 2),
+        "mb_per_second": round(len(latencies) * input_bytes / elapsed / 2**20, 2),
+        "latency_ms": {
+            name: round(seconds * 1000, 3)
+            for name, seconds in (
+                ("mean", statistics.mean(latencies)),
+                ("p50", p50),
+                ("p90", p90),
+                ("p99", p99),
+                ("max", max(latencies)),
+            )
+        },
+    }
+
+
+def read_inputs(paths):
+    contents = []
+    for path in paths:
+        with open(path, "rb") as f:
+            contents.append(f.read())
+    return contents
+
+
+### In-process ###
+
+
+def run_in_process(scenario, paths, settings):
+    """Run a scenario in a child process, straight against the ASGI app."""
+    env = dict(os.environ)
+    if not settings["cache"]:
+        env["PBCORE_CACHE_SIZE"] = "0"
+    child = subprocess.run(
+        [sys.executable, "-m", "benchmarks.suite", "scenario"],
+        input=json.dumps({"scenario": scenario, "paths": paths, "settings": settings}),
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if child.returncode:
+        raise RuntimeError(f"{scenario['id']} failed:\n{child.stderr}")
+    return json.loads(child.stdout)
+
+
+def scenario_main():
+    """The child process's side of `run_in_process`."""
+    import httpx
+
+    job = json.load(sys.stdin)
+    inputs = read_inputs(job["paths"])
+    startup_rss = _max_rss()
+
+    from app.main import app
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://benchmark", timeout=None
+            ) as client:
+                return await load(client, job["scenario"], inputs, job["settings"])
+
+    result = asyncio.run(run())
+    result["startup_rss_mb"] = startup_rss
+    result["peak_rss_mb"] = _max_rss()
+    json.dump(result, sys.stdout)
+
+
+def _max_rss():
+    """Peak RSS in MiB of this process, or of its largest child process (a
+    process work pool's workers), whichever is bigger."""
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # Kilobytes on Linux, bytes on macOS.
+    scale = 2**20 if sys.platform == "darwin" else 2**10
+    return round(peak / scale, 1)
+
+
+### Over HTTP ###
+
+
+def run_over_http(scenario, paths, settings):
+    """Start a server for a scenario, and send it the scenario's requests."""
+    import httpx
+
+    port = _free_port()
+    env = dict(os.environ)
+    if not settings["cache"]:
+        env["PBCORE_CACHE_SIZE"] = "0"
+    if settings["server"] == "gunicorn":
+        command = ["gunicorn", "-c", "gunicorn_conf.py", "app.main:app"]
+        command += ["--bind", f"127.0.0.1:{port}"]
+        if settings["workers"]:
+            command += ["--workers", str(settings["workers"])]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "app.main:app"]
+        command += ["--host", "127.0.0.1", "--port", str(port)]
+        command += ["--log-level", "warning"]
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        startup_rss = _wait_until_up(server, base_url)
+
+        async def run():
+            limits = httpx.Limits(max_connections=settings["concurrency"])
+            async with httpx.AsyncClient(
+                base_url=base_url, limits=limits, timeout=None
+            ) as client:
+                return await load(client, scenario, read_inputs(paths), settings)
+
+        result = asyncio.run(run())
+        result["startup_rss_mb"] = startup_rss
+        result["peak_rss_mb"] = _tree_peak_rss(server.pid)
+        return result
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_up(server, base_url, timeout=60):
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with {server.returncode}")
+        try:
+            if httpx.get(f"{base_url}/health").status_code == 200:
+                return _tree_peak_rss(server.pid)
+        except httpx.TransportError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"Server not up after {timeout}s")
+
+
+def _tree_peak_rss(pid):
+    """Peak RSS in MiB of a process and all its descendants, added up, from
+    /proc (Linux only; None elsewhere)."""
+    total = 0
+    pending = [pid]
+    try:
+        while pending:
+            pid = pending.pop()
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        total += int(line.split()[1])
+            for task in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+    except OSError:
+        return None
+    return round(total / 2**10, 1)
+
+
+### Running and comparing ###
+
+
+def metadata(settings):
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "lxml": _version("lxml"),
+        "libxml2": _libxml2_version(),
+        "fastapi": _version("fastapi"),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "settings": settings,
+    }
+
+
+def _git(*args):
+    try:
+        return subprocess.run(
+            ["git", *args], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _version(package):
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version(package)
+    except PackageNotFoundError:
+        return None
+
+
+def _libxml2_version():
+    from lxml import etree
+
+    return ".".join(map(str, etree.LIBXML_VERSION))
+
+
+def run(args):
+    settings = {
+        "seconds": args.seconds,
+        "min_requests": args.min_requests,
+        "warmup": args.warmup,
+        "concurrency": args.concurrency,
+        "cache": args.cache,
+        "server": args.server,
+        "workers": args.workers,
+    }
+    profiles = args.profiles.split(",")
+    modes = ["inprocess", "http"] if args.mode == "both" else [args.mode]
+    report = {"metadata": metadata(settings), "results": []}
+    with tempfile.TemporaryDirectory() as directory:
+        paths = {profile: write_corpus(directory, profile) for profile in profiles}
+        for scenario in scenarios(
+            args.endpoints.split(","), args.engines.split(","), profiles, modes
+        ):
+            inputs = paths[scenario["profile"]][scenario["kind"]]
+            if scenario["mode"] == "http":
+                result = run_over_http(scenario, inputs, settings)
+            else:
+                result = run_in_process(scenario, inputs, settings)
+            report["results"].append({**scenario, **result})
+            print(
+                f"{scenario['id']:<48} {result['throughput']:>9.1f} req/s"
+                f" p50 {result['latency_ms']['p50']:>9.2f} ms"
+                f" p99 {result['latency_ms']['p99']:>9.2f} ms"
+                f" {result['peak_rss_mb'] or 0:>7.1f} MiB"
+                + (f"  {result['errors']} errors" if result["errors"] else ""),
+                file=sys.stderr,
+            )
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+def compare(baseline, current, threshold):
+    """Changes in each scenario found in both reports, and whether each is a
+    regression of more than `threshold` (a fraction)."""
+    baseline_results = {result["id"]: result for result in baseline["results"]}
+    changes = []
+    for result in current["results"]:
+        before = baseline_results.get(result["id"])
+        if before is None:
+            continue
+        for metric, up_is_worse in CHECKS:
+            old, new = _metric(before, metric), _metric(result, metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change if up_is_worse else -change
+            changes.append(
+                {
+                    "id": result["id"],
+                    "metric": metric,
+                    "baseline": old,
+                    "current": new,
+                    "change": round(change, 4),
+                    "regression": worse > threshold,
+                }
+            )
+    return changes
+
+
+def _metric(result, metric):
+    value = result
+    for key in metric.split("."):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def compare_main(args):
+    reports = []
+    for path in (args.baseline, args.current):
+        with open(path) as f:
+            reports.append(json.load(f))
+    changes = compare(*reports, args.threshold)
+    for change in changes:
+        if change["regression"] or args.verbose:
+            flag = "REGRESSION" if change["regression"] else ""
+            print(
+                f"{change['id']:<48} {change['metric']:<16}"
+                f" {change['baseline']:>10} -> {change['current']:>10}"
+                f" {change['change']:>+8.1%} {flag}"
+            )
+    regressions = sum(change["regression"] for change in changes)
+    print(f"{regressions} regressions in {len(changes)} comparisons")
+    sys.exit(1 if regressions else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("--output", help="Write results here, not to stdout")
+    run_parser.add_argument(
+        "--mode", choices=["inprocess", "http", "both"], default="inprocess"
+    )
+    run_parser.add_argument("--profiles", default="small,medium")
+    run_parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    run_parser.add_argument("--engines", default=",".join(ENGINES))
+    run_parser.add_argument(
+        "--seconds", type=float, default=3.0, help="Measured per scenario"
+    )
+    run_parser.add_argument("--min-requests", type=int, default=5)
+    run_parser.add_argument("--warmup", type=int, default=2)
+    run_parser.add_argument("--concurrency", type=int, default=4)
+    run_parser.add_argument(
+        "--cache", action="store_true", help="Leave the result cache on"
+    )
+    run_parser.add_argument(
+        "--server", choices=["uvicorn", "gunicorn"], default="uvicorn"
+    )
+    run_parser.add_argument(
+        "--workers", type=int, help="gunicorn workers (default: its config's)"
+    )
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two runs' results")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument(
+        "--threshold", type=float, default=0.1, help="Fraction counted as regressed"
+    )
+    compare_parser.add_argument(
+        "--verbose", action="store_true", help="List every change, not just regressions"
+    )
+
+    # Runs one in-process scenario, given as JSON on stdin.
+    subparsers.add_parser("scenario")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    elif args.command == "compare":
+        compare_main(args)
+    else:
+        scenario_main()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,103 @@
-import multiprocessing
+import gc
+import math
+import os
+import shutil
+import tempfile
 
 bind = "0.0.0.0:8000"
-workers = multiprocessing.cpu_count() * 2 + 1
 worker_class = "uvicorn.workers.UvicornWorker"
 timeout = 60
 
 accesslog = "-"
 errorlog = "-"
 loglevel = "info"
+
+# Each worker writes its metrics to files here, for /metrics to add up across
+# all of them. prometheus_client reads it when first imported, so it must be set
+# before anything here imports prometheus_client (or the app, which does).
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "pbcore-metrics")
+)
+
+# Validation sessions are kept here as well as in each worker's memory, so that
+# any worker can carry on with any session.
+os.environ.setdefault(
+    "PBCORE_SESSION_PATH",
+    os.path.join(tempfile.gettempdir(), "pbcore-sessions.sqlite3"),
+)
+
+
+def available_cpus():
+    """CPUs this process may run on, within the container's CPU quota if any."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(1, cpus)
+
+
+def recommended_workers(cpus):
+    """One worker per CPU, rather than the `2 * cpus + 1` suited to workers
+    that block on I/O.
+
+    A worker's event loop only waits on I/O (uploads, fetches, responses),
+    which needs no extra workers, and hands parsing, validation and conversion
+    to its work pool. lxml lets go of the GIL while it parses, validates and
+    transforms, so a worker's threads can keep several CPUs busy with that, but
+    the Python parts (the native engine, JSON Schema validation, serializing
+    JSON) run one thread at a time per worker. A worker per CPU lets every CPU
+    run them at once; more only adds contention, and memory for each worker's
+    own pools and caches. In process mode each worker's pool already spreads
+    over all the CPUs, so few workers are needed.
+    """
+    from app.config import WORK_POOL_MODE, WORK_POOL_SIZE
+
+    if WORK_POOL_MODE == "process":
+        return math.ceil(cpus / WORK_POOL_SIZE)
+    return cpus
+
+
+workers = int(
+    os.environ.get("PBCORE_WORKERS")
+    or os.environ.get("WEB_CONCURRENCY")
+    or recommended_workers(available_cpus())
+)
+
+# Load the app in the master process and compile everything it needs there,
+# before forking the workers: they start at once, already warm, and share the
+# compiled schemas and stylesheets copy-on-write instead of each holding its
+# own. Without it, each worker imports the app and compiles them itself, and
+# the app is reloaded on HUP.
+preload_app = os.environ.get("PBCORE_PRELOAD", "true").lower() in ("1", "true", "yes")
+
+
+def on_starting(server):
+    # Start from zero rather than adding to the metrics of a previous run.
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def when_ready(server):
+    # Runs in the master, after the app is preloaded and before any workers
+    # are forked.
+    if server.cfg.preload_app:
+        from app.main import warm_up
+
+        warm_up(fill=True)
+        # Keep the garbage collector from writing to (and so copying) pages
+        # holding everything loaded so far, each time it runs in a worker.
+        gc.freeze()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
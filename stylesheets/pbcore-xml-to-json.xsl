@@ -6,12 +6,19 @@
   <xsl:output method="text" encoding="UTF-8" />
   <xsl:strip-space elements="*" />
 
-  <!-- Hardcoded list of repeatable elements -->
-  <xsl:variable name="repeatable"
+  <!--
+    Element tables. The API reads its default lists from these, and passes
+    them back unless it is set to use tables derived from the PBCore XSD
+    instead (see app/elements.py), which make arrays of the other elements the
+    XSD lets repeat.
+  -->
+
+  <!-- Repeatable elements -->
+  <xsl:param name="repeatable"
     select="' pbcoreAssetType pbcoreAssetDate pbcoreIdentifier pbcoreTitle pbcoreSubject pbcoreDescription pbcoreGenre pbcoreRelation pbcoreCoverage pbcoreAudienceLevel pbcoreAudienceRating pbcoreCreator creatorRole pbcoreContributor contributorRole pbcorePublisher publisherRole pbcoreInstantiation pbcoreAnnotation pbcorePart pbcoreExtension instantiationIdentifier instantiationDate instantiationDimensions instantiationGenerations instantiationEssenceTrack instantiationRelation instantiationAnnotation instantiationExtension essenceTrackIdentifier essenceTrackLanguage essenceTrackAnnotation essenceTrackExtension extensionWrap extensionEmbedded '" />
 
-  <!-- Hardcoded list of repeatable elements that have sub-elements -->
-  <xsl:variable name="with-sub-elements"
+  <!-- Elements that have sub-elements -->
+  <xsl:param name="with-sub-elements"
     select="' pbcoreDescriptionDocument pbcoreRelation pbcoreCoverage pbcoreCreator pbcoreContributor pbcorePublisher pbcoreRightsSummary pbcoreExtension pbcoreInstantiation instantiationEssenceTrack instantiationRelation instantiationRights instantiationExtension '" />
 
   <xsl:template match="/">
@@ -0,0 +1,11 @@
+from pytest import fixture
+
+from app.cache import result_cache
+
+
+@fixture(autouse=True)
+def clear_result_cache():
+    # Results are cached by document content, and the tests reuse documents.
+    result_cache.clear()
+    yield
+    result_cache.clear()
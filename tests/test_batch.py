@@ -0,0 +1,189 @@
+import asyncio
+import io
+import json
+import tarfile
+import threading
+import zipfile
+
+from fastapi.testclient import TestClient
+from pytest import fixture
+
+from app import batch
+from app.executor import work_pool
+from app.main import app
+
+client = TestClient(app)
+
+VALID = "tests/sample_data/pbcore_xml/100-009w0w2t.xml"
+INVALID = "tests/sample_data/pbcore_xml/100-009w0w2t.invalid_coverage_type.xml"
+NOT_XML = "tests/sample_data/not_xml.txt"
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def make_zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, content in members.items():
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+def make_tar(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, content in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+### FIXTURES ###
+@fixture
+def members():
+    return {
+        "dump/valid.xml": read(VALID),
+        "dump/invalid.xml": read(INVALID),
+        "dump/README.txt": b"not a PBCore document",
+    }
+
+
+@fixture
+def zip_archive(members):
+    return make_zip(members)
+
+
+@fixture
+def tar_archive(members):
+    return make_tar(members)
+
+
+### TESTS ###
+
+
+def test_validate_batch_files():
+    response = client.post(
+        "/validate/xml-batch",
+        files=[
+            ("files", ("valid.xml", read(VALID))),
+            ("files", ("invalid.xml", read(INVALID))),
+            ("files", ("not_xml.txt", read(NOT_XML))),
+        ],
+    )
+    assert response.status_code == 200
+    response_json = response.json()
+    results = response_json["results"]
+    assert [result["file"] for result in results] == [
+        "valid.xml",
+        "invalid.xml",
+        "not_xml.txt",
+    ]
+    assert [result["valid"] for result in results] == [True, False, False]
+    assert response_json["summary"] == {"files": 3, "valid": 1, "invalid": 2}
+
+
+def test_validate_batch_matches_single_file_errors():
+    single = client.post("/validate/xml-file", files={"file": read(INVALID)})
+    results = client.post(
+        "/validate/xml-batch", files=[("files", ("invalid.xml", read(INVALID)))]
+    ).json()["results"]
+    assert results[0]["error"] == single.json()["detail"]
+
+    single = client.post("/validate/xml-file", files={"file": read(NOT_XML)})
+    results = client.post(
+        "/validate/xml-batch", files=[("files", ("not_xml.txt", read(NOT_XML)))]
+    ).json()["results"]
+    assert results[0]["error"] == single.json()["detail"]
+
+
+def test_validate_batch_archives(zip_archive, tar_archive):
+    for name, archive in (("dump.zip", zip_archive), ("dump.tar.gz", tar_archive)):
+        response = client.post(
+            "/validate/xml-batch", files=[("files", (name, archive))]
+        )
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert {result["file"]: result["valid"] for result in results} == {
+            "dump/valid.xml": True,
+            "dump/invalid.xml": False,
+        }
+        assert all(result["archive"] == name for result in results)
+
+
+def test_validate_batch_stream(zip_archive):
+    response = client.post(
+        "/validate/xml-batch?stream=true",
+        files=[
+            ("files", ("dump.zip", zip_archive)),
+            ("files", ("valid.xml", read(VALID))),
+        ],
+    )
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(line["file"] for line in lines[:-1]) == [
+        "dump/invalid.xml",
+        "dump/valid.xml",
+        "valid.xml",
+    ]
+    assert lines[-1] == {"summary": {"files": 3, "valid": 2, "invalid": 1}}
+
+
+def test_validate_batch_corrupt_archive(zip_archive):
+    response = client.post(
+        "/validate/xml-batch",
+        files=[("files", ("broken.zip", zip_archive[: len(zip_archive) // 2]))],
+    )
+    (result,) = response.json()["results"]
+    assert not result["valid"]
+    assert "Archive Error" in result["error"]
+
+
+def test_validate_batch_member_too_large(members, monkeypatch):
+    # Compresses to next to nothing, but would take 16 MiB to hold.
+    members["dump/huge.xml"] = b"<a>" + b" " * 2**24 + b"</a>"
+    monkeypatch.setattr("app.batch.MAX_UPLOAD_SIZE", 2**20)
+    for name, archive in (
+        ("dump.zip", make_zip(members)),
+        ("dump.tar.gz", make_tar(members)),
+    ):
+        response = client.post(
+            "/validate/xml-batch", files=[("files", (name, archive))]
+        )
+        results = {result["file"]: result for result in response.json()["results"]}
+        assert results["dump/valid.xml"]["valid"]
+        assert not results["dump/huge.xml"]["valid"]
+        assert results["dump/huge.xml"]["error"].startswith("Document Too Large")
+
+
+def test_validate_batch_overloaded(monkeypatch):
+    monkeypatch.setattr(
+        work_pool, "_pending", work_pool.max_workers + work_pool.max_queue
+    )
+    response = client.post(
+        "/validate/xml-batch", files=[("files", ("valid.xml", read(VALID)))]
+    )
+    assert response.status_code == 503
+
+
+def test_fan_out_reads_jobs_on_one_thread():
+    # An iterparse behind the jobs would crash if it moved between threads.
+    def jobs(threads):
+        for i in range(20):
+            threads.add(threading.get_ident())
+            yield i, None, i
+
+    async def drain(threads):
+        return [result async for _, result in batch.fan_out(jobs(threads))]
+
+    threads = [set() for _ in range(4)]
+
+    async def scenario():
+        return await asyncio.gather(*(drain(t) for t in threads))
+
+    results = asyncio.run(scenario())
+    assert all(sorted(result) == list(range(20)) for result in results)
+    assert all(len(t) == 1 for t in threads)
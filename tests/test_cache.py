@@ -0,0 +1,149 @@
+from fastapi.testclient import TestClient
+
+from app.cache import MISS, ResultCache, result_cache, result_key
+from app.executor import Overloaded, work_pool
+from app.main import app
+from app.registry import stylesheet_registry
+
+client = TestClient(app)
+
+VALID = "tests/sample_data/pbcore_xml/100-009w0w2t.xml"
+INVALID = "tests/sample_data/pbcore_xml/100-009w0w2t.invalid_coverage_type.xml"
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+### TESTS ###
+
+
+def test_validate_cache_hit():
+    first = client.post("/validate/xml-file", files={"file": read(VALID)})
+    second = client.post("/validate/xml-file", files={"file": read(VALID)})
+    assert first.headers["X-Cache"] == "miss"
+    assert second.headers["X-Cache"] == "hit"
+    assert first.json() == second.json()
+
+
+def test_validate_cache_hit_invalid():
+    first = client.post("/validate/xml-file", files={"file": read(INVALID)})
+    second = client.post("/validate/xml-file", files={"file": read(INVALID)})
+    assert second.status_code == 422
+    assert second.headers["X-Cache"] == "hit"
+    assert first.json() == second.json()
+
+
+def test_validate_cache_per_mode():
+    modes = ["", "?fail_fast=true", "?all_errors=true", "?all_errors=true"]
+    responses = [
+        client.post(f"/validate/xml-file{mode}", files={"file": read(INVALID)})
+        for mode in modes
+    ]
+    assert [response.headers["X-Cache"] for response in responses] == [
+        "miss",
+        "miss",
+        "miss",
+        "hit",
+    ]
+    assert responses[2].json() == responses[3].json()
+    assert responses[3].json()["detail"]["error_count"] == 1
+
+
+def test_convert_cache_hit_per_engine():
+    responses = [
+        client.post(
+            f"/convert/xml-to-json-file?engine={engine}", files={"file": read(VALID)}
+        )
+        for engine in ("xslt", "native", "xslt")
+    ]
+    assert [response.headers["X-Cache"] for response in responses] == [
+        "miss",
+        "miss",
+        "hit",
+    ]
+    assert responses[0].json() == responses[2].json()
+
+
+def test_cache_invalidated_by_stylesheet_change(monkeypatch):
+    client.post("/convert/xml-to-json-file", files={"file": read(VALID)})
+    monkeypatch.setattr(stylesheet_registry, "digest", lambda name=None: "changed")
+    response = client.post("/convert/xml-to-json-file", files={"file": read(VALID)})
+    assert response.headers["X-Cache"] == "miss"
+
+
+def test_cache_hit_skips_work_pool(monkeypatch):
+    client.post("/validate/xml-file", files={"file": read(VALID)})
+
+    def overloaded(*args, **kwargs):
+        raise Overloaded(1)
+
+    # The upload is still read in the pool, but not validated.
+    monkeypatch.setattr(work_pool, "run", overloaded)
+    response = client.post("/validate/xml-file", files={"file": read(VALID)})
+    assert response.status_code == 200
+    uncached = read(VALID) + b"<!-- not seen before -->"
+    response = client.post("/validate/xml-file", files={"file": uncached})
+    assert response.status_code == 503
+
+    monkeypatch.setattr(work_pool, "submit", overloaded)
+    response = client.post(
+        "/validate/xml-batch", files=[("files", ("valid.xml", read(VALID)))]
+    )
+    assert response.status_code == 200
+    assert response.json()["results"][0]["valid"]
+
+
+def test_cache_disabled(monkeypatch):
+    monkeypatch.setattr(result_cache, "size", 0)
+    response = client.post("/validate/xml-file", files={"file": read(VALID)})
+    assert response.status_code == 200
+    assert "X-Cache" not in response.headers
+
+
+def test_memory_lru_eviction():
+    cache = ResultCache(2)
+    cache.put("a", "1")
+    cache.put("b", None)
+    assert cache.get("a") == "1"
+    cache.put("c", "3")
+    assert cache.get("b") is MISS
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+
+
+def test_large_results_not_cached():
+    cache = ResultCache(2, max_item_size=4)
+    cache.put("a", "12345")
+    assert cache.get("a") is MISS
+
+
+def test_disk_tier_shared(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    key = result_key("validate", "0" * 64)
+    ResultCache(0, path=path).put(key, None)
+
+    # Another worker, with nothing in memory, finds it on disk.
+    other = ResultCache(4, path=path)
+    assert other.get(key) is MISS
+    assert other.lookup(key) is None
+    assert other.get(key) is None
+    assert other.lookup("unknown") is MISS
+
+
+def test_disk_tier_values(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    values = ["text", "", None, True, False, {"errors": [1]}]
+    for value in values:
+        ResultCache(0, path=path).put("key", value)
+        assert ResultCache(0, path=path).lookup("key") == value
+        assert type(ResultCache(0, path=path).lookup("key")) is type(value)
+
+
+def test_disk_tier_trimmed(tmp_path):
+    cache = ResultCache(0, path=str(tmp_path / "cache.sqlite"), disk_size=10)
+    for i in range(100):
+        cache.put(str(i), str(i))
+    assert cache.lookup("0") is MISS
+    assert cache.lookup("99") == "99"
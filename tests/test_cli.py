@@ -0,0 +1,125 @@
+import csv
+import json
+import shutil
+import subprocess
+import sys
+import zipfile
+
+from app import cli, core
+
+VALID = "tests/sample_data/pbcore_xml/100-009w0w2t.xml"
+INVALID = "tests/sample_data/pbcore_xml/100-009w0w2t.invalid_coverage_type.xml"
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def corpus(tmp_path):
+    records = tmp_path / "records"
+    (records / "nested").mkdir(parents=True)
+    shutil.copy(VALID, records / "valid.xml")
+    shutil.copy(INVALID, records / "nested" / "invalid.xml")
+    (records / "notes.txt").write_text("not a document")
+    with zipfile.ZipFile(records / "batch.zip", "w") as archive:
+        archive.write(VALID, "zipped/valid.xml")
+        archive.write(INVALID, "../invalid.xml")
+    return records
+
+
+def results(report):
+    return sorted(json.loads(report.read_text())["results"], key=lambda r: r["file"])
+
+
+### TESTS ###
+
+
+def test_validate(tmp_path):
+    records = corpus(tmp_path)
+    report = tmp_path / "report.json"
+    args = ["validate", str(records), "--report", str(report), "--quiet"]
+    assert cli.main([*args, "--workers", "2", "--chunk-size", "1"]) == 1
+
+    found = results(report)
+    assert [(r["file"], r["archive"], r["valid"]) for r in found] == [
+        ("../invalid.xml", str(records / "batch.zip"), False),
+        (str(records / "nested" / "invalid.xml"), None, False),
+        (str(records / "valid.xml"), None, True),
+        ("zipped/valid.xml", str(records / "batch.zip"), True),
+    ]
+    assert found[0]["error"] == core.validation_error(read(INVALID))
+    assert sorted(r["index"] for r in found) == [0, 1, 2, 3]
+    assert json.loads(report.read_text())["summary"] == {
+        "files": 4,
+        "valid": 2,
+        "invalid": 2,
+    }
+
+    # In this process, the same results.
+    in_process = tmp_path / "in-process.json"
+    args[3] = str(in_process)
+    assert cli.main([*args, "--workers", "0"]) == 1
+    assert results(in_process) == found
+
+
+def test_validate_all_errors_csv(tmp_path):
+    report = tmp_path / "report.csv"
+    pattern = str(tmp_path / "**" / "*.xml")
+    corpus(tmp_path)
+    status = cli.main(
+        ["validate", pattern, "missing.xml", "--all-errors", "--workers", "0"]
+        + ["--report", str(report), "--quiet"]
+    )
+    assert status == 1
+    with open(report, newline="") as f:
+        rows = sorted(csv.DictReader(f), key=lambda row: row["file"])
+    assert [(row["file"], row["valid"]) for row in rows] == [
+        (str(tmp_path / "records" / "nested" / "invalid.xml"), "False"),
+        (str(tmp_path / "records" / "valid.xml"), "True"),
+        ("missing.xml", "False"),
+    ]
+    assert rows[0]["error_count"] == "1"
+    assert rows[0]["error"].startswith("line 13: Element")
+    assert rows[2]["error"] == "File Error: No such file or directory"
+
+
+def test_convert(tmp_path):
+    records = corpus(tmp_path)
+    converted, back = tmp_path / "json", tmp_path / "xml"
+    report = tmp_path / "report.json"
+    args = ["--report", str(report), "--quiet", "--workers", "0"]
+    assert cli.main(["convert", str(records), "--out", str(converted), *args]) == 0
+    assert {str(path.relative_to(converted)) for path in converted.rglob("*.json")} == {
+        "valid.json",
+        "nested/invalid.json",
+        "batch/zipped/valid.json",
+        "batch/invalid.json",
+    }
+    assert (converted / "valid.json").read_text() == core.xml_to_json(read(VALID))
+
+    # Back to XML, leaving out what doesn't validate.
+    status = cli.main(
+        ["convert", str(converted), "--out", str(back), "--validate", *args]
+    )
+    assert status == 1
+    assert {str(path.relative_to(back)) for path in back.rglob("*.xml")} == {
+        "valid.xml",
+        "batch/zipped/valid.xml",
+    }
+    assert json.loads(report.read_text())["summary"] == {
+        "files": 4,
+        "converted": 2,
+        "failed": 2,
+    }
+
+
+def test_no_web_framework_imported():
+    modules = subprocess.run(
+        [sys.executable, "-c", "import sys, app.cli; print(sorted(sys.modules))"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    for name in ("fastapi", "starlette", "uvicorn"):
+        assert f"'{name}'" not in modules
@@ -0,0 +1,102 @@
+import json
+
+from fastapi.testclient import TestClient
+from pytest import fixture
+
+from app import core
+from app.collection import iter_records
+from app.core import Engine
+from app.main import app
+
+client = TestClient(app)
+
+VALID = "tests/sample_data/pbcore_xml/100-009w0w2t.xml"
+INVALID = "tests/sample_data/pbcore_xml/100-009w0w2t.invalid_coverage_type.xml"
+
+
+def record(path):
+    with open(path, "rb") as f:
+        return f.read().split(b"?>", 1)[1]
+
+
+def make_collection(*records):
+    return (
+        b'<?xml version="1.0" encoding="UTF-8"?>\n'
+        b'<pbcoreCollection xmlns="http://www.pbcore.org/PBCore/PBCoreNamespace.html">'
+        + b"\n".join(records)
+        + b"</pbcoreCollection>"
+    )
+
+
+def ndjson(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+### FIXTURES ###
+@fixture
+def pbcore_collection():
+    return make_collection(record(VALID), record(INVALID), record(VALID))
+
+
+### TESTS ###
+
+
+def test_validate_collection(pbcore_collection):
+    response = client.post(
+        "/validate/xml-collection-file", files={"file": pbcore_collection}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = ndjson(response)
+    assert [line.get("valid") for line in lines[:3]] == [True, False, True]
+    assert lines[0]["identifier"] == "The Debt Culture"
+    assert "coverageType" in lines[1]["error"]
+    assert lines[3] == {"summary": {"records": 3, "valid": 2, "invalid": 1}}
+
+
+def test_validate_collection_not_xml():
+    with open("tests/sample_data/not_xml.txt", "rb") as f:
+        response = client.post("/validate/xml-collection-file", files={"file": f})
+    lines = ndjson(response)
+    assert "XML Parsing Error" in lines[0]["error"]
+    assert lines[-1] == {"summary": {"records": 0, "valid": 0, "invalid": 0}}
+
+
+def test_convert_collection_matches_single_documents(pbcore_collection):
+    expected = json.loads(core.xml_to_json(record(VALID)))
+    for engine in Engine:
+        response = client.post(
+            f"/convert/xml-to-json-collection-file?engine={engine.value}",
+            files={"file": pbcore_collection},
+        )
+        assert response.status_code == 200
+        lines = ndjson(response)
+        assert len(lines) == 3
+        assert lines[0] == expected
+        assert lines[2] == expected
+
+
+def test_convert_collection_with_validation(pbcore_collection):
+    response = client.post(
+        "/convert/xml-to-json-collection-file?validate=true",
+        files={"file": pbcore_collection},
+    )
+    lines = ndjson(response)
+    assert "pbcoreDescriptionDocument" in lines[0]
+    assert lines[1]["valid"] is False
+    assert lines[1]["index"] == 1
+    assert "pbcoreDescriptionDocument" in lines[2]
+
+
+def test_iter_records_frees_processed_records(tmp_path):
+    path = tmp_path / "collection.xml"
+    path.write_bytes(make_collection(*[record(VALID)] * 50))
+    count = 0
+    for pbcore_record in iter_records(str(path)):
+        # Everything before the current record has been freed, except the
+        # emptied shell of the record just before it.
+        previous = list(pbcore_record.itersiblings(preceding=True))
+        assert len(previous) <= 1
+        assert all(len(p) == 0 for p in previous)
+        count += 1
+    assert count == 50
@@ -0,0 +1,63 @@
+from lxml import etree
+
+from app import collection, core
+from benchmarks import corpus, suite
+
+SIZES = dict(instantiations=3, essence_tracks=2, repeats=2, text_length=500)
+
+
+def records(pbcore_collection):
+    root = etree.fromstring(pbcore_collection)
+    return root.findall(f"{{{corpus.json_xml.PBCORE_NS}}}pbcoreDescriptionDocument")
+
+
+### TESTS ###
+
+
+def test_documents_are_valid():
+    for sizes in (SIZES, corpus.PROFILES["small"], corpus.PROFILES["medium"]):
+        assert core.validation_report(corpus.document(**sizes)) is None
+        assert core.json_validation_errors(corpus.json_document(**sizes)) == []
+
+
+def test_sizes():
+    pbcore_xml = etree.fromstring(corpus.document(**SIZES))
+    ns = {"p": corpus.json_xml.PBCORE_NS}
+    assert len(pbcore_xml.findall("p:pbcoreInstantiation", ns)) == 3
+    assert len(pbcore_xml.findall("p:pbcoreTitle", ns)) == 2
+    assert len(pbcore_xml.findall(".//p:instantiationEssenceTrack", ns)) == 6
+    description = pbcore_xml.findtext("p:pbcoreDescription", namespaces=ns)
+    assert len(description) >= 500
+    bigger = corpus.document(**{**SIZES, "instantiations": 30})
+    assert len(bigger) > 5 * len(corpus.document(**SIZES))
+
+
+def test_reproducible():
+    assert corpus.document(seed=1, **SIZES) == corpus.document(seed=1, **SIZES)
+    assert corpus.document(seed=1, **SIZES) != corpus.document(seed=2, **SIZES)
+
+
+def test_collections():
+    pbcore_collection = corpus.collection(4, **SIZES)
+    assert core.validate_xml(pbcore_collection) is None
+    identifiers = {collection.record_identifier(r) for r in records(pbcore_collection)}
+    assert len(identifiers) == 4
+    assert len(corpus.ndjson(4, **SIZES).splitlines()) == 4
+
+
+def test_compare():
+    def report(throughput, p99):
+        result = {
+            "id": "validate-xml/small/inprocess",
+            "throughput": throughput,
+            "latency_ms": {"p50": 1.0, "p99": p99},
+            "peak_rss_mb": 60.0,
+        }
+        return {"metadata": {}, "results": [result]}
+
+    changes = suite.compare(report(100, 2.0), report(95, 2.1), threshold=0.1)
+    assert not any(change["regression"] for change in changes)
+
+    changes = suite.compare(report(100, 2.0), report(80, 3.0), threshold=0.1)
+    regressed = {change["metric"] for change in changes if change["regression"]}
+    assert regressed == {"throughput", "latency_ms.p99"}
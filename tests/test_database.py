@@ -0,0 +1,48 @@
+import pytest
+
+from app.database import SharedDatabase
+
+SCHEMA = ("CREATE TABLE IF NOT EXISTS items (name TEXT PRIMARY KEY)",)
+
+
+@pytest.fixture
+def database(tmp_path):
+    return SharedDatabase(str(tmp_path / "nested" / "shared.sqlite3"), SCHEMA)
+
+
+def names(database):
+    with database.connection() as db:
+        return [name for (name,) in db.execute("SELECT name FROM items")]
+
+
+### TESTS ###
+
+
+def test_transaction_commits(database):
+    with database.transaction() as db:
+        db.execute("INSERT INTO items VALUES ('a')")
+        db.execute("INSERT INTO items VALUES ('b')")
+    assert names(database) == ["a", "b"]
+    # Another connection to the same file, as another worker would have.
+    assert names(SharedDatabase(database.path, SCHEMA)) == ["a", "b"]
+
+
+def test_transaction_rolls_back(database):
+    with pytest.raises(RuntimeError):
+        with database.transaction() as db:
+            db.execute("INSERT INTO items VALUES ('a')")
+            assert db.execute("SELECT name FROM items").fetchall() == [("a",)]
+            raise RuntimeError("failed part-way")
+    assert names(database) == []
+    # The connection isn't left in the transaction.
+    with database.transaction() as db:
+        db.execute("INSERT INTO items VALUES ('b')")
+    assert names(database) == ["b"]
+
+
+def test_reconnects_after_fork(database, monkeypatch):
+    with database.connection() as first:
+        pass
+    monkeypatch.setattr("os.getpid", lambda: -1)
+    with database.connection() as second:
+        assert second is not first
@@ -0,0 +1,178 @@
+import asyncio
+import threading
+import time
+
+import httpx
+from fastapi.testclient import TestClient
+from pytest import fixture, raises
+
+from app import core
+from app.executor import Overloaded, WorkPool, work_pool
+from app.main import app
+
+
+### FIXTURES ###
+@fixture
+def large_xml():
+    # Thousands of sibling titles make the XSLT conversion take a while.
+    with open("tests/sample_data/pbcore_xml/100-009w0w2t.xml", "rb") as f:
+        content = f.read()
+    title = b'<pbcoreTitle titleType="Program">The Debt Culture</pbcoreTitle>\n'
+    return content.replace(
+        b"<pbcoreDescription>", title * 2000 + b"<pbcoreDescription>", 1
+    )
+
+
+@fixture
+def invalid_xml():
+    with open(
+        "tests/sample_data/pbcore_xml/100-009w0w2t.invalid_coverage_type.xml", "rb"
+    ) as f:
+        return f.read()
+
+
+### TESTS ###
+
+
+def test_work_pool_rejects_work_when_full():
+    pool = WorkPool(max_workers=1, max_queue=1, retry_after=7)
+    release = threading.Event()
+
+    async def scenario():
+        running = asyncio.ensure_future(pool.run(release.wait))
+        queued = asyncio.ensure_future(pool.run(release.wait))
+        await asyncio.sleep(0)
+        with raises(Overloaded) as exc_info:
+            await pool.run(release.wait)
+        assert exc_info.value.retry_after == 7
+        release.set()
+        await asyncio.gather(running, queued)
+        assert pool.pending == 0
+
+    asyncio.run(scenario())
+    pool.shutdown()
+
+
+def test_work_pool_processes_propagate_errors(invalid_xml):
+    pool = WorkPool(max_workers=1, max_queue=0, processes=True)
+    with raises(core.DocumentInvalid) as exc_info:
+        asyncio.run(pool.run(core.validate_xml, invalid_xml))
+    assert "coverageType" in str(exc_info.value)
+    pool.shutdown()
+
+
+def test_overloaded_responds_503(monkeypatch):
+    monkeypatch.setattr(
+        work_pool, "_pending", work_pool.max_workers + work_pool.max_queue
+    )
+    with open("tests/sample_data/pbcore_xml/100-009w0w2t.xml", "rb") as f:
+        response = TestClient(app).post("/validate/xml-file", files={"file": f})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(work_pool.retry_after)
+
+
+def test_large_conversion_does_not_block_event_loop(large_xml):
+    async def scenario():
+        transport = httpx.ASGITransport(app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            convert = asyncio.ensure_future(
+                client.post("/convert/xml-to-json-file", files={"file": large_xml})
+            )
+            while not work_pool.pending:
+                await asyncio.sleep(0.001)
+            start = time.perf_counter()
+            health = await client.get("/health")
+            health_latency = time.perf_counter() - start
+            assert health.status_code == 200
+            assert not convert.done()
+            assert (await convert).status_code == 200
+        return health_latency
+
+    assert asyncio.run(scenario()) < 0.1
+
+
+def test_iterate_stops_if_never_consumed():
+    pool = WorkPool(max_workers=1, max_queue=0)
+    produced = []
+
+    def count():
+        for i in range(100):
+            produced.append(i)
+            yield i
+
+    async def scenario():
+        # Dropped without being started, e.g. by a request that failed first.
+        pool.iterate(count, buffer=1)
+        while pool.pending:
+            await asyncio.sleep(0.01)
+
+    asyncio.run(asyncio.wait_for(scenario(), 5))
+    assert len(produced) < 100
+    pool.shutdown()
+
+
+def test_feed_runs_in_thread_with_backpressure():
+    pool = WorkPool(max_workers=1, max_queue=0, max_feeds=1)
+    release = threading.Event()
+    threads = set()
+
+    def join(chunks):
+        release.wait(10)
+        threads.add(threading.current_thread())
+        return b"".join(chunks)
+
+    async def scenario():
+        with pool.feed(join, buffer=2) as feed:
+            await feed.send(b"a")
+            await feed.send(b"b")
+            # The job hasn't read anything yet, so a third waits for room.
+            third = asyncio.ensure_future(feed.send(b"c"))
+            await asyncio.sleep(0.05)
+            assert not third.done()
+            with raises(Overloaded):
+                pool.feed(join)
+            # Waiting for data doesn't take up the pool.
+            assert pool.pending == 0
+            assert await pool.run(len, b"pool") == 4
+            release.set()
+            await third
+            return await feed.close()
+
+    assert asyncio.run(scenario()) == b"abc"
+    assert threads and threading.current_thread() not in threads
+    assert pool.feeding == 0
+    pool.shutdown()
+
+
+def test_feed_stops_on_errors():
+    pool = WorkPool(max_workers=1, max_queue=0)
+    read = []
+
+    def fail(chunks):
+        for chunk in chunks:
+            read.append(chunk)
+            raise ValueError(chunk)
+
+    def drain(chunks):
+        for chunk in chunks:
+            read.append(chunk)
+
+    async def scenario():
+        # The job's error reaches the sender, which stops sending.
+        with raises(ValueError):
+            with pool.feed(fail, buffer=1) as feed:
+                for chunk in (b"a", b"b", b"c", b"d"):
+                    await feed.send(chunk)
+        # A sender that gives up ends the job's data.
+        with raises(KeyError):
+            with pool.feed(drain) as feed:
+                await feed.send(b"e")
+                raise KeyError
+        while pool.feeding:
+            await asyncio.sleep(0.01)
+
+    asyncio.run(scenario())
+    assert read == [b"a", b"e"]
+    pool.shutdown()
@@ -0,0 +1,253 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+from fastapi.testclient import TestClient
+from lxml import etree
+from pytest import fixture, raises
+
+from app.executor import work_pool
+from app.fetch import DocumentTooLarge, Fetcher, FetchError, NotModified
+from app.main import app
+
+client = TestClient(app)
+
+DOCUMENTS = {
+    "/valid.xml": "tests/sample_data/pbcore_xml/100-009w0w2t.xml",
+    "/invalid.xml": "tests/sample_data/pbcore_xml/100-009w0w2t.invalid_coverage_type.xml",
+    "/not-xml.txt": "tests/sample_data/not_xml.txt",
+}
+
+
+def serve(request):
+    path = DOCUMENTS.get(request.url.path)
+    if path is None:
+        return httpx.Response(404)
+    with open(path, "rb") as f:
+        content = f.read()
+
+    async def chunks():
+        # Small chunks, without a Content-Length, like a chunked response.
+        for i in range(0, len(content), 256):
+            yield content[i : i + 256]
+
+    return httpx.Response(200, content=chunks())
+
+
+### FIXTURES ###
+@fixture
+def requests():
+    return []
+
+
+@fixture
+def mock_fetcher(monkeypatch, requests):
+    def handler(request):
+        requests.append(request)
+        return serve(request)
+
+    fetcher = Fetcher(transport=httpx.MockTransport(handler), max_size=4096)
+    monkeypatch.setattr("app.main.fetcher", fetcher)
+    return fetcher
+
+
+### TESTS ###
+
+
+def test_validate_xml_url(mock_fetcher):
+    response = client.post("/validate/xml-url?url=http://repo.test/valid.xml")
+    assert response.status_code == 200
+    assert response.json() == {"valid": True, "url": "http://repo.test/valid.xml"}
+
+
+def test_validate_xml_url_invalid(mock_fetcher):
+    response = client.post("/validate/xml-url?url=http://repo.test/invalid.xml")
+    assert response.status_code == 422
+    assert "coverageType" in response.json()["detail"]
+
+    response = client.post("/validate/xml-url?url=http://repo.test/not-xml.txt")
+    assert response.status_code == 422
+    assert "XML Parsing Error" in response.json()["detail"]
+
+
+def test_url_fetch_errors(mock_fetcher):
+    response = client.post("/validate/xml-url?url=http://repo.test/missing.xml")
+    assert response.status_code == 400
+    assert "Error fetching URL" in response.json()["detail"]
+
+    response = client.post("/convert/xml-to-json-url?url=not a url")
+    assert response.status_code == 400
+
+
+def test_convert_xml_to_json_url(mock_fetcher):
+    response = client.post("/convert/xml-to-json-url?url=http://repo.test/valid.xml")
+    assert response.status_code == 200
+    document = response.json()["pbcoreDescriptionDocument"]
+    assert document["pbcoreTitle"][0]["text"] == "The Debt Culture"
+
+
+def test_url_document_too_large(mock_fetcher):
+    mock_fetcher.max_size = 1024
+    response = client.post("/validate/xml-url?url=http://repo.test/valid.xml")
+    assert response.status_code == 413
+
+
+def test_client_is_reused(mock_fetcher, requests):
+    first = mock_fetcher.client
+    for _ in range(3):
+        client.post("/validate/xml-url?url=http://repo.test/valid.xml")
+    assert mock_fetcher.client is first
+    assert len(requests) == 3
+
+
+def test_fetch_rejects_large_content_length():
+    def handler(request):
+        return httpx.Response(200, headers={"Content-Length": "5000"}, content=b"")
+
+    fetcher = Fetcher(transport=httpx.MockTransport(handler), max_size=4096)
+    with raises(DocumentTooLarge):
+        asyncio.run(fetcher.fetch_bytes("http://repo.test/big.xml"))
+
+
+def test_fetch_xml_parses_while_downloading(mock_fetcher, monkeypatch):
+    fed = []
+
+    class RecordingParser(etree.XMLParser):
+        def feed(self, data):
+            fed.append(len(data))
+            super().feed(data)
+
+    monkeypatch.setattr(
+        "app.fetch.etree",
+        SimpleNamespace(XMLParser=RecordingParser, XMLSyntaxError=etree.XMLSyntaxError),
+    )
+    root = asyncio.run(mock_fetcher.fetch_xml("http://repo.test/valid.xml")).document
+    assert root.tag.endswith("pbcoreDescriptionDocument")
+    assert len(fed) > 1
+
+
+def test_stalled_fetch_does_not_block_others(monkeypatch):
+    monkeypatch.setattr(work_pool, "max_workers", 1)
+    monkeypatch.setattr(work_pool, "max_queue", 0)
+    content = open(DOCUMENTS["/valid.xml"], "rb").read()
+
+    async def scenario():
+        resume = asyncio.Event()
+
+        async def chunks():
+            yield content[:100]
+            await resume.wait()
+            yield content[100:]
+
+        fetcher = Fetcher(
+            transport=httpx.MockTransport(
+                lambda request: httpx.Response(200, content=chunks())
+            )
+        )
+        fetch = asyncio.ensure_future(fetcher.fetch_xml("http://repo.test/slow.xml"))
+        while not work_pool.feeding:
+            await asyncio.sleep(0.001)
+        transport = httpx.ASGITransport(app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            other = await client.post("/validate/xml-file", files={"file": content})
+        assert other.status_code == 200
+        assert not fetch.done()
+        resume.set()
+        return (await fetch).document
+
+    assert asyncio.run(scenario()).tag.endswith("pbcoreDescriptionDocument")
+
+
+def test_fetch_error_wraps_transport_errors():
+    def handler(request):
+        raise httpx.ConnectError("connection refused")
+
+    fetcher = Fetcher(transport=httpx.MockTransport(handler))
+    with raises(FetchError):
+        asyncio.run(fetcher.fetch_bytes("http://repo.test/valid.xml"))
+
+
+def test_conditional_fetch_reuses_result(monkeypatch):
+    content = open(DOCUMENTS["/valid.xml"], "rb").read()
+    conditional = []
+
+    def handler(request):
+        if request.headers.get("If-None-Match") == '"v1"':
+            conditional.append(request)
+            return httpx.Response(304, headers={"ETag": '"v1"'})
+        return httpx.Response(200, headers={"ETag": '"v1"'}, content=content)
+
+    fetcher = Fetcher(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr("app.main.fetcher", fetcher)
+    for endpoint in ("/validate/xml-url", "/convert/xml-to-json-url"):
+        first = client.post(f"{endpoint}?url=http://repo.test/valid.xml")
+        second = client.post(f"{endpoint}?url=http://repo.test/valid.xml")
+        assert first.headers["X-Cache"] == "miss"
+        assert second.headers["X-Cache"] == "hit"
+        assert first.json() == second.json()
+        assert first.headers["ETag"] == second.headers["ETag"]
+    assert len(conditional) == 2
+
+
+def test_conditional_fetch_changed(monkeypatch):
+    versions = iter(
+        [
+            open(DOCUMENTS["/valid.xml"], "rb").read(),
+            open(DOCUMENTS["/invalid.xml"], "rb").read(),
+        ]
+    )
+
+    def handler(request):
+        # Always changed since the last fetch.
+        return httpx.Response(
+            200,
+            headers={"Last-Modified": "Tue, 01 Sep 2026 00:00:00 GMT"},
+            content=next(versions),
+        )
+
+    fetcher = Fetcher(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr("app.main.fetcher", fetcher)
+    assert (
+        client.post("/validate/xml-url?url=http://repo.test/a.xml").status_code == 200
+    )
+    response = client.post("/validate/xml-url?url=http://repo.test/a.xml")
+    assert response.status_code == 422
+    assert response.headers["X-Cache"] == "miss"
+
+
+def test_if_none_match(mock_fetcher):
+    url = "/convert/xml-to-json-url?url=http://repo.test/valid.xml"
+    etag = client.post(url).headers["ETag"]
+    response = client.post(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert not response.content
+
+    response = client.post(url, headers={"If-None-Match": '"other"'})
+    assert response.status_code == 200
+    assert response.headers["ETag"] == etag
+    # The ETag depends on the operation.
+    native = client.post(f"{url}&engine=native", headers={"If-None-Match": etag})
+    assert native.status_code == 200
+    assert native.headers["ETag"] != etag
+
+
+def test_fetch_remembers_validators():
+    def handler(request):
+        if "If-None-Match" in request.headers:
+            return httpx.Response(304)
+        return httpx.Response(200, headers={"ETag": '"v1"'}, content=b"<a/>")
+
+    fetcher = Fetcher(transport=httpx.MockTransport(handler), validators_size=1)
+    fetched = asyncio.run(fetcher.fetch_bytes("http://repo.test/a.xml"))
+    assert fetcher.last_digest("http://repo.test/a.xml") == fetched.digest
+    with raises(NotModified) as exc_info:
+        asyncio.run(fetcher.fetch_bytes("http://repo.test/a.xml", conditional=True))
+    assert exc_info.value.digest == fetched.digest
+
+    # Unconditional fetches ignore what is remembered.
+    assert asyncio.run(fetcher.fetch_bytes("http://repo.test/a.xml")) == fetched
+    asyncio.run(fetcher.fetch_bytes("http://repo.test/b.xml"))
+    assert fetcher.last_digest("http://repo.test/a.xml") is None
@@ -0,0 +1,130 @@
+import io
+import json
+import zipfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.index import IndexBuffer, RecordIndex
+from app.main import app
+
+client = TestClient(app)
+
+VALID = "tests/sample_data/pbcore_xml/100-009w0w2t.xml"
+INVALID = "tests/sample_data/pbcore_xml/100-009w0w2t.invalid_coverage_type.xml"
+PBCORE_NS = "http://www.pbcore.org/PBCore/PBCoreNamespace.html"
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def record(path=VALID):
+    return read(path).split(b"?>", 1)[-1].strip()
+
+
+def collection(*records):
+    return (
+        f'<pbcoreCollection xmlns="{PBCORE_NS}">'.encode()
+        + b"".join(records)
+        + b"</pbcoreCollection>"
+    )
+
+
+def renamed(identifier):
+    # The sample record, under another AAPB ID but the same instantiation.
+    return record().replace(b"cpb-aacip/100-009w0w2t", identifier.encode())
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    index = RecordIndex(str(tmp_path / "index.sqlite3"))
+    for module in ("app.main", "app.batch", "app.collection", "app.jobs"):
+        monkeypatch.setattr(f"{module}.record_index", index)
+    return index
+
+
+### TESTS ###
+
+
+def test_collection_harvest(index):
+    content = collection(record(), renamed("cpb-aacip/2"), record(INVALID))
+    response = client.post(
+        "/validate/xml-collection-file?harvest=first", files={"file": content}
+    )
+    assert json.loads(response.text.splitlines()[-1])["summary"]["records"] == 3
+
+    found = client.get("/index/records?identifier=cpb-aacip/2").json()["records"]
+    assert [(r["kind"], r["source"], r["position"]) for r in found] == [
+        ("pbcoreIdentifier", "http://americanarchiveinventory.org", 1)
+    ]
+    assert found[0]["identifier"] == "The Debt Culture"
+    assert found[0]["title"] == "The Debt Culture"
+    assert found[0]["valid"]
+
+    # Every record shares the instantiation identifier, and the first two
+    # their AAPB ID with the invalid one, which differs only in a coverage.
+    duplicates = client.get("/index/duplicates?kind=instantiationIdentifier").json()[
+        "duplicates"
+    ]
+    assert [(d["source"], d["value"], len(d["records"])) for d in duplicates] == [
+        ("WYSU 88.5 FM", "673.0", 3)
+    ]
+    duplicates = client.get("/index/duplicates").json()["duplicates"]
+    assert [(d["value"], len(d["records"])) for d in duplicates] == [
+        ("The Debt Culture", 3),
+        ("cpb-aacip/100-009w0w2t", 2),
+    ]
+    assert [r["valid"] for r in duplicates[1]["records"]] == [True, False]
+    assert client.get("/index/duplicates?kind=content").json()["duplicates"] == []
+
+
+def test_batch_harvests(index):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as z:
+        z.writestr("a.xml", read(VALID))
+        z.writestr("b.xml", collection(renamed("cpb-aacip/2"), renamed("cpb-aacip/3")))
+    response = client.post(
+        "/validate/xml-batch?harvest=first",
+        files=[("files", ("records.zip", archive.getvalue()))],
+    )
+    assert response.json()["summary"] == {"files": 2, "valid": 2, "invalid": 0}
+    client.post(
+        "/validate/xml-batch?harvest=second",
+        files=[("files", ("again.xml", read(VALID))), ("files", ("bad.xml", b"<"))],
+    )
+
+    harvests = client.get("/index/harvests").json()["harvests"]
+    assert [(h["name"], h["records"]) for h in harvests] == [
+        ("first", 3),
+        ("second", 1),
+    ]
+    # The same record, byte for byte, in both harvests.
+    duplicates = client.get("/index/duplicates?kind=content&harvest=second").json()
+    (duplicate,) = duplicates["duplicates"]
+    assert [(r["harvest"], r["file"], r["archive"]) for r in duplicate["records"]] == [
+        ("first", "a.xml", "records.zip"),
+        ("second", "again.xml", None),
+    ]
+    found = client.get("/index/records?identifier=cpb-aacip/3").json()["records"]
+    assert [(r["file"], r["position"]) for r in found] == [("b.xml", 1)]
+
+    assert client.delete("/index/harvests/second").status_code == 204
+    assert client.delete("/index/harvests/second").status_code == 404
+    assert client.get("/index/duplicates?kind=content").json()["duplicates"] == []
+
+
+def test_no_harvest(index):
+    client.post("/validate/xml-collection-file", files={"file": collection(record())})
+    client.post("/validate/xml-batch", files=[("files", ("a.xml", read(VALID)))])
+    assert client.get("/index/harvests").json() == {"harvests": []}
+
+
+def test_buffer_writes_in_batches(index, monkeypatch):
+    writes = []
+    monkeypatch.setattr(index, "add", lambda harvest, entries: writes.append(entries))
+    with IndexBuffer(index, "big", size=3) as buffer:
+        for i in range(7):
+            buffer.add([i])
+    assert writes == [[0, 1, 2], [3, 4, 5], [6]]
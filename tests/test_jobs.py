@@ -0,0 +1,215 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import jobs
+from app.jobs import JobKind, JobQueue
+from app.main import app
+
+client = TestClient(app)
+
+VALID = "tests/sample_data/pbcore_xml/100-009w0w2t.xml"
+INVALID = "tests/sample_data/pbcore_xml/100-009w0w2t.invalid_coverage_type.xml"
+PBCORE_NS = "http://www.pbcore.org/PBCore/PBCoreNamespace.html"
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def record(path):
+    return read(path).split(b"?>", 1)[-1].strip()
+
+
+def collection(*paths):
+    return (
+        f'<pbcoreCollection xmlns="{PBCORE_NS}">'.encode()
+        + b"".join(record(path) for path in paths)
+        + b"</pbcoreCollection>"
+    )
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    queue = JobQueue(str(tmp_path / "jobs"), workers=1, max_queue=10, ttl=60)
+    monkeypatch.setattr("app.main.jobs", queue)
+    return queue
+
+
+def wait(job, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        status = client.get(f"/jobs/{job['id']}").json()
+        if status["status"] in ("done", "failed") or time.monotonic() > deadline:
+            return status
+        time.sleep(0.02)
+
+
+def blocked(monkeypatch):
+    # Make validate-collection jobs wait until the event is set, noting the
+    # order they run in.
+    release, ran = threading.Event(), []
+
+    def run(source, filename, params):
+        ran.append(filename)
+        release.wait(10)
+        yield b"{}\n"
+
+    kinds = {**jobs.KINDS, JobKind.validate_collection: (run, "application/x-ndjson")}
+    monkeypatch.setattr(jobs, "KINDS", kinds)
+    return release, ran
+
+
+### TESTS ###
+
+
+def test_job_matches_endpoint(queue):
+    content = collection(VALID, INVALID, VALID)
+    response = client.post(
+        "/jobs/xml-to-json-collection?engine=native&validate=true",
+        files={"file": ("records.xml", content)},
+    )
+    assert response.status_code == 202
+    job = response.json()
+    assert response.headers["Location"] == f"/jobs/{job['id']}"
+    assert job["status"] in ("queued", "running", "done")
+    assert job["size"] == len(content)
+
+    status = wait(job)
+    assert status["status"] == "done"
+    assert status["progress"] == 1
+    result = client.get(status["result"])
+    assert result.headers["content-type"] == "application/x-ndjson"
+    expected = client.post(
+        "/convert/xml-to-json-collection-file?engine=native&validate=true",
+        files={"file": content},
+    )
+    assert result.content == expected.content
+
+
+def test_batch_and_roundtrip_jobs(queue):
+    content = collection(VALID, INVALID)
+    job = client.post("/jobs/validate-batch", files={"file": ("a.xml", content)})
+    lines = client.get(wait(job.json())["result"]).text.splitlines()
+    assert json.loads(lines[-1]) == {"summary": {"files": 1, "valid": 0, "invalid": 1}}
+
+    job = client.post("/jobs/roundtrip", files={"file": ("a.xml", content)})
+    lines = client.get(wait(job.json())["result"]).text.splitlines()
+    assert [json.loads(line).get("lossless") for line in lines[:-1]] == [True, True]
+
+
+def test_smaller_jobs_first(queue, monkeypatch):
+    release, ran = blocked(monkeypatch)
+    first = client.post("/jobs/validate-collection", files={"file": ("first", b"x")})
+    while not ran:
+        time.sleep(0.01)
+    big = client.post("/jobs/validate-collection", files={"file": ("big", b"x" * 100)})
+    small = client.post("/jobs/validate-collection", files={"file": ("small", b"x")})
+    assert client.get(f"/jobs/{big.json()['id']}").json()["status"] == "queued"
+    release.set()
+    for job in (first, big, small):
+        assert wait(job.json())["status"] == "done"
+    assert ran == ["first", "small", "big"]
+
+
+def test_queue_full(queue, monkeypatch, tmp_path):
+    queue.max_queue = 1
+    release, ran = blocked(monkeypatch)
+    client.post("/jobs/validate-collection", files={"file": b"x"})
+    while not ran:
+        time.sleep(0.01)
+    assert client.post("/jobs/validate-collection", files={"file": b"x"}).is_success
+    response = client.post("/jobs/validate-collection", files={"file": b"x"})
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+    # Nothing is kept of the rejected job.
+    assert len(list(tmp_path.glob("jobs/*.input"))) == 2
+    with queue.store.db.connection() as db:
+        assert db.execute("SELECT COUNT(*) FROM jobs").fetchone() == (2,)
+    release.set()
+
+
+def test_not_found_not_done_and_delete(queue, monkeypatch):
+    release, _ = blocked(monkeypatch)
+    job = client.post("/jobs/validate-collection", files={"file": b"x"}).json()
+    response = client.get(f"/jobs/{job['id']}/result")
+    assert response.status_code == 409
+    assert response.json()["detail"]["status"] in ("queued", "running")
+
+    assert client.delete(f"/jobs/{job['id']}").status_code == 204
+    release.set()
+    assert client.get(f"/jobs/{job['id']}").status_code == 404
+    assert client.delete(f"/jobs/{job['id']}").status_code == 404
+    assert client.post("/jobs/no-such-kind", files={"file": b"x"}).status_code == 422
+
+
+def expire(queue, id):
+    with queue.store.db.connection() as db:
+        db.execute("UPDATE jobs SET expires = 0 WHERE id = ?", (id,))
+
+
+def test_expired_jobs_deleted(queue, tmp_path):
+    old = client.post("/jobs/validate-collection", files={"file": collection(VALID)})
+    old = old.json()["id"]
+    assert wait({"id": old})["status"] == "done"
+    expire(queue, old)
+    # Polling for any job deletes it, as does submitting another.
+    other = client.post("/jobs/validate-collection", files={"file": b"x"}).json()
+    assert not list((tmp_path / "jobs").glob(f"{old}.*"))
+    assert client.get(f"/jobs/{old}").status_code == 404
+
+    wait(other)
+    expire(queue, other["id"])
+    assert client.get(f"/jobs/{other['id']}/result").status_code == 404
+    assert not list((tmp_path / "jobs").glob(f"{other['id']}.*"))
+
+
+def test_worker_gone(queue):
+    # A job queued by a worker process that no longer exists.
+    queue.store.create("orphan", "validate-collection", None, {}, 1, max_queue=1)
+    with queue.store.db.connection() as db:
+        db.execute("UPDATE jobs SET pid = 2147483647")
+    status = client.get("/jobs/orphan").json()
+    assert status["status"] == "failed"
+    assert status["error"] == "Worker process stopped"
+
+
+def test_stopped_workers_jobs_failed_at_start(queue):
+    # Left running by a stopped process, and by an earlier process with this
+    # one's PID; never polled.
+    for id, pid in (("stopped", 2147483647), ("restarted", os.getpid())):
+        queue.store.create(id, "validate-collection", None, {}, 1, max_queue=2)
+        queue.store.start(id)
+        with queue.store.db.connection() as db:
+            db.execute("UPDATE jobs SET pid = ? WHERE id = ?", (pid, id))
+    job = client.post("/jobs/validate-collection", files={"file": collection(VALID)})
+    assert wait(job.json())["status"] == "done"
+    for id in ("stopped", "restarted"):
+        job = queue.store.get(id)
+        assert job["status"] == "failed"
+        assert job["expires"] is not None
+
+
+def test_job_thread_survives_errors(queue, monkeypatch):
+    get = queue.store.get
+    failures = [sqlite3.OperationalError("database is locked")]
+
+    def flaky_get(id):
+        # Fails once, in the job thread.
+        if failures and threading.current_thread().name == "pbcore-job":
+            raise failures.pop()
+        return get(id)
+
+    monkeypatch.setattr(queue.store, "get", flaky_get)
+    first = client.post("/jobs/validate-collection", files={"file": collection(VALID)})
+    status = wait(first.json())
+    assert status["status"] == "failed"
+    assert status["error"] == "OperationalError: database is locked"
+    second = client.post("/jobs/validate-collection", files={"file": collection(VALID)})
+    assert wait(second.json())["status"] == "done"
@@ -0,0 +1,144 @@
+import json
+
+import httpx
+from fastapi.testclient import TestClient
+from jsonschema import Draft202012Validator
+from lxml import etree
+from pytest import fixture, mark
+
+from app import core
+from app.config import JSON_SCHEMA_PATH, XSD_PATH
+from app.core import Engine
+from app.fetch import Fetcher
+from app.json_schema import derive_json_schema
+from app.main import app
+from app.registry import json_schema_registry
+
+client = TestClient(app)
+
+VALID = "tests/sample_data/pbcore_xml/100-009w0w2t.xml"
+INVALID = "tests/sample_data/pbcore_xml/100-009w0w2t.invalid_coverage_type.xml"
+
+
+def converted(path, engine=Engine.xslt):
+    with open(path, "rb") as f:
+        return json.loads(core.xml_to_json(f.read(), engine))
+
+
+### FIXTURES ###
+@fixture
+def valid_json():
+    return converted(VALID)
+
+
+### TESTS ###
+
+
+def test_json_schema_matches_xsd():
+    with open(JSON_SCHEMA_PATH) as f:
+        on_disk = json.load(f)
+    assert on_disk == derive_json_schema(etree.parse(XSD_PATH).getroot())
+    Draft202012Validator.check_schema(on_disk)
+
+
+@mark.parametrize("engine", list(Engine))
+def test_validate_json(engine):
+    response = client.post(
+        "/validate/json-file",
+        files={"file": ("valid.json", json.dumps(converted(VALID, engine)))},
+    )
+    assert response.status_code == 200
+    assert response.json() == {"valid": True, "file": "valid.json"}
+
+
+def test_validate_json_invalid_like_xsd():
+    # The document the XSD rejects is rejected for the same reason.
+    response = client.post(
+        "/validate/json-file", files={"file": json.dumps(converted(INVALID))}
+    )
+    assert response.status_code == 422
+    detail = response.json()["detail"]
+    assert detail["message"] == "PBCore JSON Validation Error"
+    assert detail["errors"] == [
+        {
+            "pointer": "/pbcoreDescriptionDocument/pbcoreCoverage/0/coverageType/text",
+            "message": "'spatial' is not one of ['Spatial', 'Temporal']",
+            "keyword": "enum",
+        }
+    ]
+
+
+def test_validate_json_reports_all_errors(valid_json):
+    document = valid_json["pbcoreDescriptionDocument"]
+    del document["pbcoreIdentifier"]
+    document["pbcoreTitle"][0]["text"] = 1
+    document["pbcoreTitle/odd~name"] = []
+    response = client.post(
+        "/validate/json-file", files={"file": json.dumps(valid_json)}
+    )
+    pointers = [error["pointer"] for error in response.json()["detail"]["errors"]]
+    assert pointers == [
+        "/pbcoreDescriptionDocument",
+        "/pbcoreDescriptionDocument",
+        "/pbcoreDescriptionDocument/pbcoreTitle/0/text",
+    ]
+    messages = [error["message"] for error in response.json()["detail"]["errors"]]
+    assert "'pbcoreIdentifier' is a required property" in messages
+    assert any("pbcoreTitle/odd~name" in message for message in messages)
+
+
+def test_json_pointer_escaping():
+    assert core.json_pointer(["a/b", "c~d", 0]) == "/a~1b/c~0d/0"
+
+
+def test_validate_json_choices(valid_json):
+    document = valid_json["pbcoreDescriptionDocument"]
+    document["pbcoreRightsSummary"] = {"rightsSummary": {"text": "Open"}}
+    assert core.json_validation_errors(json.dumps(valid_json)) == []
+
+    # rightsSummary, rightsLink and rightsEmbedded are a choice.
+    document["pbcoreRightsSummary"]["rightsLink"] = {"text": "http://rights"}
+    (error,) = core.json_validation_errors(json.dumps(valid_json))
+    assert error["pointer"] == "/pbcoreDescriptionDocument/pbcoreRightsSummary"
+
+    # One of extensionWrap and extensionEmbedded is required.
+    del document["pbcoreRightsSummary"]
+    document["pbcoreExtension"] = [{}]
+    (error,) = core.json_validation_errors(json.dumps(valid_json))
+    assert error["keyword"] == "oneOf"
+
+
+def test_validate_json_not_json():
+    response = client.post("/validate/json-file", files={"file": b"<xml/>"})
+    assert response.status_code == 422
+    assert "JSON Parsing Error" in response.json()["detail"]
+
+    nested = b"[" * 100000 + b"]" * 100000
+    response = client.post("/validate/json-file", files={"file": nested})
+    assert response.status_code == 422
+    assert "nested too deeply" in response.json()["detail"]
+
+
+def test_validate_json_url(monkeypatch, valid_json):
+    def handler(request):
+        if request.url.path == "/valid.json":
+            return httpx.Response(200, json=valid_json)
+        return httpx.Response(404)
+
+    fetcher = Fetcher(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr("app.main.fetcher", fetcher)
+    response = client.post("/validate/json-url?url=http://repo.test/valid.json")
+    assert response.status_code == 200
+    assert response.json() == {"valid": True, "url": "http://repo.test/valid.json"}
+
+    response = client.post("/validate/json-url?url=http://repo.test/missing.json")
+    assert response.status_code == 400
+
+
+def test_json_schema_compiled_once(valid_json):
+    json_schema_registry.load()
+    compiled = json_schema_registry._get()
+    for _ in range(3):
+        assert core.json_validation_errors(json.dumps(valid_json)) == []
+    assert json_schema_registry._get() is compiled
+    assert compiled.pool.created == 1
@@ -0,0 +1,204 @@
+import glob
+import json
+
+from fastapi.testclient import TestClient
+from lxml import etree
+from pytest import mark, raises
+
+from app import core
+from app.collection import PBCORE_NS
+from app.core import Engine, JSONConversionError
+from app.main import app
+
+client = TestClient(app)
+
+SAMPLES = sorted(glob.glob("tests/sample_data/pbcore_xml/*.xml"))
+VALID = "tests/sample_data/pbcore_xml/100-009w0w2t.xml"
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def as_json(path):
+    return core.xml_to_json(read(path), Engine.native)
+
+
+### TESTS ###
+
+
+@mark.parametrize("path", SAMPLES)
+def test_json_to_xml_inverts_xml_to_json(path):
+    pbcore_json = as_json(path)
+    pbcore_xml = core.json_to_xml(pbcore_json.encode())
+    assert json.loads(core.xml_to_json(pbcore_xml)) == json.loads(pbcore_json)
+
+
+def test_json_to_xml_endpoint():
+    response = client.post(
+        "/convert/json-to-xml", files={"file": as_json(VALID).encode()}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/xml"
+    assert core.validation_error(response.content) is None
+
+
+def test_json_to_xml_xsd_order():
+    document = json.loads(as_json(VALID))
+    record = document["pbcoreDescriptionDocument"]
+    document["pbcoreDescriptionDocument"] = dict(reversed(list(record.items())))
+    pbcore_xml = core.json_to_xml(json.dumps(document))
+    assert core.validation_error(pbcore_xml) is None
+    names = [etree.QName(child).localname for child in etree.fromstring(pbcore_xml)]
+    assert names.index("pbcoreIdentifier") < names.index("pbcoreTitle")
+    assert names.index("pbcoreInstantiation") < names.index("pbcoreAnnotation")
+
+
+def test_json_to_xml_attributes_and_escaping():
+    pbcore_xml = core.json_to_xml(
+        json.dumps(
+            {
+                "pbcoreDescriptionDocument": {
+                    "xsi:schemaLocation": "urn:a a.xsd",
+                    "pbcoreTitle": [{"titleType": 'say "hi"', "text": "<b> & </b>"}],
+                }
+            }
+        )
+    )
+    root = etree.fromstring(pbcore_xml)
+    assert root.nsmap[None] == PBCORE_NS
+    assert root.get("{http://www.w3.org/2001/XMLSchema-instance}schemaLocation")
+    (title,) = root
+    assert title.tag == f"{{{PBCORE_NS}}}pbcoreTitle"
+    assert title.get("titleType") == 'say "hi"'
+    assert title.text == "<b> & </b>"
+
+
+def test_json_to_xml_errors():
+    with raises(JSONConversionError) as exc_info:
+        core.json_to_xml(b'{"pbcoreDescriptionDocument": {"pbcoreTitle": [1]}}')
+    assert str(exc_info.value) == (
+        "Expected an object, got int at /pbcoreDescriptionDocument/pbcoreTitle/0"
+    )
+    with raises(JSONConversionError):
+        core.json_to_xml(b'{"something": {}}')
+    with raises(JSONConversionError) as exc_info:
+        core.json_to_xml(b'{"pbcoreDescriptionDocument": {"odrl:policy": {}}}')
+    assert "odrl" in str(exc_info.value)
+
+    response = client.post(
+        "/convert/json-to-xml",
+        files={"file": b'{"pbcoreDescriptionDocument": {"pbcoreTitle": null}}'},
+    )
+    assert response.status_code == 422
+    assert "PBCore JSON Conversion Error" in response.json()["detail"]
+    response = client.post("/convert/json-to-xml", files={"file": b"{"})
+    assert response.status_code == 422
+    assert "JSON Parsing Error" in response.json()["detail"]
+
+
+def test_json_to_xml_names_and_strings():
+    for document, message in [
+        (
+            {"pbcoreDescriptionDocument": {"bad key": {"text": "x"}}},
+            "'bad key' isn't an XML name at /pbcoreDescriptionDocument/bad key/0",
+        ),
+        (
+            {"pbcoreDescriptionDocument": {"pbcoreTitle": {"a<b": "1", "text": "t"}}},
+            "'a<b' isn't an XML name at /pbcoreDescriptionDocument/pbcoreTitle/0/a<b",
+        ),
+        (
+            {"pbcoreDescriptionDocument": {"pbcoreTitle": {"text": "t\u0000"}}},
+            "at /pbcoreDescriptionDocument/pbcoreTitle/0/text",
+        ),
+        (
+            {"pbcoreDescriptionDocument": {"pbcoreTitle": {"titleType": "\u0001"}}},
+            "at /pbcoreDescriptionDocument/pbcoreTitle/0",
+        ),
+    ]:
+        content = json.dumps(document).replace("\\\\", "\\").encode()
+        with raises(JSONConversionError) as exc_info:
+            core.json_to_xml(content)
+        assert str(exc_info.value).endswith(message)
+        response = client.post("/convert/json-to-xml", files={"file": content})
+        assert response.status_code == 422
+
+    # In a collection, the record is left out like any other bad one.
+    lines = [
+        as_json(VALID),
+        '{"pbcoreDescriptionDocument": {"pbcoreTitle": {"text": "\\u0000"}}}',
+        '{"pbcoreDescriptionDocument": {"bad key": {}}}',
+    ]
+    response = client.post(
+        "/convert/json-to-xml-collection-file",
+        files={"file": "\n".join(lines).encode()},
+    )
+    assert response.status_code == 200
+    converted = etree.fromstring(response.content)
+    assert len(converted.findall(f"{{{PBCORE_NS}}}pbcoreDescriptionDocument")) == 1
+    assert response.text.count("not converted") == 2
+
+
+def test_json_to_xml_collection():
+    ndjson = "\n".join(
+        [as_json(VALID), "", "not json", '{"other": {}}', as_json(VALID)]
+    )
+    response = client.post(
+        "/convert/json-to-xml-collection-file",
+        files={"file": ("records.ndjson", ndjson.encode())},
+    )
+    assert response.status_code == 200
+    collection = etree.fromstring(response.content)
+    assert collection.tag == f"{{{PBCORE_NS}}}pbcoreCollection"
+    assert len(collection.findall(f"{{{PBCORE_NS}}}pbcoreDescriptionDocument")) == 2
+    comments = [node.text for node in collection if isinstance(node, etree._Comment)]
+    assert len(comments) == 2
+    assert comments[0].startswith(" Record 1 not converted")
+
+
+def test_json_to_xml_nested_too_deeply(monkeypatch):
+    nested = {}
+    for _ in range(5000):
+        nested = {"pbcoreTitle": nested}
+    document = {"pbcoreDescriptionDocument": nested}
+    # JSON this deep can't be parsed either, so hand the conversion the
+    # parsed document directly.
+    monkeypatch.setattr(core, "parse_json", lambda source: document)
+    response = client.post("/convert/json-to-xml", files={"file": b"{}"})
+    assert response.status_code == 422
+    assert "nested too deeply" in response.json()["detail"]
+
+
+def test_json_to_xml_collection_nested_too_deeply():
+    deep = b'{"a": ' * 100000 + b"{}" + b"}" * 100000
+    ndjson = b"\n".join([deep, as_json(VALID).encode()])
+    response = client.post(
+        "/convert/json-to-xml-collection-file",
+        files={"file": ("records.ndjson", ndjson)},
+    )
+    assert response.status_code == 200
+    collection = etree.fromstring(response.content)
+    assert len(collection.findall(f"{{{PBCORE_NS}}}pbcoreDescriptionDocument")) == 1
+    comments = [node.text for node in collection if isinstance(node, etree._Comment)]
+    assert comments == [" Record 0 not converted: nested too deeply "]
+
+
+def test_json_to_xml_collection_roundtrip():
+    collection = (
+        b'<pbcoreCollection xmlns="http://www.pbcore.org/PBCore/PBCoreNamespace.html">'
+        + read(VALID).split(b"?>", 1)[1] * 3
+        + b"</pbcoreCollection>"
+    )
+    ndjson = client.post(
+        "/convert/xml-to-json-collection-file", files={"file": collection}
+    ).content
+    response = client.post(
+        "/convert/json-to-xml-collection-file", files={"file": ndjson}
+    )
+    lines = client.post(
+        "/validate/xml-collection-file", files={"file": response.content}
+    ).text.splitlines()
+    assert json.loads(lines[-1]) == {
+        "summary": {"records": 3, "valid": 3, "invalid": 0}
+    }
@@ -1,5 +1,5 @@
 from fastapi.testclient import TestClient
-from pytest import fixture
+from pytest import fixture, mark
 
 from app.main import app
 
@@ -86,6 +86,82 @@ def test_validate_xml_not_xml(file_not_xml):
     assert "XML Parsing Error" in response_json["detail"]
 
 
+def test_validate_xml_all_errors(pbcore_invalid_coverage_type):
+    # Besides the coverageType, both descriptions have an unknown attribute.
+    pbcore_xml = pbcore_invalid_coverage_type.read().replace(
+        b"<pbcoreDescription>", b'<pbcoreDescription bogus="1">'
+    )
+    response = client.post(
+        "/validate/xml-file?all_errors=true", files={"file": pbcore_xml}
+    )
+    assert response.status_code == 422
+    detail = response.json()["detail"]
+    assert detail["message"] == "PBCore XML Validation Error"
+    assert detail["error_count"] == 3
+    assert [error["path"] for error in detail["errors"]] == [
+        "/pbcoreDescriptionDocument/pbcoreDescription[1]",
+        "/pbcoreDescriptionDocument/pbcoreDescription[2]",
+        "/pbcoreDescriptionDocument/pbcoreCoverage[1]/coverageType[1]",
+    ]
+    coverage_type = detail["errors"][2]
+    assert coverage_type["line"] == 13
+    assert coverage_type["column"] is None
+    assert coverage_type["domain"] == "SCHEMASV"
+    assert coverage_type["type"] == "SCHEMAV_CVC_ENUMERATION_VALID"
+    assert "'spatial'" in coverage_type["message"]
+
+    response = client.post(
+        "/validate/xml-file?all_errors=true&max_errors=1", files={"file": pbcore_xml}
+    )
+    detail = response.json()["detail"]
+    assert detail["error_count"] == 3
+    assert len(detail["errors"]) == 1
+
+    response = client.post(
+        "/validate/xml-file?all_errors=true&max_errors=100000",
+        files={"file": pbcore_xml},
+    )
+    assert response.status_code == 422
+    assert isinstance(response.json()["detail"], list)
+
+
+def test_validate_xml_all_errors_not_xml():
+    response = client.post(
+        "/validate/xml-file?all_errors=true", files={"file": b"<a>\n<b></a>"}
+    )
+    assert response.status_code == 422
+    detail = response.json()["detail"]
+    assert detail["message"] == "XML Parsing Error"
+    (error,) = detail["errors"]
+    assert error["line"] == 2
+    assert error["domain"] == "PARSER"
+
+    # Nothing to parse leaves nothing in the parser's log.
+    response = client.post("/validate/xml-file?all_errors=true", files={"file": b""})
+    assert response.status_code == 422
+    (error,) = response.json()["detail"]["errors"]
+    assert error["line"] is None
+    assert error["message"]
+
+
+def test_validate_xml_fail_fast(valid_xml, pbcore_invalid_coverage_type, monkeypatch):
+    def no_messages(*args):
+        raise AssertionError("error messages formatted")
+
+    monkeypatch.setattr("app.core.validation_error", no_messages)
+    monkeypatch.setattr("app.core.validation_report", no_messages)
+    response = client.post(
+        "/validate/xml-file?fail_fast=true", files={"file": valid_xml}
+    )
+    assert response.status_code == 200
+    for invalid in (pbcore_invalid_coverage_type, b"not xml"):
+        response = client.post(
+            "/validate/xml-file?fail_fast=true", files={"file": invalid}
+        )
+        assert response.status_code == 422
+        assert response.json() == {"detail": "PBCore XML Validation Error"}
+
+
 def test_convert_xml_to_json_single_repeatable_elements(
     pbcore_xml_single_repeatable_elements,
 ):
@@ -655,3 +731,35 @@ def test_convert_xml_to_json_handles_special_characters(
         response_json["pbcoreDescriptionDocument"]["pbcoreTitle"][6]["text"]
         == r'["[\"480\"]"] x ["[\"360\"]"]'
     )
+
+
+@mark.parametrize("engine", ["xslt", "native"])
+def test_convert_xml_to_json_escapes_control_characters(engine):
+    # Character references put tabs and newlines in attribute values.
+    pbcore_xml = (
+        b'<pbcoreDescriptionDocument xmlns="http://www.pbcore.org/PBCore/'
+        b'PBCoreNamespace.html"><pbcoreTitle titleType="a&#10;b&#9;c&#13;">'
+        b"title</pbcoreTitle></pbcoreDescriptionDocument>"
+    )
+    response = client.post(
+        f"/convert/xml-to-json-file?engine={engine}", files={"file": pbcore_xml}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert b"\n" not in response.content
+    title = response.json()["pbcoreDescriptionDocument"]["pbcoreTitle"][0]
+    assert title["titleType"] == "a\nb\tc\r"
+
+
+def test_convert_xml_to_json_verify(monkeypatch, valid_xml):
+    monkeypatch.setattr("app.main.VERIFY_JSON", True)
+    response = client.post("/convert/xml-to-json-file", files={"file": valid_xml})
+    assert response.status_code == 200
+
+    monkeypatch.setattr("app.core.native.xml_to_json", lambda *args: '{"a":')
+    response = client.post(
+        "/convert/xml-to-json-file?engine=native",
+        files={"file": b"<pbcoreDescriptionDocument/>"},
+    )
+    assert response.status_code == 500
+    assert "invalid JSON" in response.json()["detail"]
@@ -0,0 +1,127 @@
+import os
+import subprocess
+import sys
+
+from fastapi.testclient import TestClient
+
+from app.executor import WorkPool
+from app.main import app
+
+client = TestClient(app)
+
+VALID = "tests/sample_data/pbcore_xml/100-009w0w2t.xml"
+
+# Handles a request and prints /metrics, as one gunicorn worker would.
+WORKER = """
+from fastapi.testclient import TestClient
+from app.main import app
+
+client = TestClient(app)
+with open({path!r}, "rb") as f:
+    client.post("/validate/xml-file", files={{"file": f}})
+print(client.get("/metrics").text)
+"""
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def server_timing(response):
+    return {
+        metric.split(";")[0]: float(metric.split("dur=")[1])
+        for metric in response.headers["Server-Timing"].split(", ")
+    }
+
+
+def metric(text, line_start):
+    for line in text.splitlines():
+        if line.startswith(line_start):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+
+### TESTS ###
+
+
+def test_server_timing():
+    response = client.post("/validate/xml-file", files={"file": read(VALID)})
+    assert set(server_timing(response)) == {"read", "parse", "validate"}
+
+    response = client.post(
+        "/convert/xml-to-json-file?engine=native", files={"file": read(VALID)}
+    )
+    assert set(server_timing(response)) == {"read", "parse", "transform", "serialize"}
+
+    response = client.get("/health")
+    assert "Server-Timing" not in response.headers
+
+
+def test_server_timing_from_worker_processes(monkeypatch):
+    pool = WorkPool(max_workers=1, max_queue=0, processes=True)
+    monkeypatch.setattr("app.main.work_pool", pool)
+    response = client.post("/validate/xml-file", files={"file": read(VALID)})
+    pool.shutdown()
+    assert response.status_code == 200
+    assert {"parse", "validate"} <= set(server_timing(response))
+
+
+def test_metrics():
+    client.post("/validate/xml-file", files={"file": read(VALID)})
+    client.post("/validate/xml-file", files={"file": b"not xml"})
+    client.get("/no-such-page")
+    text = client.get("/metrics").text
+
+    labels = 'endpoint="/validate/xml-file",method="POST"'
+    assert metric(text, f"pbcore_requests_total{{{labels},status=") >= 1
+    assert metric(text, f"pbcore_request_duration_seconds_count{{{labels}}}") >= 2
+    assert (
+        metric(
+            text,
+            'pbcore_stage_duration_seconds_count{endpoint="/validate/xml-file",'
+            'stage="validate"}',
+        )
+        >= 1
+    )
+    assert metric(
+        text,
+        'pbcore_document_size_bytes_sum{endpoint="/validate/xml-file"}',
+    ) >= len(read(VALID))
+    assert 'endpoint="unmatched",method="GET",status="404"' in text
+
+
+def test_gunicorn_conf_sets_multiprocess_mode(tmp_path):
+    env = {**os.environ, "TMPDIR": str(tmp_path)}
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    config = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import gunicorn_conf; from prometheus_client import values; "
+            "print(values.ValueClass.__name__)",
+        ],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # MutexValue if prometheus_client was imported before the directory was set.
+    assert config.stdout.strip() == "MmapedValue"
+
+
+def test_metrics_added_up_across_processes(tmp_path):
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+    for _ in range(2):
+        worker = subprocess.run(
+            [sys.executable, "-c", WORKER.format(path=VALID)],
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    line_start = (
+        'pbcore_requests_total{endpoint="/validate/xml-file",method="POST",'
+        'status="200"}'
+    )
+    assert metric(worker.stdout, line_start) == 2
@@ -0,0 +1,145 @@
+import glob
+import json
+import time
+
+from fastapi.testclient import TestClient
+from lxml import etree
+from pytest import fixture, mark
+
+from app import core
+from app.config import XSL_PATH
+from app.core import Engine
+from app.elements import element_tables, legacy_lists
+from app.main import app
+
+client = TestClient(app)
+
+SAMPLES = sorted(glob.glob("tests/sample_data/pbcore_xml/*.xml"))
+SUBELEMENTS = "tests/sample_data/pbcore_xml/subelements.xml"
+
+
+### FIXTURES ###
+@fixture
+def tricky_xml():
+    return b"""<?xml version="1.0" encoding="UTF-8"?>
+<!-- leading comment -->
+<pb:pbcoreDescriptionDocument xmlns:pb="urn:example:pbcore"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    xsi:schemaLocation="urn:example:pbcore example.xsd">
+  <pbcoreTitle xml:lang="en" note='say "hi" \\ bye'>  Spaced
+      out\ttitle  </pbcoreTitle>
+  <pbcoreTitle>mixed <b>bold</b> <i>italic</i>&#160;text<!-- gone --></pbcoreTitle>
+  <pbcoreInstantiation>
+    <instantiationDuration>00:01:00</instantiationDuration>
+    <instantiationDuration>dropped</instantiationDuration>
+    <?processing instruction?>
+  </pbcoreInstantiation>
+  <pbcoreCoverage annotation="a"><coverage>x</coverage></pbcoreCoverage>
+  <unknownElement/>
+</pb:pbcoreDescriptionDocument>"""
+
+
+### TESTS ###
+
+
+@mark.parametrize("path", SAMPLES)
+def test_native_matches_xslt_on_samples(path):
+    with open(path, "rb") as f:
+        content = f.read()
+    assert core.xml_to_json(content, Engine.native) == core.xml_to_json(
+        content, Engine.xslt
+    )
+
+
+def test_native_matches_xslt_on_edge_cases(tricky_xml):
+    assert core.xml_to_json(tricky_xml, Engine.native) == core.xml_to_json(
+        tricky_xml, Engine.xslt
+    )
+
+
+def test_stylesheet_defaults_match_tables():
+    tables = element_tables()
+    repeatable, with_sub_elements = legacy_lists()
+    assert tables.repeatable == repeatable
+    assert tables.with_sub_elements == with_sub_elements
+    # Read from the stylesheet, misses and all.
+    assert len(repeatable) == 35 and len(with_sub_elements) == 13
+    assert "pbcoreTitle" in repeatable
+    assert "pbcoreRightsSummary" in with_sub_elements - repeatable
+
+
+@mark.parametrize("path", SAMPLES)
+def test_default_conversion_unchanged(path):
+    # The stylesheet run with its own lists, as it always has been.
+    with open(path, "rb") as f:
+        content = f.read()
+    transform = etree.XSLT(etree.parse(XSL_PATH))
+    assert core.xml_to_json(content) == str(transform(etree.fromstring(content)))
+
+
+def test_element_tables_from_xsd():
+    tables = element_tables()
+    assert "pbcoreTitle" in tables.repeatable
+    assert "instantiationDuration" not in tables.repeatable
+    assert "pbcoreInstantiation" in tables.with_sub_elements
+    assert "pbcoreTitle" not in tables.with_sub_elements
+    assert "instantiationLanguage" not in tables.repeatable
+
+    derived = element_tables(derived=True)
+    assert {"instantiationLanguage", "pbcoreRightsSummary"} <= derived.repeatable
+    assert derived.repeatable > tables.repeatable
+    assert derived.child_order == tables.child_order
+
+
+@mark.parametrize("engine", list(Engine))
+def test_derived_element_tables(engine, monkeypatch):
+    with open(SUBELEMENTS, "rb") as f:
+        content = f.read()
+    rights = json.loads(core.xml_to_json(content, engine))["pbcoreDescriptionDocument"][
+        "pbcoreRightsSummary"
+    ]
+    assert isinstance(rights, dict)
+
+    monkeypatch.setattr("app.elements.DERIVED_ELEMENT_TABLES", True)
+    converted = core.xml_to_json(content, engine)
+    assert converted == core.xml_to_json(content, Engine.native)
+    rights = json.loads(converted)["pbcoreDescriptionDocument"]["pbcoreRightsSummary"]
+    assert len(rights) == 2
+
+
+def test_native_is_linear_in_sibling_count():
+    with open("tests/sample_data/pbcore_xml/100-009w0w2t.xml", "rb") as f:
+        content = f.read()
+    title = b'<pbcoreTitle titleType="Program">The Debt Culture</pbcoreTitle>\n'
+
+    def timed(count):
+        document = content.replace(
+            b"<pbcoreDescription>", title * count + b"<pbcoreDescription>", 1
+        )
+        start = time.perf_counter()
+        core.xml_to_json(document, Engine.native)
+        return time.perf_counter() - start
+
+    timed(1000)
+    # Quadratic grouping would take ~64x as long for 8x the titles.
+    assert timed(16000) < 20 * timed(2000)
+
+
+def test_convert_endpoint_native_engine():
+    for path in SAMPLES:
+        with open(path, "rb") as f:
+            content = f.read()
+        xslt = client.post("/convert/xml-to-json-file", files={"file": content})
+        native = client.post(
+            "/convert/xml-to-json-file?engine=native", files={"file": content}
+        )
+        assert native.status_code == 200
+        assert native.json() == xslt.json()
+
+
+def test_convert_endpoint_rejects_unknown_engine():
+    with open(SAMPLES[0], "rb") as f:
+        response = client.post(
+            "/convert/xml-to-json-file?engine=fast", files={"file": f}
+        )
+    assert response.status_code == 422
@@ -0,0 +1,76 @@
+import json
+
+from fastapi.testclient import TestClient
+
+from app import core
+from app.core import Engine
+from app.main import app
+
+client = TestClient(app)
+
+VALID = "tests/sample_data/pbcore_xml/100-009w0w2t.xml"
+INVALID = "tests/sample_data/pbcore_xml/100-009w0w2t.invalid_coverage_type.xml"
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def process(path, query):
+    return client.post(f"/process/xml-file?{query}", files={"file": read(path)})
+
+
+### TESTS ###
+
+
+def test_process_all():
+    response = process(
+        VALID,
+        "operations=validate,hash,convert&operations=extract"
+        "&paths=pbcoreTitle&engine=native",
+    )
+    assert response.status_code == 200
+    result = response.json()
+    assert list(result) == ["valid", "hash", "json", "fields"]
+    assert result["valid"] is True
+    assert result["json"] == json.loads(core.xml_to_json(read(VALID), Engine.native))
+    assert result["fields"] == {
+        "pbcoreTitle": [{"titleType": "Program", "text": "The Debt Culture"}]
+    }
+    # The same hash however the document is formatted.
+    reformatted = read(VALID).replace(b'titleType="Program"', b"titleType='Program'")
+    response = client.post(
+        "/process/xml-file?operations=hash", files={"file": reformatted}
+    )
+    assert response.json() == {"hash": result["hash"]}
+
+
+def test_invalid():
+    result = process(INVALID, "operations=validate,convert").json()
+    assert result["valid"] is False
+    assert result["error"].startswith("PBCore XML Validation Error")
+    assert "pbcoreDescriptionDocument" in result["json"]
+
+    result = process(
+        INVALID,
+        "operations=validate,convert,extract&paths=pbcoreTitle"
+        "&skip_invalid=true&all_errors=true",
+    ).json()
+    assert result["valid"] is False
+    assert result["errors"]["error_count"] == 1
+    assert result["skipped"] == ["convert", "extract"]
+    assert "json" not in result and "fields" not in result
+
+
+def test_bad_requests():
+    for query in (
+        "operations=validate,frobnicate",
+        "operations=",
+        "operations=extract",
+        "operations=extract&paths=pbcoreFoo",
+    ):
+        assert process(VALID, query).status_code == 422, query
+    response = client.post("/process/xml-file", files={"file": b"<oops"})
+    assert response.status_code == 422
+    assert response.json()["detail"].startswith("XML Parsing Error")
@@ -0,0 +1,104 @@
+import json
+
+from fastapi.testclient import TestClient
+
+from app import core
+from app.core import Engine
+from app.main import app
+from app.projection import project
+
+client = TestClient(app)
+
+VALID = "tests/sample_data/pbcore_xml/100-009w0w2t.xml"
+PBCORE_NS = "http://www.pbcore.org/PBCore/PBCoreNamespace.html"
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def make_collection(*records):
+    return (
+        f'<pbcoreCollection xmlns="{PBCORE_NS}">'.encode()
+        + b"".join(records)
+        + b"</pbcoreCollection>"
+    )
+
+
+### TESTS ###
+
+
+def test_fields_as_converted():
+    content = read(VALID)
+    converted = json.loads(core.xml_to_json(content, Engine.native))
+    document = converted["pbcoreDescriptionDocument"]
+    fields = json.loads(project(content, ["pbcoreInstantiation", "pbcoreTitle"]))
+    assert fields == {
+        "pbcoreInstantiation": document["pbcoreInstantiation"],
+        "pbcoreTitle": document["pbcoreTitle"],
+    }
+
+
+def test_extract_fields():
+    response = client.post(
+        "/extract/xml-file?paths=pbcoreTitle,pbcoreIdentifier/@source"
+        "&paths=pbcoreInstantiation/instantiationDuration&paths=pbcoreTitle",
+        files={"file": read(VALID)},
+    )
+    assert response.status_code == 200
+    assert response.json() == {
+        "pbcoreTitle": [{"titleType": "Program", "text": "The Debt Culture"}],
+        "pbcoreIdentifier/@source": ["WYSU", "http://americanarchiveinventory.org"],
+        "pbcoreInstantiation/instantiationDuration": [{"text": "00:03:00"}],
+    }
+
+
+def test_bad_paths():
+    for paths in ("pbcoreFoo", "pbcoreInstantiation/pbcoreTitle", "@id", "/"):
+        response = client.post(
+            f"/extract/xml-file?paths={paths}", files={"file": read(VALID)}
+        )
+        assert response.status_code == 422, paths
+    response = client.post(
+        "/extract/xml-collection-file?paths=pbcoreTitle/@not%20a%20name",
+        files={"file": make_collection()},
+    )
+    assert response.status_code == 422
+
+    response = client.post(
+        "/extract/xml-file?paths=pbcoreTitle",
+        files={"file": make_collection(read(VALID).split(b"?>", 1)[1])},
+    )
+    assert response.status_code == 422
+    assert "pbcoreDescriptionDocument" in response.json()["detail"]
+
+
+def test_extract_collection_fields():
+    record = read(VALID).split(b"?>", 1)[1]
+    # A pbcorePart has its own pbcoreTitle, which mustn't be dropped along with
+    # the record's.
+    part = record.replace(
+        b"</pbcoreDescriptionDocument>",
+        b"<pbcorePart><pbcoreTitle>Part one</pbcoreTitle></pbcorePart>"
+        b"</pbcoreDescriptionDocument>",
+    )
+    response = client.post(
+        "/extract/xml-collection-file?paths=pbcorePart/pbcoreTitle"
+        "&paths=pbcoreInstantiation/instantiationLocation",
+        files={"file": make_collection(record, part) + b"<oops"},
+    )
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    location = [{"text": "WYSU Archive"}]
+    assert lines[:2] == [
+        {
+            "pbcorePart/pbcoreTitle": [],
+            "pbcoreInstantiation/instantiationLocation": location,
+        },
+        {
+            "pbcorePart/pbcoreTitle": [{"text": "Part one"}],
+            "pbcoreInstantiation/instantiationLocation": location,
+        },
+    ]
+    assert lines[2]["error"].startswith("XML Parsing Error")
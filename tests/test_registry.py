@@ -0,0 +1,92 @@
+import os
+import shutil
+
+from lxml import etree
+from pytest import fixture
+
+from app.config import XSD_PATH, XSL_PATH
+from app.registry import SchemaRegistry, StylesheetRegistry
+
+
+### FIXTURES ###
+@fixture
+def registry(tmp_path):
+    xsd_path = tmp_path / "pbcore.xsd"
+    shutil.copy(XSD_PATH, xsd_path)
+    return SchemaRegistry({"2.1": str(xsd_path)}, pool_size=2)
+
+
+@fixture
+def stylesheets(tmp_path):
+    xsl_path = tmp_path / "pbcore.xsl"
+    shutil.copy(XSL_PATH, xsl_path)
+    return StylesheetRegistry({"xml-to-json": str(xsl_path)}, "xml-to-json")
+
+
+@fixture
+def valid_xml():
+    return etree.parse("tests/sample_data/pbcore_xml/100-009w0w2t.xml")
+
+
+def touch(path):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+### TESTS ###
+
+
+def test_registry_compiles_once(registry, valid_xml):
+    registry.load()
+    for _ in range(5):
+        with registry.validator() as schema:
+            assert schema.validate(valid_xml)
+    assert registry._get().pool.created == 1
+
+
+def test_registry_fills_pool(registry):
+    registry.load(fill=True)
+    assert registry._get().pool.created == 2
+    with registry.validator() as first, registry.validator() as second:
+        assert first is not second
+    assert registry._get().pool.created == 2
+
+
+def test_registry_pools_concurrent_checkouts(registry):
+    with registry.validator() as first, registry.validator() as second:
+        assert first is not second
+    with registry.validator() as schema:
+        assert schema in (first, second)
+
+
+def test_registry_reloads_changed_schema(registry, valid_xml):
+    digest = registry.digest()
+    path = registry.paths["2.1"]
+    with open(path, "a") as f:
+        f.write("<!-- changed -->\n")
+    touch(path)
+
+    assert registry.digest() != digest
+    with registry.validator() as schema:
+        assert schema.validate(valid_xml)
+
+
+def test_registry_explicit_reload(registry):
+    before = registry._get()
+    registry.reload()
+    assert registry._get() is not before
+
+
+def test_stylesheet_registry_picks_up_edits(stylesheets, valid_xml):
+    with stylesheets.transform() as transform:
+        assert str(transform(valid_xml)).startswith('{"pbcoreDescriptionDocument":')
+
+    path = stylesheets.paths["xml-to-json"]
+    with open(path) as f:
+        content = f.read()
+    with open(path, "w") as f:
+        f.write(content.replace('{"pbcoreDescriptionDocument":', '{"record":'))
+    touch(path)
+
+    with stylesheets.transform() as transform:
+        assert str(transform(valid_xml)).startswith('{"record":')
@@ -0,0 +1,199 @@
+import io
+import json
+import zipfile
+
+from fastapi.testclient import TestClient
+from lxml import etree
+from pytest import mark
+
+from app import core
+from app.core import Engine
+from app.main import app
+from app.roundtrip import compare
+
+client = TestClient(app)
+
+VALID = "tests/sample_data/pbcore_xml/100-009w0w2t.xml"
+SUBELEMENTS = "tests/sample_data/pbcore_xml/subelements.xml"
+NS = b'xmlns="http://www.pbcore.org/PBCore/PBCoreNamespace.html"'
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def record(path):
+    return read(path).split(b"?>", 1)[1]
+
+
+def ndjson(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def roundtrip(files, **params):
+    response = client.post(
+        "/convert/roundtrip/xml-json/file", files=files, params=params
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    return ndjson(response)
+
+
+### TESTS ###
+
+
+@mark.parametrize("engine", list(Engine))
+def test_roundtrip_lossless(engine):
+    assert core.roundtrip(read(VALID), engine) == {
+        "identical": True,
+        "lossless": True,
+        "differences": [],
+    }
+
+
+def test_roundtrip_reports_lost_elements(monkeypatch):
+    # pbcoreRelation holds two type/identifier pairs, which the XSD doesn't
+    # allow and JSON can't hold.
+    relation = [
+        {
+            "path": "/pbcoreDescriptionDocument/pbcoreRelation[1]"
+            "/pbcoreRelationType[2]",
+            "change": "lost",
+        },
+        {
+            "path": "/pbcoreDescriptionDocument/pbcoreRelation[1]"
+            "/pbcoreRelationIdentifier[2]",
+            "change": "lost",
+        },
+    ]
+    result = core.roundtrip(read(SUBELEMENTS))
+    assert result["lossless"] is False
+    # The stylesheet's own tables don't make the rights repeatable either.
+    assert result["differences"] == relation + [
+        {"path": "/pbcoreDescriptionDocument/pbcoreRightsSummary[2]", "change": "lost"},
+        {
+            "path": "/pbcoreDescriptionDocument/pbcoreInstantiation[1]"
+            "/instantiationRights[2]",
+            "change": "lost",
+        },
+        {
+            "path": "/pbcoreDescriptionDocument/pbcoreInstantiation[2]"
+            "/instantiationRights[2]",
+            "change": "lost",
+        },
+    ]
+
+    monkeypatch.setattr("app.elements.DERIVED_ELEMENT_TABLES", True)
+    assert core.roundtrip(read(SUBELEMENTS))["differences"] == relation
+
+
+def test_compare():
+    original = etree.fromstring(
+        b"<pbcoreDescriptionDocument " + NS + b"><!-- comment -->"
+        b'<pbcoreTitle titleType="Series"> A\n  title </pbcoreTitle>'
+        b"<pbcoreIdentifier>1</pbcoreIdentifier>"
+        b"<pbcoreSubject>a</pbcoreSubject>"
+        b"</pbcoreDescriptionDocument>"
+    )
+    reordered = etree.fromstring(
+        b"<pbcoreDescriptionDocument " + NS + b">"
+        b"<pbcoreIdentifier>1</pbcoreIdentifier>"
+        b'<pbcoreTitle titleType="Series">A title</pbcoreTitle>'
+        b"<pbcoreSubject>a</pbcoreSubject>"
+        b"</pbcoreDescriptionDocument>"
+    )
+    assert compare(original, reordered) == {
+        "identical": False,
+        "lossless": True,
+        "differences": [],
+    }
+
+    altered = etree.fromstring(
+        b"<pbcoreDescriptionDocument " + NS + b">"
+        b'<pbcoreTitle titleType="Episode">A title</pbcoreTitle>'
+        b'<pbcoreIdentifier source="x"/>'
+        b"<pbcoreSubject>a</pbcoreSubject><pbcoreSubject>b</pbcoreSubject>"
+        b"</pbcoreDescriptionDocument>"
+    )
+    root = "/pbcoreDescriptionDocument"
+    assert compare(original, altered)["differences"] == [
+        {
+            "path": f"{root}/pbcoreTitle[1]/@titleType",
+            "change": "altered",
+            "expected": "Series",
+            "actual": "Episode",
+        },
+        {
+            "path": f"{root}/pbcoreIdentifier[1]/@source",
+            "change": "added",
+            "actual": "x",
+        },
+        {
+            "path": f"{root}/pbcoreIdentifier[1]/text()",
+            "change": "lost",
+            "expected": "1",
+        },
+        {"path": f"{root}/pbcoreSubject[2]", "change": "added"},
+    ]
+
+    result = compare(original, altered, limit=2)
+    assert len(result["differences"]) == 2
+    assert result["truncated"] is True
+
+
+def test_roundtrip_endpoint_document():
+    lines = roundtrip({"file": ("record.xml", read(VALID))})
+    assert lines == [
+        {
+            "index": 0,
+            "file": "record.xml",
+            "archive": None,
+            "identifier": "The Debt Culture",
+            "identical": True,
+            "lossless": True,
+            "differences": [],
+        },
+        {"summary": {"records": 1, "lossless": 1, "lossy": 0, "errors": 0}},
+    ]
+
+
+def test_roundtrip_endpoint_collection_archive():
+    pbcore_collection = (
+        b"<pbcoreCollection "
+        + NS
+        + b">"
+        + record(VALID) * 120
+        + record(SUBELEMENTS)
+        + b"</pbcoreCollection>"
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("dump/collection.xml", pbcore_collection)
+        archive.writestr("dump/record.xml", read(VALID))
+        archive.writestr("dump/broken.xml", b"<pbcoreDescriptionDocument>")
+        archive.writestr("dump/other.xml", b"<other/>")
+
+    lines = roundtrip(
+        {"file": ("dump.zip", buffer.getvalue())}, engine=Engine.native.value
+    )
+    summary = lines.pop()
+    assert summary == {
+        "summary": {"records": 124, "lossless": 121, "lossy": 1, "errors": 2}
+    }
+    assert sorted(line["index"] for line in lines) == list(range(124))
+    assert {line["archive"] for line in lines} == {"dump.zip"}
+    (lossy,) = [line for line in lines if line.get("lossless") is False]
+    assert lossy["index"] == 120
+    assert lossy["file"] == "dump/collection.xml"
+    errors = {line["file"]: line["error"] for line in lines if "error" in line}
+    assert errors["dump/broken.xml"].startswith("XML Parsing Error")
+    assert errors["dump/other.xml"] == "No pbcoreDescriptionDocument found"
+
+
+def test_roundtrip_endpoint_not_xml():
+    lines = roundtrip({"file": ("notes.txt", b"not xml")})
+    assert lines[0]["error"].startswith("XML Parsing Error")
+    assert lines[1] == {
+        "summary": {"records": 1, "lossless": 0, "lossy": 0, "errors": 1}
+    }
@@ -0,0 +1,271 @@
+import random
+
+from fastapi.testclient import TestClient
+from lxml import etree
+
+from app import core, sessions
+from app.main import app
+from app.sessions import PBCORE_NS, Sessions
+
+client = TestClient(app)
+
+VALID = "tests/sample_data/pbcore_xml/100-009w0w2t.xml"
+INVALID = "tests/sample_data/pbcore_xml/100-009w0w2t.invalid_coverage_type.xml"
+DOCUMENT = "/pbcoreDescriptionDocument"
+
+TITLE = f'<pbcoreTitle xmlns="{PBCORE_NS}">A new title</pbcoreTitle>'
+BAD_INSTANTIATION = (
+    f'<pbcoreInstantiation xmlns="{PBCORE_NS}">'
+    "<instantiationLocation>Shelf 3</instantiationLocation>"
+    "</pbcoreInstantiation>"
+)
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def create(path=VALID):
+    response = client.post("/validate/xml-sessions", files={"file": read(path)})
+    assert response.status_code == 201
+    return response.json()
+
+
+def patch(session, *patches, revision=None):
+    return client.patch(
+        f"/validate/xml-sessions/{session['session']}",
+        json={"patches": list(patches), "revision": revision},
+    )
+
+
+def document(session):
+    return client.get(f"/validate/xml-sessions/{session['session']}/document").content
+
+
+### TESTS ###
+
+
+def test_session_errors_match_full_validation():
+    session = create(INVALID)
+    report = core.validation_report(read(INVALID))
+    assert not session["valid"]
+    assert [error["message"] for error in session["errors"]] == [
+        error["message"] for error in report["errors"]
+    ]
+    assert session["errors"][0]["path"] == report["errors"][0]["path"]
+
+
+def test_patch_revalidates():
+    session = create()
+    assert session == {**session, "revision": 0, "valid": True}
+
+    response = patch(
+        session,
+        {
+            "op": "replace",
+            "path": f"{DOCUMENT}/pbcoreInstantiation[1]",
+            "xml": BAD_INSTANTIATION,
+        },
+    )
+    assert response.status_code == 200
+    result = response.json()
+    assert result["revision"] == 1
+    assert not result["valid"]
+    assert result["errors"][0]["path"] == (
+        f"{DOCUMENT}/pbcoreInstantiation[1]/instantiationLocation[1]"
+    )
+    assert not core.is_valid(document(session))
+
+    # Removing the only title breaks the document's own content model.
+    result = patch(session, {"op": "remove", "path": f"{DOCUMENT}/pbcoreTitle"}).json()
+    assert result["error_count"] == 2
+    assert result["errors"][0]["path"] == f"{DOCUMENT}/pbcoreDescription[1]"
+
+    result = patch(
+        session,
+        {"op": "insert", "path": f"{DOCUMENT}/pbcoreTitle[1]", "xml": TITLE},
+        {"op": "remove", "path": f"{DOCUMENT}/pbcoreInstantiation[1]"},
+    ).json()
+    assert result["valid"]
+    assert result["revision"] == 3
+    assert core.is_valid(document(session))
+
+
+def test_error_paths_follow_edits():
+    session = create()
+    patch(
+        session,
+        {
+            "op": "insert",
+            "path": f"{DOCUMENT}/pbcoreInstantiation[2]",
+            "xml": BAD_INSTANTIATION,
+        },
+    )
+    instantiation = read(VALID).split(b"<pbcoreInstantiation>")[1]
+    instantiation = instantiation.split(b"</pbcoreInstantiation>")[0]
+    result = patch(
+        session,
+        {
+            "op": "insert",
+            "path": f"{DOCUMENT}/pbcoreInstantiation[1]",
+            "xml": f'<pbcoreInstantiation xmlns="{PBCORE_NS}">'
+            f"{instantiation.decode()}</pbcoreInstantiation>",
+        },
+    ).json()
+    assert result["errors"][0]["path"].startswith(f"{DOCUMENT}/pbcoreInstantiation[3]/")
+
+
+def test_failed_patch_changes_nothing():
+    session = create()
+    before = document(session)
+    response = patch(
+        session,
+        {"op": "remove", "path": f"{DOCUMENT}/pbcoreDescription[1]"},
+        {"op": "remove", "path": f"{DOCUMENT}/pbcoreSubject[1]"},
+    )
+    assert response.status_code == 422
+    assert response.json()["detail"].startswith("Patch 2: No element at")
+    assert document(session) == before
+
+    for bad in (
+        {"op": "replace", "path": DOCUMENT, "xml": TITLE},
+        {"op": "insert", "path": f"{DOCUMENT}/pbcoreTitle[3]", "xml": TITLE},
+        {"op": "insert", "path": f"{DOCUMENT}/pbcoreSubject", "xml": TITLE},
+        {"op": "insert", "path": f"{DOCUMENT}/pbcoreTitle", "xml": "<pbcoreTitle/>"},
+        {"op": "insert", "path": f"{DOCUMENT}/pbcoreTitle", "xml": "<unclosed>"},
+        {"op": "remove", "path": "/pbcoreCollection/pbcoreTitle"},
+    ):
+        assert patch(session, bad).status_code == 422
+    assert client.get(f"/validate/xml-sessions/{session['session']}").json() == {
+        **session,
+        "revision": 0,
+    }
+
+
+def test_revision_conflict():
+    session = create()
+    remove = {"op": "remove", "path": f"{DOCUMENT}/pbcoreGenre[1]"}
+    assert patch(session, remove, revision=0).status_code == 200
+    response = patch(session, remove, revision=0)
+    assert response.status_code == 409
+    assert response.json()["detail"]["revision"] == 1
+
+
+def test_session_not_found():
+    session = create()
+    path = f"/validate/xml-sessions/{session['session']}"
+    assert client.delete(path).status_code == 204
+    assert client.get(path).status_code == 404
+    assert client.delete(path).status_code == 404
+    assert patch(session, {"op": "remove", "path": DOCUMENT}).status_code == 404
+
+
+def test_not_a_document():
+    response = client.post(
+        "/validate/xml-sessions",
+        files={"file": f'<pbcoreCollection xmlns="{PBCORE_NS}"/>'.encode()},
+    )
+    assert response.status_code == 422
+    response = client.post("/validate/xml-sessions", files={"file": b"not xml"})
+    assert response.status_code == 422
+
+
+def test_random_edits_agree_with_full_validation():
+    # Make random edits to the document's children, some of them breaking it,
+    # undoing each one after, and check the session against the whole document.
+    rng = random.Random(0)
+    root = etree.fromstring(read(VALID))
+    children = [
+        etree.tostring(child).decode() for child in root.iterchildren(tag=etree.Element)
+    ]
+    store = Sessions(10, 60)
+    session_id = store.create(etree.tostring(root))["session"]
+    validity = set()
+    for _ in range(60):
+        current = etree.fromstring(store.document(session_id))
+        names = [etree.QName(child).localname for child in current]
+        op = rng.choice(["replace", "insert", "remove"])
+        if op == "insert":
+            xml = rng.choice(children + [BAD_INSTANTIATION])
+            name = etree.QName(etree.fromstring(xml)).localname
+            position = rng.randint(1, names.count(name) + 1)
+        else:
+            name = rng.choice(names)
+            position = rng.randint(1, names.count(name))
+            old = current.findall(f"{{{PBCORE_NS}}}{name}")[position - 1]
+            xml = etree.tostring(old).decode()
+        path = f"{DOCUMENT}/{name}[{position}]"
+        if op == "insert":
+            edits = [{"op": "insert", "xml": xml}, {"op": "remove"}]
+        elif op == "remove":
+            edits = [{"op": "remove"}, {"op": "insert", "xml": xml}]
+        else:
+            broken = etree.fromstring(xml)
+            broken.set("bogus", "attribute")
+            edits = [
+                {"op": "replace", "xml": etree.tostring(broken).decode()},
+                {"op": "replace", "xml": xml},
+            ]
+        for edit in edits:
+            result = store.patch(session_id, [{**edit, "path": path}])
+            assert result["valid"] == core.is_valid(store.document(session_id))
+            validity.add(result["valid"])
+    assert validity == {True, False}
+
+
+def test_sessions_shared_between_workers(tmp_path, monkeypatch):
+    monkeypatch.setattr(sessions, "SNAPSHOT_EVERY", 3)
+    path = str(tmp_path / "sessions.sqlite3")
+    worker_1, worker_2 = Sessions(10, 60, path), Sessions(10, 60, path)
+    session_id = worker_1.create(read(VALID))["session"]
+
+    remove = {"op": "remove", "path": f"{DOCUMENT}/pbcoreDescription[1]"}
+    assert worker_2.patch(session_id, [remove])["revision"] == 1
+    assert worker_1.patch(session_id, [remove])["revision"] == 2
+    result = worker_2.report(session_id)
+    assert result["revision"] == 2
+    assert not result["valid"]
+
+    # The third revision is stored as a snapshot and its patches dropped, so a
+    # worker that hasn't seen it starts from the snapshot.
+    insert = {
+        "op": "insert",
+        "path": f"{DOCUMENT}/pbcoreDescription",
+        "xml": (
+            f'<pbcoreDescription xmlns="{PBCORE_NS}">Back again</pbcoreDescription>'
+        ),
+    }
+    assert worker_1.patch(session_id, [insert])["valid"]
+    worker_3 = Sessions(10, 60, path)
+    assert worker_3.report(session_id) == worker_2.report(session_id)
+    assert worker_3.document(session_id) == worker_1.document(session_id)
+
+    worker_2.delete(session_id)
+    for worker in (worker_1, worker_3):
+        try:
+            worker.report(session_id)
+        except sessions.SessionNotFound:
+            continue
+        raise AssertionError("Session not deleted")
+
+
+def test_shared_session_expires(tmp_path, monkeypatch):
+    path = str(tmp_path / "sessions.sqlite3")
+    worker_1, worker_2 = Sessions(10, 60, path), Sessions(10, 60, path)
+    monkeypatch.setattr("app.main.sessions", worker_2)
+    session = worker_1.create(read(VALID))
+    url = f"/validate/xml-sessions/{session['session']}"
+    assert client.get(url).status_code == 200
+
+    # Unused for longer than the TTL, by any worker.
+    with worker_1.store.db.connection() as db:
+        db.execute("UPDATE sessions SET used = used - 61")
+    assert client.get(url).status_code == 404
+    assert patch(session, {"op": "remove", "path": DOCUMENT}).status_code == 404
+    # A worker holding it in memory finds it gone too.
+    try:
+        worker_1.report(session["session"])
+    except sessions.SessionNotFound:
+        return
+    raise AssertionError("Session not expired")
@@ -0,0 +1,120 @@
+import csv
+import io
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.tabular import layout
+
+client = TestClient(app)
+
+VALID = "tests/sample_data/pbcore_xml/100-009w0w2t.xml"
+PBCORE_NS = "http://www.pbcore.org/PBCore/PBCoreNamespace.html"
+
+
+def record():
+    with open(VALID, "rb") as f:
+        return f.read().split(b"?>", 1)[1]
+
+
+def make_collection(*records):
+    return (
+        f'<pbcoreCollection xmlns="{PBCORE_NS}">'.encode()
+        + b"".join(records)
+        + b"</pbcoreCollection>"
+    )
+
+
+def table(content, name):
+    response = client.post(
+        f"/convert/xml-to-table-file?table={name}", files={"file": content}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    return list(csv.DictReader(io.StringIO(response.text)))
+
+
+### TESTS ###
+
+
+def test_tables():
+    # A second record with two essence tracks.
+    second = record().replace(
+        b"<instantiationEssenceTrack>",
+        b'<instantiationEssenceTrack source="x">'
+        b"<essenceTrackType>Audio</essenceTrackType></instantiationEssenceTrack>"
+        b'<instantiationEssenceTrack source="x">',
+        1,
+    )
+    content = make_collection(record(), second)
+
+    assets = table(content, "assets")
+    assert [row["record"] for row in assets] == ["0", "1"]
+    assert assets[0]["asset_identifier"] == "The Debt Culture"
+    # Repeated elements share a cell, and their attributes line up with them.
+    assert assets[0]["pbcoreIdentifier"] == "The Debt Culture | cpb-aacip/100-009w0w2t"
+    assert (
+        assets[0]["pbcoreIdentifier@source"]
+        == "WYSU | http://americanarchiveinventory.org"
+    )
+    assert assets[0]["pbcoreTitle@titleType"] == "Program"
+    assert (
+        assets[0]["pbcoreAnnotation@annotationType"] == "last_modified | organization"
+    )
+    assert assets[0]["pbcoreIdentifier@ref"] == ""
+    assert assets[0]["pbcoreCreator/creatorRole"] == "Producing Organization"
+    assert not any(column.startswith("pbcoreInstantiation") for column in assets[0])
+
+    instantiations = table(content, "instantiations")
+    assert [(row["record"], row["instantiation"]) for row in instantiations] == [
+        ("0", "0"),
+        ("1", "0"),
+    ]
+    assert instantiations[0]["instantiationDuration"] == "00:03:00"
+    assert not any("EssenceTrack" in column for column in instantiations[0])
+
+    tracks = table(content, "essence_tracks")
+    assert [
+        (row["record"], row["essence_track"], row["essenceTrackType"], row["@source"])
+        for row in tracks
+    ] == [
+        ("0", "0", "General", ""),
+        ("1", "0", "Audio", "x"),
+        ("1", "1", "General", "x"),
+    ]
+
+
+def test_columns_from_element_tables():
+    columns = layout("essence_tracks").columns
+    assert columns[:4] == ("@source", "@ref", "@version", "@annotation")
+    assert "essenceTrackEncoding@source" in columns
+    assert "essenceTrackAnnotation@annotationType" in columns
+    assert len(columns) == len(set(columns))
+
+
+def test_parquet():
+    parquet = pytest.importorskip("pyarrow.parquet")
+    content = make_collection(record(), record())
+    response = client.post(
+        "/convert/xml-to-table-file?table=instantiations&format=parquet",
+        files={"file": content},
+    )
+    assert response.status_code == 200
+    rows = parquet.read_table(io.BytesIO(response.content)).to_pylist()
+    assert [row["record"] for row in rows] == [0, 1]
+    assert rows[1]["instantiationLocation"] == "WYSU Archive"
+    assert rows[1]["instantiationPhysical"] is None
+
+
+def test_bad_requests(monkeypatch):
+    response = client.post("/convert/xml-to-table-file", files={"file": b"<oops"})
+    assert response.status_code == 422
+    assert response.json()["detail"].startswith("XML Parsing Error")
+
+    monkeypatch.setattr("app.tabular.pyarrow", None)
+    response = client.post(
+        "/convert/xml-to-table-file?format=parquet",
+        files={"file": make_collection(record())},
+    )
+    assert response.status_code == 422
@@ -0,0 +1,121 @@
+import asyncio
+import gzip
+
+import httpx
+from fastapi.testclient import TestClient
+
+from app.executor import work_pool
+from app.main import app
+
+client = TestClient(app)
+
+VALID = "tests/sample_data/pbcore_xml/100-009w0w2t.xml"
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+### TESTS ###
+
+
+def test_gzipped_upload():
+    content = read(VALID)
+    response = client.post(
+        "/validate/xml-file", files={"file": ("record.xml.gz", gzip.compress(content))}
+    )
+    assert response.json() == {"valid": True, "file": "record.xml.gz"}
+
+    plain = client.post("/convert/xml-to-json-file", files={"file": content})
+    gzipped = client.post(
+        "/convert/xml-to-json-file", files={"file": gzip.compress(content)}
+    )
+    assert gzipped.status_code == 200
+    assert gzipped.content == plain.content
+    # The cache key is the decompressed content's.
+    assert gzipped.headers["ETag"] == plain.headers["ETag"]
+
+
+def test_upload_too_large(monkeypatch):
+    content = read(VALID)
+    monkeypatch.setattr("app.upload.MAX_UPLOAD_SIZE", len(content) - 1)
+    for upload in (content, gzip.compress(content)):
+        response = client.post("/validate/xml-file", files={"file": upload})
+        assert response.status_code == 413
+
+    # Rejected by its Content-Length, before any of it is read.
+    monkeypatch.setattr("app.upload.MAX_UPLOAD_SIZE", 1)
+    response = client.post("/validate/xml-file", files={"file": b" " * 2**17})
+    assert response.status_code == 413
+
+    # A gzip bomb is stopped well before it is inflated whole.
+    monkeypatch.setattr("app.upload.MAX_UPLOAD_SIZE", 2**20)
+    bomb = gzip.compress(b"<a>" + b" " * 2**25 + b"</a>")
+    response = client.post("/convert/xml-to-json-file", files={"file": bomb})
+    assert response.status_code == 413
+
+
+def test_bad_uploads():
+    response = client.post("/validate/xml-file", files={"other": read(VALID)})
+    assert response.status_code == 422
+    assert response.json()["detail"] == "No file uploaded as 'file'"
+
+    truncated = gzip.compress(read(VALID))[:100]
+    response = client.post("/validate/xml-file", files={"file": truncated})
+    assert response.status_code == 422
+    assert response.json()["detail"].startswith("Invalid gzip data")
+
+    response = client.post(
+        "/validate/xml-file",
+        content=read(VALID),
+        headers={"Content-Type": "application/xml"},
+    )
+    assert response.status_code == 422
+
+
+def test_stalled_upload_does_not_block_others(monkeypatch):
+    monkeypatch.setattr(work_pool, "max_workers", 1)
+    monkeypatch.setattr(work_pool, "max_queue", 0)
+    content = read(VALID)
+    head = (
+        b"--boundary\r\n"
+        b'Content-Disposition: form-data; name="file"; filename="slow.xml"\r\n\r\n'
+    )
+    tail = b"\r\n--boundary--\r\n"
+
+    async def scenario():
+        resume = asyncio.Event()
+
+        async def slow_body():
+            yield head + content[:100]
+            await resume.wait()
+            yield content[100:] + tail
+
+        transport = httpx.ASGITransport(app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            slow = asyncio.ensure_future(
+                client.post(
+                    "/validate/xml-file",
+                    content=slow_body(),
+                    headers={"Content-Type": "multipart/form-data; boundary=boundary"},
+                )
+            )
+            while not work_pool.feeding:
+                await asyncio.sleep(0.001)
+            other = await client.post("/validate/xml-file", files={"file": content})
+            assert other.status_code == 200
+            assert not slow.done()
+            resume.set()
+            return await slow
+
+    response = asyncio.run(scenario())
+    assert response.json() == {"valid": True, "file": "slow.xml"}
+
+
+def test_upload_documented():
+    schema = client.get("/openapi.json").json()
+    body = schema["paths"]["/validate/xml-file"]["post"]["requestBody"]
+    assert body["content"]["multipart/form-data"]["schema"]["required"] == ["file"]